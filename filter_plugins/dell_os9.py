@@ -1,4 +1,18 @@
+import bisect
+import collections
+import contextlib
+import enum
+import fnmatch
+import functools
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import pickle
 import re
+import time
+import tracemalloc
 
 physical_interface_types = [
     "gigabitethernet",
@@ -16,42 +30,251 @@ lag_interface_types = [
     "port-channel"
 ]
 
-def OS9_PARSEINTFRANGE(s, sw_config):
-    output = []  # output list will store all interfaces in the range
+range_line_keys = [
+    "untagged",
+    "tagged",
+    "channel-member"
+]
 
-    s_parts = s.split(" ")  # Split input string into type and range parts
-    s_type = s_parts[0]
-    s_range_str = s_parts[1]
+# VLAN interface lines that stay in a block per VLAN when VLANs are joined into ranges, see OS9_VLANRANGECFG
+vlan_label_lines = ("name ", "description ", "no name", "no description")
 
-    s_rangelist = s_range_str.split(",")  # split by commas
+# Fewest consecutive VLANs that are joined into an "interface range vlan" block
+vlan_range_min = 2
 
-    for range in s_rangelist:
-        range_parts = range.split("-")  # split by dashes
-        if len(range_parts) == 1:
-            output.append(f"{s_type} {range}")  # no range here
-        else:
-            # this is a range (-)
-            range_0 = range_parts[0]
-            range_1 = range_parts[1]
+# Global settings of OS9_SYSTEMCFG, setting -> running config line
+system_setting_lines = {
+    "hostname": "hostname {}",
+    "ssh_connection_rate_limit": "ip ssh connection-rate-limit {}"
+}
+
+# Spanning tree protocols, only one of them is enabled at a time (setting "stp_protocol" of OS9_SYSTEMCFG)
+stp_protocols = ["rstp", "pvst", "mstp"]
 
-            storing = False
-            for line in sw_config:
-                if line.startswith(f"interface {s_type} {range_0}"):
-                    # found range_0
-                    storing = True
+# Subport type of a "quad" fanout per speed, used to predict the config after a fanout change
+fanout_child_types = {
+    "10G": "TenGigabitEthernet",
+    "25G": "twentyFiveGigE"
+}
 
-                if storing and line.startswith("interface"):
-                    line_parts = line.split(" ")
-                    intf_label = " ".join(line_parts[1:])
-                    output.append(intf_label)
+# Body of a defaulted physical interface in the running config
+default_intf_lines = [
+    "no ip address",
+    "shutdown"
+]
 
-                if line.startswith(f"interface {s_type} {range_1}"):
-                    # found range_1
-                    break
+# Lines of a physical port outside the manifest that OS9_CLEANINTF leaves alone: the default body and the admin
+# state, a port without switchport or address carries no traffic either way
+clean_ignored_lines = default_intf_lines + ["no shutdown"]
 
-    return output
+# Parsed configs are cached per process, keyed by a hash of the config text, so the filters can reuse them
+parse_cache_size = int(os.environ.get("OS9_PARSE_CACHE_SIZE", "16"))
+parse_cache = collections.OrderedDict()
+parse_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "disk_hits": 0
+}
+
+# Ansible templates every task in a new worker process, so the parsed configs are also kept on disk for the next
+# task of the same switch, see os9_diskcache_load. Empty disables it.
+parse_cache_dir = os.environ.get("OS9_PARSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "os9-parse"))
+parse_cache_files = int(os.environ.get("OS9_PARSE_CACHE_FILES", "64"))
+
+# A parsed config on disk is only valid for the filters that wrote it
+with open(__file__, "rb") as plugin_file:
+    plugin_hash = hashlib.sha256(plugin_file.read()).hexdigest()[:16]
+
+# Worker processes OS9_GETCONFIG generates the interface config with, 0 or 1 plans serially, see os9_generateparallel
+plan_workers = int(os.environ.get("OS9_PLAN_WORKERS", "0"))
+
+# Interfaces below this number are always planned serially, starting the workers costs more than it saves
+plan_parallel_min = 64
+
+# Bump this when a change to the filters makes the fingerprints of earlier runs invalid, see os9_fingerprints
+fingerprint_version = 1
+
+# Bump this when the layout of the compiled manifest changes, see OS9_COMPILEMANIFEST
+compiled_manifest_version = 1
+
+# Opt-in instrumentation of the filters, see OS9Profile
+profile_dir = os.environ.get("OS9_PROFILE_DIR")
+active_profile = None
+
+class OS9Profile(object):
+    """
+    Wall time and call count per stage, counters and peak memory (tracemalloc) of a single filter call
+    Stage times are inclusive, so nested stages (e.g. vlan_cleanup inside generate) are also counted in the outer one
+    """
+
+    def __init__(self, filter_name):
+        self.filter_name = filter_name
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counters = collections.Counter()
+        self.seconds = 0
+        self.peak_bytes = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stats = self.stages.setdefault(name, [0, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats[0] += time.perf_counter() - start
+            stats[1] += 1
+
+    def run(self, filter_func, *args, **kwargs):
+        """
+        Runs the filter while tracing memory
+
+        :param filter_func: Filter function
+        :type filter_func: callable
+        :return: Result of the filter
+        """
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            return filter_func(*args, **kwargs)
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+    def to_dict(self):
+        return {
+            "seconds": round(self.seconds, 6),
+            "peak_bytes": self.peak_bytes,
+            "stages": {name: {"seconds": round(seconds, 6), "calls": calls} for name, (seconds, calls) in self.stages.items()},
+            "counters": dict(self.counters),
+            "parse_cache": OS9_CACHESTATS()
+        }
+
+    def write(self, profile, sw_config):
+        """
+        Adds the results to the JSON file of the switch, which holds the last result of every filter
+
+        :param profile: Path of the JSON file, or a directory to write HOSTNAME.json to
+        :type profile: str
+        :param sw_config: Switch facts, the hostname is taken from the running config
+        :type sw_config: dict
+        """
+
+        if not profile.endswith(".json"):
+            hostname = "unknown"
+            for block in OS9_PARSECONFIG(sw_config).iter_blocks(["hostname "]):
+                hostname = block.header.split(" ")[1]
+
+            os.makedirs(profile, exist_ok=True)
+            profile = os.path.join(profile, f"{hostname}.json")
+
+        results = {}
+        if os.path.exists(profile):
+            with open(profile) as f:
+                results = json.load(f)
+
+        results[self.filter_name] = self.to_dict()
+
+        with open(profile, "w") as f:
+            json.dump(results, f, indent=2)
+
+def profile_stage(name):
+    """
+    Times a stage of the active profile, this does nothing when profiling is off
+
+    :param name: Name of the stage
+    :type name: str
+    :return: Context manager
+    """
+
+    if active_profile is None:
+        return contextlib.nullcontext()
+
+    return active_profile.stage(name)
+
+def profile_count(name):
+    """
+    Increments a counter of the active profile, this does nothing when profiling is off
+
+    :param name: Name of the counter
+    :type name: str
+    """
+
+    if active_profile is not None:
+        active_profile.counters[name] += 1
+
+def profiled(filter_func):
+    """
+    Adds the profile argument to a filter
+    When profile (or the OS9_PROFILE_DIR environment variable) is set, the filter call is profiled and the results
+    are written to a JSON file per switch. Filters called by a profiled filter are part of its profile.
+
+    :param filter_func: Filter function, the first argument must be the switch facts
+    :type filter_func: callable
+    :return: Filter function
+    :rtype: callable
+    """
+
+    @functools.wraps(filter_func)
+    def wrapper(sw_config, *args, profile=None, **kwargs):
+        global active_profile
+
+        if profile is None:
+            profile = profile_dir
+
+        if not profile or active_profile is not None:
+            return filter_func(sw_config, *args, **kwargs)
+
+        cur_profile = OS9Profile(filter_func.__name__)
+        active_profile = cur_profile
+        try:
+            result = cur_profile.run(filter_func, sw_config, *args, **kwargs)
+        finally:
+            active_profile = None
+
+        cur_profile.write(profile, sw_config)
+
+        return result
+
+    return wrapper
+
+def OS9_PARSEINTFRANGE(s, sw_config):
+    """
+    Expands an OS9 interface range (e.g. "TenGigabitEthernet 1/1-1/4,1/7") into single interfaces
+
+    :param s: Interface range
+    :type s: str
+    :param sw_config: Parsed switch config (a list of lines is parsed first)
+    :type sw_config: OS9ConfigTree
+    :return: List of interface labels in the range
+    :rtype: list
+    """
+
+    if not isinstance(sw_config, OS9ConfigTree):
+        sw_config = OS9ConfigTree(sw_config)
+
+    return list(OS9IntfRange(sw_config, s))
 
 def OS9_GETEXTENDEDCFG(sw_config):
+    """
+    Returns the config lines with every tagged/untagged/channel-member range expanded to one line per interface
+    This is only kept for backwards compatibility, the filters use the ranges in OS9ConfigTree directly
+
+    :param sw_config: Switch configuration lines
+    :type sw_config: list
+    :return: Expanded switch configuration lines
+    :rtype: list
+    """
+
+    sw_tree = OS9ConfigTree(sw_config)
+
     output = []
 
     for line in sw_config:
@@ -62,9 +285,9 @@ def OS9_GETEXTENDEDCFG(sw_config):
         num_spaces = line_parts.count("")
         line_header = line_parts[num_spaces]
 
-        if line_header == "untagged" or line_header == "tagged" or line_header == "channel-member":  #! any others?
+        if line_header in range_line_keys:
             range_str = " ".join(line_parts[num_spaces + 1:])
-            intf_list = OS9_PARSEINTFRANGE(range_str, sw_config)
+            intf_list = OS9IntfRange(sw_tree, range_str)
             cfg_list = [f'{" " * num_spaces}{line_header} {i}' for i in intf_list]
             output += cfg_list
         else:
@@ -72,462 +295,992 @@ def OS9_GETEXTENDEDCFG(sw_config):
 
     return output
 
-def OS9_GETINTFCONFIG(intf, sw_config):
-    output = []
+def normalize_header(line):
+    """
+    Normalizes a config block header so lookups don't depend on case or spacing
 
-    search_label = f"interface {intf}"
-    recording = False
-    for line in sw_config:
-        if line == search_label:
-            recording = True
-            continue
+    :param line: Header line (e.g. "interface TenGigabitEthernet 1/1")
+    :type line: str
+    :return: Normalized header
+    :rtype: str
+    """
 
-        if recording and not line.startswith(" "):
-            break
+    return " ".join(line.split()).lower()
 
-        if recording:
-            output.append(line.strip())
+class OS9IntfType(enum.IntEnum):
+    """
+    Canonical interface types, interfaces of different types sort in this order
+    """
 
-    return output
+    GIGABITETHERNET = 1
+    TENGIGABITETHERNET = 2
+    TWENTYFIVEGIGE = 3
+    FORTYGIGE = 4
+    FIFTYGIGE = 5
+    HUNDREDGIGE = 6
+    PORT_CHANNEL = 7
+    VLAN = 8
+    MANAGEMENTETHERNET = 9
+    LOOPBACK = 10
+    OTHER = 11  # anything else, told apart by its lowercase type name
+
+# Spelling of each type in the running config, used for canonical labels
+intf_type_names = {
+    OS9IntfType.GIGABITETHERNET: "GigabitEthernet",
+    OS9IntfType.TENGIGABITETHERNET: "TenGigabitEthernet",
+    OS9IntfType.TWENTYFIVEGIGE: "twentyFiveGigE",
+    OS9IntfType.FORTYGIGE: "fortyGigE",
+    OS9IntfType.FIFTYGIGE: "fiftyGigE",
+    OS9IntfType.HUNDREDGIGE: "hundredGigE",
+    OS9IntfType.PORT_CHANNEL: "Port-channel",
+    OS9IntfType.VLAN: "Vlan",
+    OS9IntfType.MANAGEMENTETHERNET: "ManagementEthernet",
+    OS9IntfType.LOOPBACK: "Loopback"
+}
+
+# Lowercase type names and OS9 short forms (as in "show interfaces status") -> type
+intf_type_spellings = {name.lower(): intf_type for intf_type, name in intf_type_names.items()}
+intf_type_spellings.update({
+    "gi": OS9IntfType.GIGABITETHERNET,
+    "te": OS9IntfType.TENGIGABITETHERNET,
+    "tf": OS9IntfType.TWENTYFIVEGIGE,
+    "fo": OS9IntfType.FORTYGIGE,
+    "hu": OS9IntfType.HUNDREDGIGE,
+    "po": OS9IntfType.PORT_CHANNEL,
+    "vl": OS9IntfType.VLAN,
+    "ma": OS9IntfType.MANAGEMENTETHERNET,
+    "lo": OS9IntfType.LOOPBACK
+})
+
+physical_intf_types = frozenset(intf_type_spellings[i] for i in physical_interface_types)
+vlan_intf_types = frozenset(intf_type_spellings[i] for i in vlan_interface_types)
+lag_intf_types = frozenset(intf_type_spellings[i] for i in lag_interface_types)
+
+intf_label_re = re.compile(r"^\s*([A-Za-z][A-Za-z-]*?)\s*(\d+(?:/\d+)*)\s*$")
+
+# Interned interface IDs, see intf_id
+intf_ids = {}  # label as written -> OS9IntfId (or None if it isn't an interface label)
+intf_ids_canonical = {}  # (type, type name, numbers) -> OS9IntfId
+
+@functools.total_ordering
+class OS9IntfId(object):
+    """
+    Canonical identifier of an interface, a type and its numbers (unit, port and fanout subport for physical
+    interfaces, the number for logical ones). IDs are interned, so every spelling of an interface ("Te 1/1",
+    "tengigabitethernet 1/1", "TenGigabitEthernet 1/1") is the same object. They sort by type, then numerically
+    (1/2 before 1/10). Use intf_id to get one.
+    """
 
-def OS9_GENERATEINTFCONFIG(intf_label, intf_fields, sw_config, managed_vlan_list, default_list):
+    __slots__ = ["type", "numbers", "label", "key", "_hash"]
+
+    def __init__(self, intf_type, type_name, numbers):
+        """
+        :param intf_type: Canonical type
+        :type intf_type: OS9IntfType
+        :param type_name: Type as written, only used for OTHER
+        :type type_name: str
+        :param numbers: Interface numbers
+        :type numbers: tuple
+        """
+
+        self.type = intf_type
+        self.numbers = numbers
+        self.label = f"{intf_type_names.get(intf_type, type_name)} {'/'.join(map(str, numbers))}"
+        self.key = (intf_type, type_name.lower() if intf_type == OS9IntfType.OTHER else "", numbers)
+        self._hash = hash(self.key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, OS9IntfId) and self.key == other.key)
+
+    def __lt__(self, other):
+        if not isinstance(other, OS9IntfId):
+            return NotImplemented
+
+        return self.key < other.key
+
+    def __reduce__(self):
+        # the hash of the key differs per process, so an unpickled ID is interned again
+        return intf_id_from_parts, (self.label.rsplit(" ", 1)[0], self.numbers)
+
+    def __str__(self):
+        return self.label
+
+    def __repr__(self):
+        return f"OS9IntfId({self.label!r})"
+
+def intf_id_from_parts(type_name, numbers):
+    """
+    Returns the interned ID of an interface from its already split type and numbers
+
+    :param type_name: Type in any spelling (e.g. "Te")
+    :type type_name: str
+    :param numbers: Interface numbers
+    :type numbers: tuple
+    :return: Interface ID
+    :rtype: OS9IntfId
     """
-    This will generate a sequence of OS9 commands for a single interface based on existing and manifest config.
 
-    :param intf_label: Name of interface
+    intf_type = intf_type_spellings.get(type_name.lower(), OS9IntfType.OTHER)
+    canonical_key = (intf_type, type_name.lower() if intf_type == OS9IntfType.OTHER else "", numbers)
+
+    result = intf_ids_canonical.get(canonical_key)
+    if result is None:
+        result = OS9IntfId(intf_type, type_name, numbers)
+        intf_ids_canonical[canonical_key] = result
+
+    return result
+
+def intf_id(intf_label):
+    """
+    Parses an interface label in any spelling of the manifest, the running config or the OS9 short forms
+    Every label is only parsed once per process.
+
+    :param intf_label: Interface label (e.g. "TenGigabitEthernet 1/1" or "Te 1/1")
     :type intf_label: str
-    :param intf_fields: Fields from manifest of interface
-    :type intf_fields: str
-    :param sw_config: Switch configuration lines
-    :type sw_config: list
-    :return list of os9 commands:
-    :rtype: list
+    :return: Interned interface ID, or None if it isn't an interface label
+    :rtype: OS9IntfId
     """
-    def os9_searchconfig(sw_config, search_keys, line_keys, intf_search):
-        """
-        Searches through config lines for specific subitem "line keys" from parent "search keys"
-        This is useful for finding existing VLAN/LACP mappins since OS9 does it backwards
 
-        :param sw_config: Switch configuration lines
-        :type sw_config: list
-        :param search_keys: List of parent keys to find in the config
-        :type search_keys: list
-        :param line_keys: List of subitem items to find below the parent (no leading spaces)
-        :type line_keys: list
-        :param intf_search: name of interface to match
-        :type intf_search: str
-        :return: List of parents found that match a all keys
-        :rtype: list
-        """
-        out = []
+    try:
+        return intf_ids[intf_label]
+    except KeyError:
+        pass
 
-        search_keys = ["interface " + i for i in search_keys]
+    match = intf_label_re.match(intf_label)
+    if match is None:
+        result = None
+    else:
+        result = intf_id_from_parts(match.group(1), tuple(int(i) for i in match.group(2).split("/")))
 
-        cur_line = ""
-        for line in sw_config:
-            line_str = line.strip()
-            if line_str.lower().startswith(tuple(search_keys)):
-                cur_line = line
-            elif line_str.startswith("interface") and cur_line != "":
-                cur_line = ""
+    intf_ids[intf_label] = result
 
-            if line_str.startswith(tuple(line_keys)) and cur_line != "":
-                line_parts = line_str.split(" ")
+    return result
 
-                if line_parts[0].lower() == "port-channel":
-                    # port channel is part of the name so that has to stay
-                    line_intf_label = " ".join(line_parts[:2])
-                else:
-                    line_intf_label = " ".join(line_parts[1:])
+def intf_key(intf_label):
+    """
+    Index key of an interface label, its ID or the normalized label if it can't be parsed
 
-                parent_label = " ".join(cur_line.split(" ")[1:3])
+    :param intf_label: Interface label
+    :type intf_label: str
+    :return: Interface ID or normalized label
+    :rtype: OS9IntfId or str
+    """
 
-                if line_intf_label.lower() == intf_search.lower():
-                    # found interface
-                    out.append(parent_label)
+    result = intf_id(intf_label)
+    if result is None:
+        return normalize_header(intf_label)
 
-        return out
+    return result
 
-    def os9_name(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "name" attribute (only for VLAN interfaces)
+# Lines of the running config, as indent and the rest of the line
+config_line_re = re.compile(r"^( *)([^\n]*)", re.M)
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set name
-        :rtype: list
-        """
+# Top level lines of the running config, the headers of the top level blocks ("!" lines don't end a block)
+config_header_re = re.compile(r"^[^ \n!][^\n]*", re.M)
 
-        out = []
+class OS9ConfigBlock(object):
+    """
+    A single block of the running config, made of a header line and its indented children
+    The children are kept as offsets into the config text and only split into lines when they are used.
+    """
 
-        if "name" in man_fields:
-            # Name attribute exists in the manifest
-            conf_line = f"name {man_fields['name']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+    __slots__ = ["text", "header", "indent", "start", "end"]
 
-        elif any(item.startswith("name") for item in running_fields) and not default_port:
-            # Name attribute exists on the switch, but shouldn't
-            out.append("no name")
+    def __init__(self, text, header, indent, start, end):
+        """
+        :param text: Running config text
+        :type text: str
+        :param header: Stripped header line
+        :type header: str
+        :param indent: Indent of the header line
+        :type indent: int
+        :param start: Offset of the first child line in text
+        :type start: int
+        :param end: Offset after the last child line in text
+        :type end: int
+        """
 
-        return out
+        self.text = text
+        self.header = header
+        self.indent = indent
+        self.start = start
+        self.end = end
 
-    def os9_description(man_fields, running_fields, default_port):
+    def _iter_lines(self):
+        # (indent, stripped line, offset of the line, offset after the line) of all children
+        for match in config_line_re.finditer(self.text, self.start, self.end):
+            line_str = match.group(2)
+            if line_str == "" or (match.group(1) == "" and line_str.startswith("!")):
+                continue
+
+            yield len(match.group(1)), line_str.rstrip(), match.start(), match.end()
+
+    @property
+    def lines(self):
         """
-        Create OS9 commands for "description" attribute
+        Stripped lines of all children, in config order (a new list on every use)
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set description
         :rtype: list
         """
 
-        out = []
-
-        if "description" in man_fields:
-            # Description attribute exists in the manifest
-            conf_line = f"description {man_fields['description']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
-
-        elif any(item.startswith("description") for item in running_fields) and not default_port:
-            # Description attribute exists on the switch, but shouldn't
-            out.append("no description")
-
-        return out
+        return [line_str for _, line_str, _, _ in self._iter_lines()]
 
-    def os9_state(man_fields, running_fields, default_port):
+    @property
+    def children(self):
         """
-        Create OS9 commands for "state" attribute
+        Nested blocks (e.g. "port-channel-protocol LACP"), in config order
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set state
         :rtype: list
         """
 
         out = []
 
-        # Create a no prefix based on manifest value
-        if "state" in man_fields and man_fields["state"] == "up":
-            no_str = "no "
-        else:
-            no_str = ""
+        for indent, line_str, line_start, line_end in self._iter_lines():
+            if len(out) > 0 and indent > out[-1].indent:
+                # nested in the previous child
+                continue
 
-        conf_line = f"{no_str}shutdown"
-        if conf_line not in running_fields or default_port:
-            out.append(conf_line)  # add to out only if not already in switch conf
+            if len(out) > 0:
+                out[-1].end = line_start
+
+            out.append(OS9ConfigBlock(self.text, line_str, indent, line_end, self.end))
 
         return out
 
-    def os9_mtu(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "mtu" attribute
+class OS9IntfState(object):
+    """
+    Attributes of a single interface in the running config, parsed once from the lines of its block
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set mtu
-        :rtype: list
+    Free text (name, description) is kept apart from the other attributes, so a description can't make
+    an attribute look like it's set.
+    """
+
+    __slots__ = [
+        "name",  # str or None
+        "description",  # str or None
+        "shutdown",  # True for "shutdown", False for "no shutdown", None if neither
+        "mtu",  # str or None
+        "portmode_hybrid",  # bool
+        "switchport",  # bool
+        "ip4",  # list of "ip address" values
+        "ip6",  # list of "ipv6 address" values
+        "stp_disabled",  # bool, "no spanning-tree"
+        "stp_edgeport",  # dict of STP type -> full edge-port line
+        "stp_bpduguard",  # bool, any edge-port line with bpduguard
+        "stp_rootguard",  # set of STP types
+        "stp_loopguard",  # set of STP types
+        "lacp",  # bool, "port-channel-protocol LACP"
+        "lacp_fast_switchover",  # bool
+        "vlt_peer_lag",  # str or None
+        "fec",  # full fec line or None
+        "autoneg"  # full negotiation/autoneg line or None
+    ]
+
+    def __init__(self, lines=()):
+        """
+        :param lines: Stripped lines of the interface block
+        :type lines: list
         """
 
-        out = []
+        self.name = None
+        self.description = None
+        self.shutdown = None
+        self.mtu = None
+        self.portmode_hybrid = False
+        self.switchport = False
+        self.ip4 = []
+        self.ip6 = []
+        self.stp_disabled = False
+        self.stp_edgeport = {}
+        self.stp_bpduguard = False
+        self.stp_rootguard = set()
+        self.stp_loopguard = set()
+        self.lacp = False
+        self.lacp_fast_switchover = False
+        self.vlt_peer_lag = None
+        self.fec = None
+        self.autoneg = None
+
+        for line in lines:
+            self._parse_line(line)
+
+    def _parse_line(self, line):
+        if line.startswith("name "):
+            self.name = line[len("name "):]
+        elif line.startswith("description "):
+            self.description = line[len("description "):]
+        elif line == "shutdown":
+            self.shutdown = True
+        elif line == "no shutdown":
+            self.shutdown = False
+        elif line.startswith("mtu "):
+            self.mtu = line[len("mtu "):]
+        elif line == "portmode hybrid":
+            self.portmode_hybrid = True
+        elif line == "switchport":
+            self.switchport = True
+        elif line.startswith("ip address "):
+            self.ip4.append(line[len("ip address "):])
+        elif line.startswith("ipv6 address "):
+            self.ip6.append(line[len("ipv6 address "):])
+        elif line == "no spanning-tree":
+            self.stp_disabled = True
+        elif line.startswith("spanning-tree "):
+            line_parts = line.split(" ")
+            if len(line_parts) < 3:
+                return
+
+            stp_type = line_parts[1]
+            if line_parts[2] == "edge-port":
+                self.stp_edgeport[stp_type] = line
+                if "bpduguard" in line_parts:
+                    self.stp_bpduguard = True
+            elif line_parts[2] == "rootguard":
+                self.stp_rootguard.add(stp_type)
+            elif line_parts[2] == "loopguard":
+                self.stp_loopguard.add(stp_type)
+        elif line == "port-channel-protocol LACP":
+            self.lacp = True
+        elif line == "lacp fast-switchover":
+            self.lacp_fast_switchover = True
+        elif line.startswith("vlt-peer-lag "):
+            self.vlt_peer_lag = line[len("vlt-peer-lag "):]
+        elif line.startswith(("fec ", "no fec ")):
+            self.fec = line
+        elif "negotiation" in line or "autoneg" in line:
+            self.autoneg = line
+
+class OS9IntfRange(object):
+    """
+    A set of interfaces from OS9 range syntax, stored as intervals over the ordered port list of the config
 
-        if "mtu" in man_fields:
-            # mtu attribute exists in the manifest
-            conf_line = f"mtu {str(intf_fields['mtu'])}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+    OS9 ranges like "1/1-1/4" cover every interface between the two ends in config order, so a range is kept
+    as (start, end) positions in OS9ConfigTree.ports instead of being expanded to one label per interface.
+    """
 
-        elif any(item.startswith("mtu") for item in running_fields) and not default_port:
-            # mtu attribute exists on the switch, but shouldn't
-            out.append("no mtu")
+    def __init__(self, sw_tree, s=None):
+        """
+        :param sw_tree: Parsed switch config the positions refer to
+        :type sw_tree: OS9ConfigTree
+        :param s: Optional interface range to add (e.g. "TenGigabitEthernet 1/1-1/4,1/7")
+        :type s: str
+        """
 
-        return out
+        self.sw_tree = sw_tree
+        self.intervals = []  # sorted, non overlapping (start, end) positions, both inclusive
+        self.extra = {}  # interface key (see intf_key) -> label, for interfaces that don't have a block in the config
 
-    def os9_autoneg(intf_label, man_fields, running_fields, default_port):
+        if s is not None:
+            self.add(s)
+
+    def add(self, s):
         """
-        Create OS9 commands for "autoneg" attribute
+        Adds an interface range to the set
 
-        :param intf_label: Name of interface
-        :type intf_label: str
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set autoneg
-        :rtype: list
+        :param s: Interface range (e.g. "TenGigabitEthernet 1/1-1/4,1/7")
+        :type s: str
         """
 
-        intf_type = intf_label.split(" ")[0].lower()
+        s_parts = s.split(" ")  # Split input string into type and range parts
+        s_type = s_parts[0]
+        s_range_str = s_parts[1]
 
-        if intf_type == "gigabitethernet" or intf_type == "tengigabitethernet":
-            # support negotiation command
-            conf_line = "negotiation auto"
-        elif intf_type == "twentyfivegige":
-            conf_line = "intf-type cr1 autoneg"
-        elif intf_type == "fiftygige":
-            conf_line = "intf-type cr2 autoneg"
-        elif intf_type == "hundredgige" or intf_type == "fortygige":
-            conf_line = "intf-type cr4 autoneg"
+        with profile_stage("range_expansion"):
+            for range_str in s_range_str.split(","):
+                range_parts = range_str.split("-")  # split by dashes
+                range_ids = [intf_id(f"{s_type} {range_part}") for range_part in range_parts]
 
-        out = []
+                if len(range_parts) == 1:
+                    # no range here
+                    pos = self.sw_tree.port_index.get(range_ids[0])
 
-        if "autoneg" in man_fields and not man_fields["autoneg"]:
-            conf_line = f"no {conf_line}"
+                    if pos is None:
+                        intf_label = f"{s_type} {range_str}"
+                        self.extra.setdefault(range_ids[0] or normalize_header(intf_label), intf_label)
+                    else:
+                        self._add_interval(pos, pos)
+                else:
+                    # this is a range (-), it covers everything between both ends in config order
+                    start = self.sw_tree.port_index.get(range_ids[0])
+                    end = self.sw_tree.port_index.get(range_ids[1])
 
-            if conf_line not in running_config or default_port:
-                out.append(conf_line)
+                    if start is None:
+                        continue
 
-        elif any("autoneg" in i for i in running_fields) or any("negotiation" in i for i in running_fields):
-            out.append(conf_line)
+                    if end is None:
+                        # range runs until the end of the config
+                        end = len(self.sw_tree.ports) - 1
 
-        return out
+                    if end >= start:
+                        self._add_interval(start, end)
 
-    def os9_fec(man_fields, running_fields, default_port):
+    def update(self, other):
         """
-        Create OS9 commands for "fec" attribute
+        Adds all interfaces of another range of the same config to the set
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set fec
-        :rtype: list
+        :param other: Range to add
+        :type other: OS9IntfRange
         """
 
-        out = []
+        for start, end in other.intervals:
+            self._add_interval(start, end)
 
-        # Create a no prefix based on manifest value
-        if "fec" in man_fields:
-            if man_fields["fec"]:
-                conf_line = "fec enable"
-            else:
-                conf_line = "no fec enable"
+        self.extra.update(other.extra)
 
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)
-        elif any("fec" in i for i in running_fields):
-            # fec field exists
-            conf_line = "fec default"
-            out.append(conf_line)
+    def _add_interval(self, start, end):
+        idx = bisect.bisect_left(self.intervals, (start, end))
 
-        return out
+        # merge with overlapping/adjacent neighbours
+        if idx > 0 and self.intervals[idx - 1][1] >= start - 1:
+            idx -= 1
+            start = self.intervals[idx][0]
+            end = max(end, self.intervals[idx][1])
+            del self.intervals[idx]
+
+        while idx < len(self.intervals) and self.intervals[idx][0] <= end + 1:
+            end = max(end, self.intervals[idx][1])
+            del self.intervals[idx]
 
-    def os9_ip4(man_fields, running_fields, default_port):
+        self.intervals.insert(idx, (start, end))
+
+    def contains_position(self, pos):
         """
-        Create OS9 commands for "ip4" attribute
+        Checks if a port position is in the set
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set ip4
-        :rtype: list
+        :param pos: Position in OS9ConfigTree.ports
+        :type pos: int
+        :return: True if the position is in the set
+        :rtype: bool
         """
 
-        out = []
+        idx = bisect.bisect_right(self.intervals, (pos, len(self.sw_tree.ports)))
+        return idx > 0 and self.intervals[idx - 1][1] >= pos
 
-        if "port-channel-protocol lacp" in running_fields:
-            out.append("no port-channel-protocol lacp")
-            #! this only works for LACP, what if interface is in a normal LAG?
+    def positions(self):
+        """
+        Iterates over the port positions in the set
 
-        if "ip4" in man_fields:
-            # ip4 attribute exists in the manifest
-            conf_line = f"ip address {man_fields['ip4']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+        :return: Generator of positions, in config order
+        :rtype: generator
+        """
 
-        elif any(item.startswith("ip address") for item in running_fields) and not default_port:
-            # ip4 attribute exists on the switch, but shouldn't
-            out.append("no ip address")
+        for start, end in self.intervals:
+            yield from range(start, end + 1)
 
-        return out
+    def __contains__(self, intf_label):
+        pos = self.sw_tree.get_port_position(intf_label)
+        if pos is None:
+            return intf_key(intf_label) in self.extra
 
-    def os9_ip6(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "ip6" attribute
+        return self.contains_position(pos)
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set ip6
-        :rtype: list
-        """
+    def __iter__(self):
+        for pos in self.positions():
+            yield self.sw_tree.ports[pos]
 
-        out = []
+        yield from self.extra.values()
 
-        if "port-channel-protocol lacp" in running_fields:
-            out.append("no port-channel-protocol lacp")
-            #! this only works for LACP, what if interface is in a normal LAG?
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.intervals) + len(self.extra)
 
-        if "ip6" in man_fields:
-            # ip6 attribute exists in the manifest
-            conf_line = f"ipv6 address {man_fields['ip6']}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)  # add to out only if not already in switch conf
+class OS9ConfigTree(object):
+    """
+    Block tree of an OS9 running config, built in a single pass
 
-        elif any(item.startswith("ipv6 address") for item in running_fields) and not default_port:
-            # ip6 attribute exists on the switch, but shouldn't
-            out.append("no ipv6 address")
+    Top level blocks (interfaces, stack-unit, protocol spanning-tree, vlt domain, etc) are indexed
+    by their normalized header so they can be looked up without rescanning the config. Interfaces are
+    indexed by their ID (see intf_key), so any spelling of an interface label finds them.
+    """
 
-        return out
+    def __init__(self, sw_config):
+        """
+        :param sw_config: Switch configuration text (or lines)
+        :type sw_config: str
+        """
 
-    def os9_stp(man_fields, running_fields, default_port):
+        if not isinstance(sw_config, str):
+            sw_config = "\n".join(sw_config)
+
+        self.text = sw_config  # the blocks refer to this by offset, so it isn't copied or split into lines
+
+        self.blocks = []  # top level blocks, in config order
+        self.index = {}  # normalized header -> first top level block with that header (other than interfaces)
+        self.intf_index = {}  # interface key -> first interface block with that key
+        self.ports = []  # labels of all interfaces, in config order (this is what OS9 ranges are based on)
+        self.port_index = {}  # interface key -> position in self.ports
+        self.intf_states = {}  # interface key -> OS9IntfState, filled on first use
+        self.vlan_bitmaps = {}  # (member key, mode) -> VLAN bitmap, filled on first use
+
+        # only the top level lines are looked at here, a block runs until the next one
+        block = None
+        for match in config_header_re.finditer(sw_config):
+            line_str = match.group().rstrip()
+            if line_str == "":
+                continue
+
+            if block is not None:
+                block.end = match.start()
+
+            block = OS9ConfigBlock(sw_config, line_str, 0, match.end(), len(sw_config))
+            self.blocks.append(block)
+
+            if line_str.startswith("interface "):
+                intf_label = line_str[len("interface "):]
+                port_id = intf_key(intf_label)
+                self.intf_index.setdefault(port_id, block)
+                self.port_index.setdefault(port_id, len(self.ports))
+                self.ports.append(intf_label)
+            else:
+                self.index.setdefault(normalize_header(line_str), block)
+
+        # reverse membership indexes, OS9 stores these on the parent (VLAN/port-channel) side or the member side
+        self.member_vlans = {}  # port position (or interface key if not a port) -> {(vlan id, mode): vlan label}
+        self.vlan_members = {}  # vlan id -> {mode: OS9IntfRange}
+        self.channel_members = {}  # port-channel ID -> OS9IntfRange
+        self.lacp_members = {}  # port-channel ID -> {member ID: (member label, mode)}
+
+        for port_id, block in self.intf_index.items():
+            port_type = getattr(port_id, "type", None)
+            if port_type in vlan_intf_types:
+                self._index_vlan(port_id, block)
+            elif port_type in lag_intf_types:
+                self._index_channel(port_id, block)
+            elif port_type in physical_intf_types:
+                self._index_lacp(port_id, block)
+
+        # fanout index, a fanned out port (stack-unit U port P portmode quad) is replaced by subports U/P/1-4
+        self.fanouts = {}  # (unit, port) -> (stack-unit line, portmode, speed or None)
+        self.unit_ports = {}  # (unit, port) -> {"parent": label or None, "children": [labels]}, in config order
+
+        for port_id, block in self.intf_index.items():
+            if getattr(port_id, "type", None) in physical_intf_types and len(port_id.numbers) in (2, 3):
+                unit_port = self.unit_ports.setdefault(port_id.numbers[:2], {"parent": None, "children": []})
+                if len(port_id.numbers) == 2:
+                    unit_port["parent"] = block.header[len("interface "):]
+                else:
+                    unit_port["children"].append(block.header[len("interface "):])
 
-        out = []
+        for block in self.blocks:
+            if block.header.startswith("stack-unit "):
+                self._index_fanout(block)
 
-        os9_stp_types = ["rstp", "pvst", "mstp"]
+    def _index_fanout(self, block):
+        line_parts = block.header.split(" ")
+        if len(line_parts) < 6 or line_parts[2] != "port" or line_parts[4] != "portmode" or \
+           not (line_parts[1].isdigit() and line_parts[3].isdigit()):
+            return
 
-        # enable/disable
-        stp_disabled = "stp" in man_fields and "disabled" in man_fields["stp"] and man_fields["stp"]["disabled"]
-        if stp_disabled:
-            # stp should be disabled
-            conf_line = f"no spanning-tree"
-            if conf_line not in running_fields and not default_port:
-                out.append(conf_line)
-        elif "no spanning-tree" in running_fields:
-            conf_line = "spanning-tree"
-            out.append(conf_line)
+        speed = line_parts[7] if len(line_parts) > 7 and line_parts[6] == "speed" else None
+        self.fanouts[(int(line_parts[1]), int(line_parts[3]))] = (block.header, line_parts[5], speed)
 
-        for stp_type in os9_stp_types:
-            if "stp" in man_fields:
-                stp_fields = man_fields["stp"]
+    def _index_vlan(self, vlan_key, block):
+        vlan_label = " ".join(block.header.split(" ")[1:3])
+        vlan_id = str(vlan_key.numbers[-1])
 
-                # Edgeport settings
-                if "edgeport" in stp_fields and stp_fields["edgeport"]:
-                    # this port is an edge port
-                    conf_line = f"spanning-tree {stp_type} edge-port"
-                    if "bpduguard" in stp_fields and stp_fields["bpduguard"]:
-                        conf_line += " bpduguard shutdown-on-violation"
-                    elif any("bpduguard" in item for item in running_fields):
-                        # existing bpduguard where it shouldn't be
-                        out.append(f"no spanning-tree {stp_type} edge-port")
+        for line_str in block.lines:
+            line_parts = line_str.split(" ")
+            if line_parts[0] not in ("untagged", "tagged"):
+                continue
 
-                    if conf_line not in running_fields or default_port:
-                        out.append(conf_line)
-                elif any(item.startswith(f"spanning-tree {stp_type} edge-port") for item in running_fields):
-                    out.append(f"no spanning-tree {stp_type} edge-port")
+            vlan_mode = line_parts[0]
+            line_range = OS9IntfRange(self, " ".join(line_parts[1:]))
 
-                # Rootguard settings
-                if "rootguard" in stp_fields and stp_fields["rootguard"]:
-                    # enable rootguard
-                    conf_line = f"spanning-tree {stp_type} rootguard"
+            vlan_ranges = self.vlan_members.setdefault(vlan_id, {})
+            vlan_ranges.setdefault(vlan_mode, OS9IntfRange(self)).update(line_range)
 
-                    if conf_line not in running_fields or default_port:
-                        out.append(conf_line)
-                elif f"spanning-tree {stp_type} rootguard" in running_fields:
-                    out.append(f"no spanning-tree {stp_type} rootguard")
+            # the reverse index is filled from the intervals, so it costs one entry per membership
+            # (sharing one key tuple, as there can be hundreds of thousands of them)
+            membership = (vlan_id, vlan_mode)
+            for pos in line_range.positions():
+                self.member_vlans.setdefault(pos, {})[membership] = vlan_label
 
-                # Loopguard settings
-                if "loopguard" in stp_fields and stp_fields["loopguard"]:
-                    # enable loopguard
-                    conf_line = f"spanning-tree {stp_type} loopguard"
+            for member_key in line_range.extra:
+                self.member_vlans.setdefault(member_key, {})[membership] = vlan_label
 
-                    if conf_line not in running_fields or default_port:
-                        out.append(conf_line)
-                elif f"spanning-tree {stp_type} loopguard" in running_fields:
-                    out.append(f"no spanning-tree {stp_type} loopguard")
-            elif any(item.startswith(f"spanning-tree {stp_type} edge-port") for item in running_fields):
-                out.append(f"no spanning-tree {stp_type} edge-port")
-            elif f"spanning-tree {stp_type} rootguard" in running_fields:
-                out.append(f"no spanning-tree {stp_type} rootguard")
-            elif f"spanning-tree {stp_type} loopguard" in running_fields:
-                out.append(f"no spanning-tree {stp_type} loopguard")
+    def _index_channel(self, channel_key, block):
+        for line_str in block.lines:
+            if line_str.startswith("channel-member "):
+                channel_range = self.channel_members.setdefault(channel_key, OS9IntfRange(self))
+                channel_range.add(line_str[len("channel-member "):])
 
-        return out
+    def _index_lacp(self, member_key, block):
+        member_label = block.header[len("interface "):]
 
-    def os9_portmode(man_fields, running_fields):
+        for line_str in block.lines:
+            line_parts = line_str.split(" ")
+            if line_parts[0].lower() != "port-channel" or len(line_parts) < 2:
+                continue
+
+            # LACP membership is stored on the member as "port-channel X mode active"
+            channel_key = intf_key(" ".join(line_parts[:2]))
+            lacp_mode = line_parts[3] if len(line_parts) > 3 and line_parts[2] == "mode" else ""
+            self.lacp_members.setdefault(channel_key, {})[member_key] = (member_label, lacp_mode)
+
+    def get(self, header):
         """
-        Create OS9 commands for "portmode" attribute
+        Looks up a top level block by its header
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :return: Tuple of <OS9 commands to set portmode>,<defaulted port>
-        :rtype: tuple
+        :param header: Block header (e.g. "interface Vlan 10")
+        :type header: str
+        :return: Matching block, or None if it doesn't exist
+        :rtype: OS9ConfigBlock
         """
 
-        out = []
-        def_intf = False  # if true then the interface needs to be defaulted before continuing
+        if header[:len("interface ")].lower() == "interface ":
+            return self.intf_index.get(intf_key(header[len("interface "):]))
 
-        if "portmode" in man_fields:
-            if "port-channel-protocol LACP" in running_fields:
-                # default interface if part of lag
-                def_intf = True
+        return self.index.get(normalize_header(header))
 
-            intf_portmode = intf_fields["portmode"]
+    def get_intf_state(self, intf_label):
+        """
+        Returns the parsed attributes of an interface, the result is cached so it must not be modified
 
-            has_switchport = "switchport" in running_fields
-            has_portmode = "portmode hybrid" in running_fields
+        :param intf_label: Label of the interface
+        :type intf_label: str
+        :return: Interface state (empty if the interface doesn't exist)
+        :rtype: OS9IntfState
+        """
 
-            if intf_portmode == "hybrid":
-                # for hybrid port, portmode hybrid needs to go first
-                if not has_portmode:
-                    out.append("portmode hybrid")
+        state_key = intf_key(intf_label)
+        intf_state = self.intf_states.get(state_key)
 
-                    if has_switchport:
-                        # You cannot apply portmode hybrid unless switchport doesn't exist
-                        def_intf = True
+        if intf_state is None:
+            block = self.intf_index.get(state_key)
+            intf_state = OS9IntfState(() if block is None else block.lines)
+            self.intf_states[state_key] = intf_state
 
-            if not has_switchport or def_intf:
-                out.append("switchport")  # only apply if not already on switch
+        return intf_state
 
-            if not def_intf:
-                # remove L3 fields since they are mutually exclusive if they exist
-                if any(item.startswith("ip address") for item in running_fields):
-                    out.insert(0, "no ip address")
+    def get_port_position(self, intf_label):
+        """
+        Looks up the position of an interface in the ordered port list
 
-                if any(item.startswith("ipv6 address") for item in running_fields):
-                    out.insert(0, "no ipv6 address")
-        else:
-            if "switchport" in running_fields:
-                def_intf = True
+        :param intf_label: Label of the interface
+        :type intf_label: str
+        :return: Position in self.ports, or None if the interface doesn't exist
+        :rtype: int
+        """
 
-            if "portmode hybrid" in running_fields and not def_intf:
-                out.append("no portmode hybrid")
+        return self.port_index.get(intf_key(intf_label))
 
-        return out,def_intf
+    def _member_key(self, member):
+        member_key = intf_key(member)
+        pos = self.port_index.get(member_key)
+        if pos is None:
+            return member_key
 
-    def getTaggedVlanList(tagList):
+        return pos
+
+    def get_member_vlans(self, member, vlan_mode):
         """
-        The manifest allows tagged vlans to be specified as a range like 1000:1010
-        This method parses that
+        Looks up the VLANs an interface is a member of
 
-        :param tagList: String to be parsed
-        :type tagList: str
-        :return: List of each vlan in the list
+        :param member: Label of the member interface
+        :type member: str
+        :param vlan_mode: "tagged" or "untagged"
+        :type vlan_mode: str
+        :return: List of VLAN labels (e.g. "Vlan 10"), in config order
         :rtype: list
         """
 
-        out = []
+        vlans = self.member_vlans.get(self._member_key(member), {})
+        return [vlan_label for (vlan_id, mode), vlan_label in vlans.items() if mode == vlan_mode]
+
+    def get_vlan_bitmap(self, member, vlan_mode):
+        """
+        Looks up the VLANs an interface is a member of as a bitmap (see vlan_bitmap), the result is cached
+
+        :param member: Label of the member interface
+        :type member: str
+        :param vlan_mode: "tagged" or "untagged"
+        :type vlan_mode: str
+        :return: VLAN bitmap
+        :rtype: int
+        """
+
+        member_key = self._member_key(member)
+        bitmap = self.vlan_bitmaps.get((member_key, vlan_mode))
+
+        if bitmap is None:
+            # a trunk can be in thousands of VLANs, setting bytes is cheaper than shifting a 4096 bit int for each
+            vlan_bytes = bytearray(512)
+            for vlan_id, mode in self.member_vlans.get(member_key, {}):
+                if mode == vlan_mode:
+                    vlan_id = int(vlan_id)
+                    vlan_bytes[vlan_id >> 3] |= 1 << (vlan_id & 7)
+
+            bitmap = int.from_bytes(vlan_bytes, "little")
+            self.vlan_bitmaps[(member_key, vlan_mode)] = bitmap
+
+        return bitmap
+
+    def has_vlan_member(self, vlan_id, vlan_mode, member):
+        """
+        Checks if an interface is a tagged/untagged member of a VLAN
+
+        :param vlan_id: VLAN ID
+        :type vlan_id: str
+        :param vlan_mode: "tagged" or "untagged"
+        :type vlan_mode: str
+        :param member: Label of the member interface
+        :type member: str
+        :return: True if the interface is a member
+        :rtype: bool
+        """
+
+        vlan_range = self.vlan_members.get(str(vlan_id), {}).get(vlan_mode)
+        return vlan_range is not None and member in vlan_range
+
+    def get_channel_members(self, channel):
+        """
+        Looks up the (non-LACP) channel members of a port-channel
+
+        :param channel: Label of the port-channel
+        :type channel: str
+        :return: Range of channel members
+        :rtype: OS9IntfRange
+        """
+
+        return self.channel_members.get(intf_key(channel), OS9IntfRange(self))
+
+    def get_lacp_members(self, channel):
+        """
+        Looks up the LACP members of a port-channel
+
+        :param channel: Label of the port-channel
+        :type channel: str
+        :return: Dict of member ID -> (member label, "active" or "passive"), in config order
+        :rtype: dict
+        """
+
+        return self.lacp_members.get(intf_key(channel), {})
+
+    def iter_blocks(self, prefixes):
+        """
+        Iterates over the top level blocks with a header starting with one of the prefixes
+
+        :param prefixes: Lowercase header prefixes (e.g. ["interface vlan"])
+        :type prefixes: list
+        :return: Generator of blocks, in config order
+        :rtype: generator
+        """
+
+        prefixes = tuple(prefixes)
+        for block in self.blocks:
+            if block.header.lower().startswith(prefixes):
+                yield block
+
+def os9_diskcache_path(cache_key, suffix):
+    """
+    Returns the path of a file of the disk parse cache
+
+    :param cache_key: Hash of the config text
+    :type cache_key: str
+    :param suffix: File suffix, ".pickle" for the parsed config or ".json" for its counters
+    :type suffix: str
+    :return: Path
+    :rtype: str
+    """
+
+    return os.path.join(parse_cache_dir, f"{cache_key}-{plugin_hash}{suffix}")
+
+def os9_diskcache_count(cache_key, counter):
+    """
+    Increments a counter of a parsed config on disk, these show the reuse over the tasks of a run (OS9_CACHESTATS)
+
+    :param cache_key: Hash of the config text
+    :type cache_key: str
+    :param counter: "parses" or "loads"
+    :type counter: str
+    """
+
+    counts_path = os9_diskcache_path(cache_key, ".json")
+    counts = {"parses": 0, "loads": 0}
+
+    try:
+        with open(counts_path) as f:
+            counts.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    counts[counter] += 1
+
+    with open(counts_path, "w") as f:
+        json.dump(counts, f)
+
+def os9_diskcache_load(cache_key):
+    """
+    Loads a parsed config that an earlier task (another worker process) saved with os9_diskcache_save
+
+    :param cache_key: Hash of the config text
+    :type cache_key: str
+    :return: Block tree of the running config, or None if it isn't on disk
+    :rtype: OS9ConfigTree
+    """
+
+    if not parse_cache_dir:
+        return None
+
+    try:
+        with open(os9_diskcache_path(cache_key, ".pickle"), "rb") as f:
+            sw_tree = pickle.load(f)
+    except Exception:
+        # missing, or written by another copy of the plugin, parse it again
+        return None
+
+    if type(sw_tree) is not OS9ConfigTree:
+        return None
+
+    os9_diskcache_count(cache_key, "loads")
+
+    return sw_tree
+
+def os9_diskcache_save(cache_key, sw_tree):
+    """
+    Saves a freshly parsed config for the next tasks, keeping the parse_cache_files most recent ones
+
+    :param cache_key: Hash of the config text
+    :type cache_key: str
+    :param sw_tree: Block tree of the running config, before any lookups filled it
+    :type sw_tree: OS9ConfigTree
+    """
+
+    if not parse_cache_dir:
+        return
 
-        for list_item in tagList:
+    try:
+        os.makedirs(parse_cache_dir, mode=0o700, exist_ok=True)
+
+        pickle_path = os9_diskcache_path(cache_key, ".pickle")
+        tmp_path = f"{pickle_path}.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(sw_tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, pickle_path)
+
+        os9_diskcache_count(cache_key, "parses")
+
+        pickles = [entry for entry in os.scandir(parse_cache_dir) if entry.name.endswith(".pickle")]
+        pickles.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in pickles[:max(0, len(pickles) - parse_cache_files)]:
+            for path in (entry.path, entry.path[:-len(".pickle")] + ".json"):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+    except (OSError, pickle.PicklingError):
+        # the cache is only an optimization, the filters work without it
+        pass
+
+def OS9_PARSECONFIG(sw_config):
+    """
+    Parses the running config from the switch facts into a block tree
+    The result is cached, so it must not be modified by the caller
+
+    :param sw_config: Switch facts containing the running config
+    :type sw_config: dict
+    :return: Block tree of the running config
+    :rtype: OS9ConfigTree
+    """
+
+    conf_text = sw_config["ansible_facts"]["ansible_net_config"]
+    cache_key = hashlib.sha256(conf_text.encode()).hexdigest()
+
+    if cache_key in parse_cache:
+        parse_cache_stats["hits"] += 1
+        profile_count("parse_cache_hits")
+        parse_cache.move_to_end(cache_key)
+        return parse_cache[cache_key]
+
+    with profile_stage("parse"):
+        sw_tree = os9_diskcache_load(cache_key)
+
+        if sw_tree is not None:
+            parse_cache_stats["disk_hits"] += 1
+            profile_count("parse_cache_disk_hits")
+        else:
+            parse_cache_stats["misses"] += 1
+            profile_count("parse_cache_misses")
+            sw_tree = OS9ConfigTree(conf_text)
+            os9_diskcache_save(cache_key, sw_tree)
+
+    parse_cache[cache_key] = sw_tree
+    while len(parse_cache) > parse_cache_size:
+        # evict least recently used
+        parse_cache.popitem(last=False)
+        parse_cache_stats["evictions"] += 1
+
+    return sw_tree
+
+def OS9_CACHESTATS(sw_config=None):
+    """
+    Returns the counters of the parse cache of this process and, for switch facts, of their config on disk
+    Ansible templates every task in a new worker process, so the counters of the process only cover the filter calls
+    of one task (they are part of every profile, see OS9_PROFILE_DIR). The disk counters cover the whole run: how
+    often the config was parsed and how often a later task loaded it instead of parsing it again.
+
+    :param sw_config: Switch facts containing the running config, or None for the counters of this process only
+    :type sw_config: dict
+    :return: Dict of hits, misses, evictions, disk_hits, size and max_size, with "disk" (parses and loads) for
+             switch facts
+    :rtype: dict
+    """
+
+    stats = dict(parse_cache_stats)
+    stats["size"] = len(parse_cache)
+    stats["max_size"] = parse_cache_size
+
+    if isinstance(sw_config, dict) and parse_cache_dir:
+        conf_text = sw_config["ansible_facts"]["ansible_net_config"]
+        cache_key = hashlib.sha256(conf_text.encode()).hexdigest()
+        stats["disk"] = {"parses": 0, "loads": 0}
+
+        try:
+            with open(os9_diskcache_path(cache_key, ".json")) as f:
+                stats["disk"].update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    return stats
+
+def OS9_GETINTFCONFIG(intf, sw_config):
+    """
+    Returns the (stripped) config lines of a single interface
+
+    :param intf: Name of interface
+    :type intf: str
+    :param sw_config: Parsed switch config (a list of lines is parsed first)
+    :type sw_config: OS9ConfigTree
+    :return: Config lines of the interface
+    :rtype: list
+    """
+
+    profile_count("OS9_GETINTFCONFIG")
+
+    if not isinstance(sw_config, OS9ConfigTree):
+        sw_config = OS9ConfigTree(sw_config)
+
+    block = sw_config.get(f"interface {intf}")
+    if block is None:
+        return []
+
+    return block.lines
+
+def os9_expandvlans(tag_list):
+    """
+    The manifest allows tagged vlans to be specified as a range like 1000:1010
+    This method parses that
+
+    :param tag_list: Manifest tagged list
+    :type tag_list: list
+    :return: List of each vlan in the list
+    :rtype: list
+    """
+
+    out = []
+
+    with profile_stage("range_expansion"):
+        for list_item in tag_list:
             item_parts = str(list_item).split(":")
 
             if len(item_parts) == 1:
@@ -536,541 +1289,2181 @@ def OS9_GENERATEINTFCONFIG(intf_label, intf_fields, sw_config, managed_vlan_list
                 vlan_list = list(range(int(item_parts[0]), int(item_parts[1]) + 1))
                 out += map(str, vlan_list)
 
-        return out
+    return out
 
-    def os9_cleanvlans(intf_label, sw_config, man_fields, default_port, managed_vlan_list):
-        """
-        Create OS9 commands for cleaning vlans
+def vlan_bitmap(vlan_ids):
+    """
+    Turns VLAN IDs into a bitmap (bit N is set for VLAN N, so it fits in 4096 bits), VLAN sets are then diffed with
+    a few bitwise operations instead of one lookup per VLAN
 
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param defaulted: If true, this interface is defaulted before executing
-        :type defaulted: boolean
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :param managed_vlan_list: List of VLANs that are managed
-        :type managed_vlan_list: list
-        :return: List of OS9 commands to set clean vlans
-        :rtype: list
-        """
+    :param vlan_ids: VLAN IDs (int or str)
+    :type vlan_ids: list
+    :return: VLAN bitmap
+    :rtype: int
+    """
 
-        out = []
+    bitmap = 0
+    for vlan_id in vlan_ids:
+        bitmap |= 1 << int(vlan_id)
 
-        if default_port:
-            return out
+    return bitmap
 
-        for vlan_mode in ["untagged", "tagged"]:
-            existing_vlan_list = os9_searchconfig(sw_config, vlan_interface_types, [vlan_mode], intf_label)
+def vlan_spec_bitmap(tag_list):
+    """
+    Turns a manifest tagged list (with ranges like 1000:1010, see os9_expandvlans) into a VLAN bitmap
+    A range is set at once, without expanding it
 
-            if vlan_mode == "tagged" and "tagged" in man_fields:
-                check_vllist = getTaggedVlanList(man_fields["tagged"])
-            elif vlan_mode == "untagged" and "untagged" in man_fields:
-                check_vllist = [str(man_fields["untagged"])]
-            else:
-                check_vllist = []
+    :param tag_list: Manifest tagged list
+    :type tag_list: list
+    :return: VLAN bitmap
+    :rtype: int
+    """
 
-            for existing_vlan in existing_vlan_list:
-                vlan_id = existing_vlan.split(" ")[-1]
-                if not vlan_id in check_vllist and not vlan_id in managed_vlan_list:
-                    # Don't remove managed vlan
-                    cur_intf_cfg = []
+    bitmap = 0
 
-                    cur_intf_cfg.append(f"interface {str(existing_vlan)}")
-                    conf_line = f"no {vlan_mode} {intf_label}"
-                    cur_intf_cfg.append(conf_line)
+    for list_item in tag_list:
+        item_parts = str(list_item).split(":")
 
-                    out.append(cur_intf_cfg)
+        if len(item_parts) == 1:
+            bitmap |= 1 << int(item_parts[0])
+        elif int(item_parts[1]) >= int(item_parts[0]):
+            bitmap |= (1 << (int(item_parts[1]) + 1)) - (1 << int(item_parts[0]))
 
-        return out
+    return bitmap
 
-    def os9_untagged(intf_label, sw_config, man_fields, default_port):
+def vlan_bitmap_runs(bitmap):
+    """
+    Splits a VLAN bitmap into runs of consecutive VLANs
+
+    :param bitmap: VLAN bitmap
+    :type bitmap: int
+    :return: List of (first VLAN ID, last VLAN ID), ascending
+    :rtype: list
+    """
+
+    out = []
+
+    while bitmap:
+        first = (bitmap & -bitmap).bit_length() - 1
+        # adding the lowest bit carries through the run, leaving the first bit above it
+        above = (bitmap + (1 << first)) & ~bitmap
+        out.append((first, above.bit_length() - 2))
+        bitmap &= ~(above - 1)
+
+    return out
+
+def OS9_GETINTFSTATE(intf, sw_config):
+    """
+    Returns the parsed attributes of a single interface
+
+    :param intf: Name of interface
+    :type intf: str
+    :param sw_config: Parsed switch config (a list of lines is parsed first)
+    :type sw_config: OS9ConfigTree
+    :return: Interface state
+    :rtype: OS9IntfState
+    """
+
+    profile_count("OS9_GETINTFSTATE")
+
+    if not isinstance(sw_config, OS9ConfigTree):
+        sw_config = OS9ConfigTree(sw_config)
+
+    return sw_config.get_intf_state(intf)
+
+def os9_portmode(man_fields, running_state):
+    """
+    Create OS9 commands for "portmode" attribute and decide if the interface has to be defaulted first
+    Module level, as OS9_GETCONFIG makes this decision for all interfaces before generating their config
+
+    :param man_fields: Manifest fields for current interface
+    :type man_fields: dict
+    :param running_state: Interface attributes in the running config
+    :type running_state: OS9IntfState
+    :return: Tuple of <OS9 commands to set portmode>,<defaulted port>
+    :rtype: tuple
+    """
+
+    out = []
+    def_intf = False  # if true then the interface needs to be defaulted before continuing
+
+    if "portmode" in man_fields:
+        if running_state.lacp:
+            # default interface if part of lag
+            def_intf = True
+
+        intf_portmode = man_fields["portmode"]
+
+        has_switchport = running_state.switchport
+        has_portmode = running_state.portmode_hybrid
+
+        if intf_portmode == "hybrid":
+            # for hybrid port, portmode hybrid needs to go first
+            if not has_portmode:
+                out.append("portmode hybrid")
+
+                if has_switchport:
+                    # You cannot apply portmode hybrid unless switchport doesn't exist
+                    def_intf = True
+
+        if not has_switchport or def_intf:
+            out.append("switchport")  # only apply if not already on switch
+
+        if not def_intf:
+            # remove L3 fields since they are mutually exclusive if they exist
+            if len(running_state.ip4) > 0:
+                out.insert(0, "no ip address")
+
+            if len(running_state.ip6) > 0:
+                out.insert(0, "no ipv6 address")
+    else:
+        if running_state.switchport:
+            def_intf = True
+
+        if running_state.portmode_hybrid and not def_intf:
+            out.append("no portmode hybrid")
+
+    return out,def_intf
+
+def OS9_GENERATEINTFCONFIG(intf_label, intf_fields, sw_config, managed_vlan_list, default_list, vlan_changes=None,
+                           tagged_vlans=None, lacp_members=None):
+    """
+    This will generate a sequence of OS9 commands for a single interface based on existing and manifest config.
+
+    :param intf_label: Name of interface
+    :type intf_label: str
+    :param intf_fields: Fields from manifest of interface
+    :type intf_fields: str
+    :param sw_config: Parsed switch config
+    :type sw_config: OS9ConfigTree
+    :param managed_vlan_list: VLANs that are managed, or their bitmap (see vlan_bitmap)
+    :type managed_vlan_list: set
+    :param vlan_changes: If set, VLAN membership changes are added to this list instead of the output
+    :type vlan_changes: list
+    :param tagged_vlans: Expanded tagged VLANs of the interface (from OS9_COMPILEMANIFEST), expanded here if None
+    :type tagged_vlans: list
+    :param lacp_members: LACP member label -> mode of the interface (from OS9_COMPILEMANIFEST), resolved here if None
+    :type lacp_members: dict
+    :return list of os9 commands:
+    :rtype: list
+    """
+    def os9_name(man_fields, running_state, default_port):
         """
-        Create OS9 commands for "untagged" attribute
+        Create OS9 commands for "name" attribute (only for VLAN interfaces)
 
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
         :param man_fields: Manifest fields for current interface
         :type man_fields: dict
-        :param defaulted: If true, this interface is defaulted before executing
-        :type defaulted: boolean
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
         :param default_port: If true, this port is being defaulted
         :type default_port: boolean
-        :return: List of OS9 commands to set untagged
+        :return: List of OS9 commands to set name
         :rtype: list
         """
 
         out = []
 
-        if "untagged" in man_fields:
-            untagged_vlan = str(man_fields["untagged"])
-            vlan_intf_label = f"Vlan {untagged_vlan}"
+        if "name" in man_fields:
+            # Name attribute exists in the manifest
+            conf_line = f"name {man_fields['name']}"
+            if running_state.name != str(man_fields["name"]) or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
 
-            vlan_running_fields = OS9_GETINTFCONFIG(vlan_intf_label, sw_config)
-            conf_line = f"untagged {intf_label}"
+        elif running_state.name is not None and not default_port:
+            # Name attribute exists on the switch, but shouldn't
+            out.append("no name")
 
-            if conf_line not in vlan_running_fields or default_port:
-                cur_intf_cfg = []
+        return out
 
-                cur_intf_cfg.append(f"interface {vlan_intf_label}")
-                cur_intf_cfg.append(conf_line)
-                out.append(cur_intf_cfg)
+    def os9_description(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "description" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set description
+        :rtype: list
+        """
+
+        out = []
+
+        if "description" in man_fields:
+            # Description attribute exists in the manifest
+            conf_line = f"description {man_fields['description']}"
+            if running_state.description != str(man_fields["description"]) or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
+
+        elif running_state.description is not None and not default_port:
+            # Description attribute exists on the switch, but shouldn't
+            out.append("no description")
 
         return out
 
-    def os9_tagged(intf_label, sw_config, man_fields, default_port):
+    def os9_state(man_fields, running_state, default_port):
         """
-        Create OS9 commands for "tagged" attribute
+        Create OS9 commands for "state" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set state
+        :rtype: list
+        """
+
+        out = []
+
+        # Create a no prefix based on manifest value
+        if "state" in man_fields and man_fields["state"] == "up":
+            no_str = "no "
+        else:
+            no_str = ""
+
+        conf_line = f"{no_str}shutdown"
+        if running_state.shutdown is not (no_str == "") or default_port:
+            out.append(conf_line)  # add to out only if not already in switch conf
+
+        return out
+
+    def os9_mtu(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "mtu" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set mtu
+        :rtype: list
+        """
+
+        out = []
+
+        if "mtu" in man_fields:
+            # mtu attribute exists in the manifest
+            conf_line = f"mtu {str(intf_fields['mtu'])}"
+            if running_state.mtu != str(intf_fields["mtu"]) or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
+
+        elif running_state.mtu is not None and not default_port:
+            # mtu attribute exists on the switch, but shouldn't
+            out.append("no mtu")
+
+        return out
+
+    def os9_autoneg(intf_label, man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "autoneg" attribute
+
+        :param intf_label: Name of interface
+        :type intf_label: str
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set autoneg
+        :rtype: list
+        """
+
+        port_type = getattr(intf_id(intf_label), "type", None)
+
+        if port_type in (OS9IntfType.GIGABITETHERNET, OS9IntfType.TENGIGABITETHERNET):
+            # support negotiation command
+            conf_line = "negotiation auto"
+        elif port_type == OS9IntfType.TWENTYFIVEGIGE:
+            conf_line = "intf-type cr1 autoneg"
+        elif port_type == OS9IntfType.FIFTYGIGE:
+            conf_line = "intf-type cr2 autoneg"
+        elif port_type in (OS9IntfType.HUNDREDGIGE, OS9IntfType.FORTYGIGE):
+            conf_line = "intf-type cr4 autoneg"
+        else:
+            conf_line = None
+
+        out = []
+
+        if "autoneg" in man_fields and conf_line is None:
+            raise ValueError(f"autoneg is not supported on {intf_label}")
+
+        if "autoneg" in man_fields and not man_fields["autoneg"]:
+            conf_line = f"no {conf_line}"
+
+            if running_state.autoneg != conf_line or default_port:
+                out.append(conf_line)
+
+        elif running_state.autoneg is not None and conf_line is not None:
+            # no autoneg line for this port type, so a line in the running config is left alone
+            out.append(conf_line)
+
+        return out
+
+    def os9_fec(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "fec" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set fec
+        :rtype: list
+        """
+
+        out = []
+
+        # Create a no prefix based on manifest value
+        if "fec" in man_fields:
+            if man_fields["fec"]:
+                conf_line = "fec enable"
+            else:
+                conf_line = "no fec enable"
+
+            if running_state.fec != conf_line or default_port:
+                out.append(conf_line)
+        elif running_state.fec is not None:
+            # fec field exists
+            conf_line = "fec default"
+            out.append(conf_line)
+
+        return out
+
+    def os9_ip4(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "ip4" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set ip4
+        :rtype: list
+        """
+
+        out = []
+
+        if "ip4" in man_fields:
+            # ip4 attribute exists in the manifest
+            conf_line = f"ip address {man_fields['ip4']}"
+            if str(man_fields["ip4"]) not in running_state.ip4 or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
+
+        elif len(running_state.ip4) > 0 and not default_port:
+            # ip4 attribute exists on the switch, but shouldn't
+            out.append("no ip address")
+
+        return out
+
+    def os9_ip6(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "ip6" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set ip6
+        :rtype: list
+        """
+
+        out = []
+
+        if "ip6" in man_fields:
+            # ip6 attribute exists in the manifest
+            conf_line = f"ipv6 address {man_fields['ip6']}"
+            if str(man_fields["ip6"]) not in running_state.ip6 or default_port:
+                out.append(conf_line)  # add to out only if not already in switch conf
+
+        elif len(running_state.ip6) > 0 and not default_port:
+            # ip6 attribute exists on the switch, but shouldn't
+            out.append("no ipv6 address")
+
+        return out
+
+    def os9_stp(man_fields, running_state, default_port):
+
+        out = []
+
+        os9_stp_types = ["rstp", "pvst", "mstp"]
+
+        # enable/disable
+        stp_disabled = "stp" in man_fields and "disabled" in man_fields["stp"] and man_fields["stp"]["disabled"]
+        if stp_disabled:
+            # stp should be disabled
+            conf_line = f"no spanning-tree"
+            if not running_state.stp_disabled and not default_port:
+                out.append(conf_line)
+        elif running_state.stp_disabled:
+            conf_line = "spanning-tree"
+            out.append(conf_line)
+
+        for stp_type in os9_stp_types:
+            if "stp" in man_fields:
+                stp_fields = man_fields["stp"]
+
+                # Edgeport settings
+                if "edgeport" in stp_fields and stp_fields["edgeport"]:
+                    # this port is an edge port
+                    conf_line = f"spanning-tree {stp_type} edge-port"
+                    if "bpduguard" in stp_fields and stp_fields["bpduguard"]:
+                        conf_line += " bpduguard shutdown-on-violation"
+                    elif running_state.stp_bpduguard:
+                        # existing bpduguard where it shouldn't be
+                        out.append(f"no spanning-tree {stp_type} edge-port")
+
+                    if running_state.stp_edgeport.get(stp_type) != conf_line or default_port:
+                        out.append(conf_line)
+                elif stp_type in running_state.stp_edgeport:
+                    out.append(f"no spanning-tree {stp_type} edge-port")
+
+                # Rootguard settings
+                if "rootguard" in stp_fields and stp_fields["rootguard"]:
+                    # enable rootguard
+                    conf_line = f"spanning-tree {stp_type} rootguard"
+
+                    if stp_type not in running_state.stp_rootguard or default_port:
+                        out.append(conf_line)
+                elif stp_type in running_state.stp_rootguard:
+                    out.append(f"no spanning-tree {stp_type} rootguard")
+
+                # Loopguard settings
+                if "loopguard" in stp_fields and stp_fields["loopguard"]:
+                    # enable loopguard
+                    conf_line = f"spanning-tree {stp_type} loopguard"
+
+                    if stp_type not in running_state.stp_loopguard or default_port:
+                        out.append(conf_line)
+                elif stp_type in running_state.stp_loopguard:
+                    out.append(f"no spanning-tree {stp_type} loopguard")
+            elif stp_type in running_state.stp_edgeport:
+                out.append(f"no spanning-tree {stp_type} edge-port")
+            elif stp_type in running_state.stp_rootguard:
+                out.append(f"no spanning-tree {stp_type} rootguard")
+            elif stp_type in running_state.stp_loopguard:
+                out.append(f"no spanning-tree {stp_type} loopguard")
+
+        return out
+
+    def os9_cleanvlans(intf_label, sw_config, man_fields, default_port, managed_vlan_list):
+        """
+        Create OS9 commands for cleaning vlans
 
         :param intf_label: Label of the interface
         :type: str
-        :param sw_config: Switch config lines
-        :type: list
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
         :param man_fields: Manifest fields for current interface
         :type man_fields: dict
         :param defaulted: If true, this interface is defaulted before executing
         :type defaulted: boolean
         :param default_port: If true, this port is being defaulted
         :type default_port: boolean
-        :return: List of OS9 commands to set tagged
+        :param managed_vlan_list: VLANs that are managed
+        :type managed_vlan_list: set
+        :return: List of (VLAN label, command, member label) to clean vlans
         :rtype: list
         """
 
-        out = []
+        out = []
+
+        if default_port:
+            return out
+
+        for vlan_mode in ["untagged", "tagged"]:
+            if vlan_mode == "tagged" and "tagged" in man_fields:
+                keep_bits = tagged_bits
+            elif vlan_mode == "untagged" and "untagged" in man_fields:
+                keep_bits = vlan_bitmap([man_fields["untagged"]])
+            else:
+                keep_bits = 0
+
+            # Don't remove managed vlan
+            stale_bits = sw_config.get_vlan_bitmap(intf_label, vlan_mode) & ~keep_bits & ~managed_bits
+            if stale_bits == 0:
+                continue
+
+            for existing_vlan in sw_config.get_member_vlans(intf_label, vlan_mode):
+                if stale_bits >> int(existing_vlan.split(" ")[-1]) & 1:
+                    out.append((str(existing_vlan), f"no {vlan_mode}", intf_label))
+
+        return out
+
+    def os9_untagged(intf_label, sw_config, man_fields, default_port):
+        """
+        Create OS9 commands for "untagged" attribute
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param defaulted: If true, this interface is defaulted before executing
+        :type defaulted: boolean
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of (VLAN label, command, member label) to set untagged
+        :rtype: list
+        """
+
+        out = []
+
+        if "untagged" in man_fields:
+            untagged_vlan = str(man_fields["untagged"])
+            vlan_intf_label = f"Vlan {untagged_vlan}"
+
+            if not sw_config.has_vlan_member(untagged_vlan, "untagged", intf_label) or default_port:
+                out.append((vlan_intf_label, "untagged", intf_label))
+
+        return out
+
+    def os9_tagged(intf_label, sw_config, man_fields, default_port):
+        """
+        Create OS9 commands for "tagged" attribute
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param defaulted: If true, this interface is defaulted before executing
+        :type defaulted: boolean
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of (VLAN label, command, member label) to set tagged
+        :rtype: list
+        """
+
+        out = []
+
+        if "tagged" in man_fields:
+            if default_port:
+                missing_bits = tagged_bits
+            else:
+                missing_bits = tagged_bits & ~sw_config.get_vlan_bitmap(intf_label, "tagged")
+
+            if missing_bits:
+                # in manifest order
+                for cur_vlan in tagged_vlans:
+                    if missing_bits >> int(cur_vlan) & 1:
+                        out.append((f"Vlan {str(cur_vlan)}", "tagged", intf_label))
+
+        return out
+
+    def os9_lagmembers(intf_label, sw_config, man_fields, default_port):
+        """
+        Create OS9 commands for "lag-members" attribute
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set lag-members
+        :rtype: list
+        """
+
+        out = []
+
+        if "lag-members" in man_fields:
+            channel_members = man_fields["lag-members"]
+            channel_member_ids = {intf_key(lag_member) for lag_member in channel_members}
+            existing_members = sw_config.get_channel_members(intf_label)
+
+            for lag_member in channel_members:
+                conf_line = f"channel-member {lag_member}"
+
+                if lag_member not in existing_members or default_port:
+                    out.append(conf_line)  # add channel member if not on switch
+
+            for mem_intf_label in existing_members:
+                if intf_key(mem_intf_label) not in channel_member_ids and not default_port:
+                    conf_line = f"no channel-member {mem_intf_label}"
+                    out.insert(0, conf_line)  # remove any existing channel members if they exist
+
+        return out
+
+    def os9_cleanlacpmembers(intf_label, sw_config, man_fields, default_list):
+        """
+        Removed LACP config from ports that need it
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :return: List of OS9 commands to clean LACP interfaces
+        :rtype: list
+        """
+
+        out = []
+
+        # clean existing members
+        member_ids = {intf_key(member) for member in lacp_members}
+        default_ids = {intf_key(default_intf) for default_intf in default_list}
+
+        for member_id, (existing_member, _) in sw_config.get_lacp_members(intf_label).items():
+            if member_id not in member_ids:
+                if member_id in default_ids:
+                    continue
+
+                cur_intf_cfg = []
+
+                cur_intf_cfg.append(f"interface {existing_member}")
+                conf_line = "no port-channel-protocol LACP"
+                cur_intf_cfg.append(conf_line)
+
+                out.append(cur_intf_cfg)
+
+        return out
+
+    def os9_lacpmembersactive(intf_label, sw_config, man_fields):
+        """
+        Create OS9 commands for "lag-members-active" attribute
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :return: List of OS9 commands to set lag-members-active
+        :rtype: list
+        """
+
+        out = []
+
+        if "lacp-members-active" in man_fields:
+            channel_members = man_fields["lacp-members-active"]
+
+            existing_members = sw_config.get_lacp_members(intf_label)
+
+            for lag_member in channel_members:
+                conf_line = f"{intf_label.lower()} mode active"
+                if existing_members.get(intf_key(lag_member), ("", ""))[1] != "active":
+                    cur_intf_cfg = []
+
+                    cur_intf_cfg.append(f"interface {lag_member}")
+                    cur_intf_cfg.append("port-channel-protocol LACP")
+                    cur_intf_cfg.append(conf_line)
+
+                    out.append(cur_intf_cfg)
+
+        return out
+
+    def os9_lacpmemberspassive(intf_label, sw_config, man_fields):
+        """
+        Create OS9 commands for "lag-members-passive" attribute
+
+        :param intf_label: Label of the interface
+        :type: str
+        :param sw_config: Parsed switch config
+        :type: OS9ConfigTree
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :return: List of OS9 commands to set lag-members-passive
+        :rtype: list
+        """
+
+        out = []
+
+        if "lacp-members-passive" in man_fields:
+            channel_members = man_fields["lacp-members-passive"]
+
+            existing_members = sw_config.get_lacp_members(intf_label)
+
+            for lag_member in channel_members:
+                conf_line = f"{intf_label.lower()} mode passive"
+                if existing_members.get(intf_key(lag_member), ("", ""))[1] != "passive":
+                    cur_intf_cfg = []
+
+                    cur_intf_cfg.append(f"interface {lag_member}")
+                    cur_intf_cfg.append("port-channel-protocol LACP")
+                    cur_intf_cfg.append(conf_line)
+
+                    out.append(cur_intf_cfg)
+
+        return out
+
+    def os9_lacprate(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "lacp-rate" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set lacp-rate
+        :rtype: list
+        """
+
+        out = []
+
+        if "lacp-rate" in man_fields:
+            if man_fields["lacp-rate"] == "fast":
+                conf_line = "lacp fast-switchover"
+
+                if not running_state.lacp_fast_switchover or default_port:
+                    out.append(conf_line)
+
+        elif running_state.lacp_fast_switchover and not default_port:
+            out.append("no lacp fast-switchover")
+
+        return out
+
+    def os9_mlag(man_fields, running_state, default_port):
+        """
+        Create OS9 commands for "mlag" attribute
+
+        :param man_fields: Manifest fields for current interface
+        :type man_fields: dict
+        :param running_state: Interface attributes in the running config
+        :type running_state: OS9IntfState
+        :param default_port: If true, this port is being defaulted
+        :type default_port: boolean
+        :return: List of OS9 commands to set mlag
+        :rtype: list
+        """
+
+        out = []
+
+        if "mlag" in man_fields:
+            conf_line = f"vlt-peer-lag {man_fields['mlag'].lower()}"
+            if running_state.vlt_peer_lag != man_fields["mlag"].lower() or default_port:
+                out.append(conf_line)
+
+        elif running_state.vlt_peer_lag is not None and not default_port:
+            out.append("no vlt-peer-lag")
+
+        return out
+
+    #
+    # Combine all configuration for the interface
+    #
+
+    running_state = OS9_GETINTFSTATE(intf_label, sw_config)
+
+    if tagged_vlans is None:
+        tagged_vlans = os9_expandvlans(intf_fields.get("tagged", []))
+
+    if lacp_members is None:
+        lacp_members = os9_lacpmembers(intf_fields)
+
+    # VLAN sets as bitmaps, a trunk that is already converged is diffed with a few bitwise operations
+    tagged_bits = vlan_spec_bitmap(intf_fields.get("tagged", []))
+    managed_bits = managed_vlan_list if isinstance(managed_vlan_list, int) else vlan_bitmap(managed_vlan_list)
+
+    cur_intf_cfg = []
+    output = []
+
+    portmode_out,default_port = os9_portmode(intf_fields, running_state)
+    if default_port:
+        default_list.append(intf_label)
+
+    # General
+    cur_intf_cfg += os9_name(intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_description(intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_state(intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_mtu(intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_autoneg(intf_label, intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_fec(intf_fields, running_state, default_port)
+    # L3
+    cur_intf_cfg += os9_ip4(intf_fields, running_state, default_port)
+    cur_intf_cfg += os9_ip6(intf_fields, running_state, default_port)
+    # LAG
+    cur_intf_cfg += os9_lagmembers(intf_label, sw_config, intf_fields, default_port)
+    cur_intf_cfg += os9_lacprate(intf_fields, running_state, default_port)
+
+    # VLAN interfaces / L2
+    cur_intf_cfg += portmode_out
+    cur_intf_cfg += os9_mlag(intf_fields, running_state, default_port)
+    # STP
+    cur_intf_cfg += os9_stp(intf_fields, running_state, default_port)
+
+    # these are controlling the VLAN interfaces, so they either get grouped per VLAN by the caller
+    # or go directly to output
+    with profile_stage("vlan_cleanup"):
+        vlan_change_list = os9_cleanvlans(intf_label, sw_config, intf_fields, default_port, managed_vlan_list)
+    vlan_change_list += os9_untagged(intf_label, sw_config, intf_fields, default_port)
+    vlan_change_list += os9_tagged(intf_label, sw_config, intf_fields, default_port)
+
+    if vlan_changes is None:
+        output += [[f"interface {vlan_label}", f"{command} {member}"] for vlan_label, command, member in vlan_change_list]
+    else:
+        vlan_changes += vlan_change_list
+
+    # These change physical interfaces
+    with profile_stage("lacp_cleanup"):
+        lacp_members_cleaned = os9_cleanlacpmembers(intf_label, sw_config, intf_fields, default_list)
+    output += lacp_members_cleaned
+
+    lacp_members_active_list = os9_lacpmembersactive(intf_label, sw_config, intf_fields)
+    output += lacp_members_active_list
+
+    lacp_members_passive_list = os9_lacpmemberspassive(intf_label, sw_config, intf_fields)
+    output += lacp_members_passive_list
+
+    # add interface config line
+    if len(cur_intf_cfg) > 0:
+        cur_intf_cfg.insert(0, f"interface {intf_label}")
+
+        if default_port:
+            port_type = getattr(intf_id(intf_label), "type", None)
+            if port_type in physical_intf_types:
+                # this is a physical interface
+                cur_intf_cfg.insert(0, f"default interface {intf_label}")
+            elif port_type in lag_intf_types:
+                # this is a port channel, so it just needs to be delete
+                cur_intf_cfg.insert(0, f"no interface {intf_label}")
+
+        output.insert(0, cur_intf_cfg)
+
+    return output,default_list
+
+def OS9_COMPRESSRANGE(intf_list, sw_config):
+    """
+    Compresses a list of interfaces into OS9 range syntax (e.g. "twentyFiveGigE 1/1/1-1/1/4,1/1/7")
+    Only physical interfaces that are next to each other in the running config, on the same unit (and port, for
+    fanned out subports) and with consecutive numbers are joined into a range
+
+    :param intf_list: List of interface labels
+    :type intf_list: list
+    :param sw_config: Parsed switch config
+    :type sw_config: OS9ConfigTree
+    :return: List of interface ranges, one per interface type
+    :rtype: list
+    """
+
+    type_labels = {}  # type key -> type label as written first
+    type_parts = {}  # type key -> list of [first, last, last position, last interface ID]
+
+    positioned = []
+    for intf_label in intf_list:
+        port_id = intf_id(intf_label)
+        pos = sw_config.port_index.get(port_id)
+
+        if pos is None or port_id.type not in physical_intf_types:
+            # not in the running config (or a logical interface), has to stay on its own
+            pos = None
+
+        positioned.append((pos, intf_label, port_id))
+
+    # ranges follow config order, anything else keeps its original order
+    positioned.sort(key=lambda item: (item[0] is None, item[0] or 0))
+
+    for pos, intf_label, port_id in positioned:
+        intf_type, intf_num = intf_label.split(" ", 1)
+        type_key = intf_type.lower() if port_id is None else port_id.key[:2]
+        type_labels.setdefault(type_key, intf_type)
+        parts = type_parts.setdefault(type_key, [])
+
+        if pos is not None and len(parts) > 0 and parts[-1][2] == pos - 1 and \
+                parts[-1][3].numbers[:-1] == port_id.numbers[:-1] and \
+                parts[-1][3].numbers[-1] == port_id.numbers[-1] - 1:
+            # next to the previous port of the same type, unit and depth
+            parts[-1][1] = intf_num
+            parts[-1][2] = pos
+            parts[-1][3] = port_id
+        else:
+            parts.append([intf_num, intf_num, pos, port_id])
+
+    out = []
+    for type_key, parts in type_parts.items():
+        range_parts = [first if first == last else f"{first}-{last}" for first, last, _, _ in parts]
+        out.append(f"{type_labels[type_key]} {','.join(range_parts)}")
+
+    return out
+
+def OS9_VLANRANGECFG(blocks, sw_config):
+    """
+    Joins the config of consecutive VLANs that get the same commands (e.g. "no shutdown" after a bulk change) into
+    "interface range vlan X - Y" blocks. Only the name and description stay in a block per VLAN.
+    OS9 skips VLANs that don't exist in an interface range, so VLANs that aren't in the running config keep all of
+    their lines in the "interface Vlan N" block that creates them. A range is only used when it replaces at least
+    two blocks, so there are never more blocks (os9_config calls) than without ranges.
+    VLAN membership blocks must not be part of blocks.
+
+    :param blocks: 2D List of os9 commands
+    :type blocks: list
+    :param sw_config: Parsed switch config
+    :type sw_config: OS9ConfigTree
+    :return: 2D List of os9 commands
+    :rtype: list
+    """
+
+    vlan_idx = {}  # vlan id -> block index
+    shared_bits = {}  # shared lines -> bitmap of the VLANs with them
+
+    for idx, block in enumerate(blocks):
+        if not block[0].startswith("interface "):
+            continue
+
+        port_id = intf_id(block[0][len("interface "):])
+        if getattr(port_id, "type", None) not in vlan_intf_types or port_id not in sw_config.intf_index:
+            continue
+
+        shared = tuple(line for line in block[1:] if not line.startswith(vlan_label_lines))
+        if len(shared) > 0:
+            vlan_idx[port_id.numbers[-1]] = idx
+            shared_bits[shared] = shared_bits.get(shared, 0) | 1 << port_id.numbers[-1]
+
+    appended = {}  # block index -> range blocks that go after it
+    replaced = {}  # block index -> block with the per VLAN lines only
+
+    for shared, bitmap in shared_bits.items():
+        for first_vlan, last_vlan in vlan_bitmap_runs(bitmap):
+            if last_vlan - first_vlan + 1 < vlan_range_min:
+                continue
+
+            run_idx = [vlan_idx[vlan_id] for vlan_id in range(first_vlan, last_vlan + 1)]
+            run_blocks = {idx: [blocks[idx][0]] +
+                          [line for line in blocks[idx][1:] if line.startswith(vlan_label_lines)]
+                          for idx in run_idx}
+
+            # the range is one more block, it has to make at least two VLAN blocks empty
+            if sum(1 for block in run_blocks.values() if len(block) == 1) < 2:
+                continue
+
+            appended.setdefault(max(run_idx), []).append([f"interface range vlan {first_vlan} - {last_vlan}"] +
+                                                         list(shared))
+            replaced.update(run_blocks)
+
+    out = []
+
+    for idx, block in enumerate(blocks):
+        block = replaced.get(idx, block)
+        if len(block) > 1:
+            out.append(block)
+
+        out += appended.get(idx, [])
+
+    return out
+
+def OS9_VLANMEMBERCFG(vlan_changes, sw_config):
+    """
+    Groups VLAN membership changes into one block per VLAN, using OS9 range syntax for the members
+    All removals come before any additions, so untagged ports can move between VLANs
+
+    :param vlan_changes: List of (VLAN label, command, member label)
+    :type vlan_changes: list
+    :param sw_config: Parsed switch config
+    :type sw_config: OS9ConfigTree
+    :return: 2D List of os9 commands
+    :rtype: list
+    """
+
+    removals = {}  # vlan label -> {command: {member label: None}}
+    additions = {}
+
+    for vlan_label, command, member in vlan_changes:
+        target = removals if command.startswith("no ") else additions
+        target.setdefault(vlan_label, {}).setdefault(command, {})[member] = None
+
+    out = []
+
+    for changes, command_order in [(removals, ["no untagged", "no tagged"]), (additions, ["untagged", "tagged"])]:
+        for vlan_label, commands in changes.items():
+            cur_intf_cfg = [f"interface {vlan_label}"]
+
+            for command in command_order:
+                if command in commands:
+                    for range_str in OS9_COMPRESSRANGE(list(commands[command]), sw_config):
+                        cur_intf_cfg.append(f"{command} {range_str}")
+
+            out.append(cur_intf_cfg)
+
+    return out
+
+def os9_fanoutplan(sw_tree, manifest):
+    """
+    Compares the fanouts of the manifest with the running config
+
+    :param sw_tree: Parsed switch config
+    :type sw_tree: OS9ConfigTree
+    :param manifest: YAML manifest
+    :type manifest: dict
+    :return: Tuple of <list of (unit, port) to remove>,<list of (unit, port) to add>,
+             <dict of (unit, port) -> (parent label, portmode, speed) from the manifest>
+    :rtype: tuple
+    """
+
+    manifest_fanouts = {}  # (unit, port) -> (parent label, portmode, speed)
+
+    for intf,items in manifest.items():
+        if "fanout" in items:
+            # this is a fanout interface
+            port_id = intf_id(intf)
+            if port_id is None or len(port_id.numbers) != 2:
+                raise ValueError(f"fanout interface {intf} is not a unit/port label")
+
+            manifest_fanouts[port_id.numbers] = (intf, items["fanout"]["type"], items["fanout"]["speed"])
+
+    def converged(unit_port):
+        # a fanout without a speed in the running config matches any speed, like before
+        fanout = sw_tree.fanouts.get(unit_port)
+        manifest_fanout = manifest_fanouts.get(unit_port)
+
+        return fanout is not None and manifest_fanout is not None and fanout[1] == manifest_fanout[1] and \
+            fanout[2] in (None, str(manifest_fanout[2]))
+
+    removed = [unit_port for unit_port in sw_tree.fanouts if not converged(unit_port)]
+    added = [unit_port for unit_port in manifest_fanouts if not converged(unit_port)]
+
+    return removed, added, manifest_fanouts
+
+@profiled
+def OS9_FANOUTCFG(sw_config, manifest):
+    """
+    This method will create OS9 commands for fanout interfaces, on any unit of a stack
+    Fanouts that are removed or changed are undone first (subports defaulted, then the portmode removed),
+    then the parents of new fanouts are defaulted and the fanouts added, so the list can be pushed in one go.
+
+    :param sw_config: Switch configuration
+    :type sw_config: dict
+    :param manifest: YAML manifest
+    :type manifest: dict
+    :return: List of OS9 commands
+    :rtype: list
+    """
+
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    removed, added, manifest_fanouts = os9_fanoutplan(sw_tree, manifest)
+
+    out = []
+
+    # Remove fanouts that need to be removed (or changed)
+    for unit_port in removed:
+        for child_label in sw_tree.unit_ports.get(unit_port, {"children": []})["children"]:
+            out.append(f"default interface {child_label}")
+
+    for unit_port in removed:
+        conf_line = sw_tree.fanouts[unit_port][0]
+
+        conf_line_index = conf_line.find(" speed ")
+        if conf_line_index != -1:
+            conf_line = conf_line[:conf_line_index]
+
+        out.append(f"no {conf_line} no-confirm")
+
+    # Add fanouts that need to be added
+    for unit_port in added:
+        parent_label = sw_tree.unit_ports.get(unit_port, {"parent": None})["parent"]
+        if parent_label is None:
+            # fanned out with other settings right now, it comes back with the label of the manifest
+            parent_label = manifest_fanouts[unit_port][0]
+
+        out.append(f"default interface {parent_label}")
+
+    for unit_port in added:
+        _, fanout_type, fanout_speed = manifest_fanouts[unit_port]
+        out.append(f"stack-unit {unit_port[0]} port {unit_port[1]} portmode {fanout_type} speed {fanout_speed} no-confirm")
+
+    return out
+
+@profiled
+def OS9_PREDICTFANOUT(sw_config, manifest):
+    """
+    Predicts the running config after the commands of OS9_FANOUTCFG, so it doesn't have to be gathered again
+    Subports of removed fanouts are replaced by their defaulted parent, parents of new fanouts by defaulted subports.
+    There is no prediction if a replaced port is a VLAN or port-channel member (OS9 changes those blocks too),
+    or if the type of a new port isn't known (only "quad" fanouts of fanout_child_types are, and parents that
+    are in the manifest).
+
+    :param sw_config: Switch configuration
+    :type sw_config: dict
+    :param manifest: YAML manifest
+    :type manifest: dict
+    :return: Switch configuration like the registered result of os9_facts, with "predicted" set to false if the
+             config has to be gathered from the switch instead
+    :rtype: dict
+    """
+
+    conf_text = sw_config["ansible_facts"]["ansible_net_config"]
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    removed, added, manifest_fanouts = os9_fanoutplan(sw_tree, manifest)
+
+    def result(text, predicted):
+        return {"ansible_facts": {"ansible_net_config": text}, "predicted": predicted}
+
+    if len(removed) == 0 and len(added) == 0:
+        return result(conf_text, True)
+
+    lacp_member_keys = {member_key for members in sw_tree.lacp_members.values() for member_key in members}
+
+    def referenced(intf_label):
+        return len(sw_tree.get_member_vlans(intf_label, "tagged")) > 0 or \
+            len(sw_tree.get_member_vlans(intf_label, "untagged")) > 0 or \
+            intf_key(intf_label) in lacp_member_keys or \
+            any(intf_label in channel_range for channel_range in sw_tree.channel_members.values())
+
+    # labels of the unit/port interfaces in the manifest, the type of a parent that comes back is only known from there
+    manifest_ports = {}
+    for key in manifest:
+        port_id = intf_id(key)
+        if port_id is not None and port_id.type in physical_intf_types and len(port_id.numbers) == 2:
+            manifest_ports[port_id.numbers] = port_id.label
+
+    replaced = {}  # header of a dropped block -> lines that take its place
+    dropped_fanouts = set()  # stack-unit lines of removed fanouts
+
+    for unit_port in removed:
+        unit_port_labels = sw_tree.unit_ports.get(unit_port, {"parent": None, "children": []})
+        if unit_port not in manifest_ports or any(referenced(label) for label in unit_port_labels["children"]):
+            return result(conf_text, False)
+
+        parent_lines = [f"interface {manifest_ports[unit_port]}"]
+        parent_lines += [f" {line}" for line in default_intf_lines]
+
+        for idx, child_label in enumerate(unit_port_labels["children"]):
+            replaced[f"interface {child_label}"] = parent_lines if idx == 0 else []
+
+        dropped_fanouts.add(sw_tree.fanouts[unit_port][0])
+
+    added_fanouts = []
+    for unit_port in added:
+        _, fanout_type, fanout_speed = manifest_fanouts[unit_port]
+        child_type = fanout_child_types.get(str(fanout_speed))
+
+        parent_label = sw_tree.unit_ports.get(unit_port, {"parent": None})["parent"]
+        if parent_label is None:
+            parent_label = intf_id(manifest_fanouts[unit_port][0]).label
+
+        if fanout_type != "quad" or child_type is None or referenced(parent_label):
+            return result(conf_text, False)
+
+        child_lines = []
+        for child in range(1, 5):
+            child_lines.append(f"interface {child_type} {unit_port[0]}/{unit_port[1]}/{child}")
+            child_lines += [f" {line}" for line in default_intf_lines]
+
+        if unit_port in removed:
+            # fanned out with other settings, the new subports take the place of the old ones
+            old_children = sw_tree.unit_ports.get(unit_port, {"children": []})["children"]
+            if len(old_children) == 0:
+                return result(conf_text, False)
+
+            replaced[f"interface {old_children[0]}"] = child_lines
+        else:
+            replaced[f"interface {parent_label}"] = child_lines
+
+        added_fanouts.append(f"stack-unit {unit_port[0]} port {unit_port[1]} portmode {fanout_type} speed {fanout_speed}")
+
+    out = []
+    dropping = False
+    last_fanout_idx = None
+    first_intf_idx = None
+
+    for line in conf_text.splitlines():
+        if not line.startswith((" ", "!")) and line.strip() != "":
+            # top level line, starts a new block
+            header = line.rstrip()
+            dropping = header in replaced or header in dropped_fanouts
+
+            if header.startswith("interface ") and first_intf_idx is None:
+                first_intf_idx = len(out)
+
+            if header in replaced:
+                out += replaced[header]
+                continue
+
+        if dropping and not line.startswith("!"):
+            continue
+
+        out.append(line)
+
+        if line.startswith("stack-unit ") and " portmode " in line:
+            last_fanout_idx = len(out)
+
+    # new fanouts go after the existing ones, or before the first interface
+    insert_idx = last_fanout_idx if last_fanout_idx is not None else first_intf_idx
+    if insert_idx is None:
+        insert_idx = len(out)
+    out[insert_idx:insert_idx] = added_fanouts
+
+    return result("\n".join(out) + "\n", True)
+
+@profiled
+def OS9_CLEANINTF(sw_config, manifest, vlans, scope=None, reset_ports=False):
+    """
+    This method will create os9 commands to delete interfaces that have been removed from the manifest
+    This can happen when a vlan interface or a port channel is deleted. With reset_ports, physical ports that are
+    configured but not in the manifest (nor a member of a port-channel in it) are defaulted as well, unless they
+    only have the default config and an admin state (see clean_ignored_lines).
+    All of it is collected in one pass over the interfaces, as one list to push at once. Consecutive VLANs and
+    port-channels are deleted with one "no interface range" line, neighbouring ports (see OS9_COMPRESSRANGE) are
+    defaulted with one "default interface range" line.
+
+    :param sw_config: existing switch config
+    :type sw_config: dict
+    :param manifst: interface manifest from YAML
+    :type manifest: dict
+    :param vlans: vlan manifest from YAML
+    :type vlans: dict
+    :param scope: If set, only these interfaces and VLANs are cleaned (see OS9Scope)
+    :type scope: list
+    :param reset_ports: If true, physical ports that were removed from the manifest are defaulted
+    :type reset_ports: bool
+    :return: List of os9 commands
+    :rtype: list
+    """
+
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    scope = OS9Scope(scope) if scope else None
+
+    manifest_ids = {intf_key(key) for key in manifest}
+
+    # ports the manifest still uses without an entry of their own, LAG members and members of managed port-channels
+    member_ids = set()
+    if reset_ports:
+        for key, fields in manifest.items():
+            members = list(fields.get("lag-members", [])) + list(os9_lacpmembers(fields))
+            if fields.get("managed") and getattr(intf_id(key), "type", None) in lag_intf_types:
+                members += list(sw_tree.get_channel_members(key))
+                members += [member_label for member_label, _ in sw_tree.get_lacp_members(key).values()]
+
+            member_ids.update(intf_key(member) for member in members)
+
+    ignored_lines = set(clean_ignored_lines)
+
+    reset_labels = []
+    deleted = {"port-channel": {}, "vlan": {}}  # range keyword -> {number: running config header}
+
+    for port_id, block in sw_tree.intf_index.items():
+        line = block.header
+        if line == "interface Vlan 1":
+            # skip default vlan
+            continue
+
+        port_type = getattr(port_id, "type", None)
+        if port_type is None:
+            continue
+
+        if scope is not None and not scope.match(line[len("interface "):]):
+            continue
+
+        if port_type in vlan_intf_types:
+            if port_id.numbers[-1] not in vlans:
+                deleted["vlan"][port_id.numbers[-1]] = line
+
+        elif port_type in lag_intf_types:
+            if port_id not in manifest_ids:
+                deleted["port-channel"][port_id.numbers[-1]] = line
+
+        elif port_type in physical_intf_types and reset_ports:
+            if port_id in manifest_ids or port_id in member_ids:
+                continue
+
+            if not ignored_lines.issuperset(block.lines):
+                reset_labels.append(line[len("interface "):])
+
+    out = []
+
+    # ports first, they can be members of the port-channels that are deleted
+    for range_str in OS9_COMPRESSRANGE(reset_labels, sw_tree):
+        intf_type, intf_nums = range_str.split(" ", 1)
+        if "," not in intf_nums and "-" not in intf_nums:
+            out.append(f"default interface {range_str}")
+            continue
+
+        # interface range syntax repeats the type and only gives the port number of the last port
+        range_parts = []
+        for intf_num in intf_nums.split(","):
+            first, _, last = intf_num.partition("-")
+            range_parts.append(f"{intf_type} {first}" + (f" - {last.split('/')[-1]}" if last else ""))
+        out.append(f"default interface range {' , '.join(range_parts)}")
+
+    for range_keyword, headers in deleted.items():
+        for first, last in vlan_bitmap_runs(vlan_bitmap(headers)):
+            if last - first + 1 < vlan_range_min:
+                out += [f"no {headers[number]}" for number in range(first, last + 1)]
+            else:
+                out.append(f"no interface range {range_keyword} {first} - {last}")
+
+    return out
+
+@profiled
+def OS9_SYSTEMCFG(sw_config, settings):
+    """
+    Creates the os9 commands for the global settings that differ from the running config, as one block
+    The settings are "hostname", "ssh_connection_rate_limit" and "stp_protocol" (one of stp_protocols, the other
+    protocols are disabled), a setting that is missing or None is not managed.
+
+    :param sw_config: Running switch config
+    :type sw_config: dict
+    :param settings: Global settings
+    :type settings: dict
+    :return: List of os9 commands, empty if the switch already has these settings
+    :rtype: list
+    """
+
+    sw_tree = OS9_PARSECONFIG(sw_config)
+
+    out = []
+
+    for setting, value in settings.items():
+        if value is None or setting == "stp_protocol":
+            continue
+
+        if setting not in system_setting_lines:
+            raise ValueError(f"Unknown system setting {setting}")
+
+        conf_line = system_setting_lines[setting].format(value)
+        block = sw_tree.get(conf_line)
+        if block is None or block.header != conf_line:
+            # compared as written, so a hostname that only differs in case is changed as well
+            out.append(conf_line)
+
+    stp_protocol = settings.get("stp_protocol")
+    if stp_protocol is not None:
+        if stp_protocol not in stp_protocols:
+            raise ValueError(f"Unknown spanning tree protocol {stp_protocol}")
+
+        # the running protocols are disabled first, these are sub-modes so they go after the global lines
+        stp_lines = None
+        for protocol in stp_protocols:
+            block = sw_tree.get(f"protocol spanning-tree {protocol}")
+            enabled = block is not None and "no disable" in block.lines
+
+            if protocol != stp_protocol and enabled:
+                out += [f"protocol spanning-tree {protocol}", "disable"]
+            elif protocol == stp_protocol and not enabled:
+                stp_lines = [f"protocol spanning-tree {protocol}", "no disable"]
+
+        if stp_lines is not None:
+            out += stp_lines
+
+    return out
+
+def os9_lacpmembers(intf_fields):
+    """
+    Resolves the LACP members of a manifest entry
+
+    :param intf_fields: Fields from manifest of interface
+    :type intf_fields: dict
+    :return: Dict of member label -> "active" or "passive"
+    :rtype: dict
+    """
+
+    out = {}
+
+    for mode in ["passive", "active"]:
+        for member in intf_fields.get(f"lacp-members-{mode}", []):
+            out[member] = mode
+
+    return out
+
+def OS9_COMPILEMANIFEST(intf, vlans, sources=None):
+    """
+    Normalizes the interface and VLAN manifests of a switch into one artifact, which the filters take as compiled=
+    The artifact is plain JSON, so it can be saved and reused until its sources change (see helpers/os9_compile.py)
+    Not profiled on its own, it has no switch facts to name the profile after; called by a filter it is part of that
+    filter's profile.
+
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param sources: Hashes of the source files, only stored in the artifact
+    :type sources: dict
+    :return: Dict of "version", "sources", "manifest" (merged manifest keyed by interface label, VLANs as "Vlan N"),
+             "managed_vlans" (list of VLAN IDs), "tagged_vlans" (interface label -> expanded list of VLAN IDs),
+             "lacp_members" (port-channel label -> {member label: mode}) and "lag_members" (port-channel label ->
+             list of member labels)
+    :rtype: dict
+    """
+
+    managed_vlan_list = [str(key) for key, value in vlans.items() if "managed" in value and value["managed"]]
+    vlans = {"Vlan " + str(key): value for key, value in vlans.items()}
+    manifest = merge_dicts(vlans, intf)
+
+    tagged_vlans = {}
+    lacp_members = {}
+    lag_members = {}
+
+    for key, fields in manifest.items():
+        if "tagged" in fields:
+            tagged_vlans[key] = os9_expandvlans(fields["tagged"])
+
+        members = os9_lacpmembers(fields)
+        if len(members) > 0:
+            lacp_members[key] = members
+
+        if "lag-members" in fields:
+            lag_members[key] = list(fields["lag-members"])
+
+    return {
+        "version": compiled_manifest_version,
+        "sources": sources or {},
+        "manifest": manifest,
+        "managed_vlans": managed_vlan_list,
+        "tagged_vlans": tagged_vlans,
+        "lacp_members": lacp_members,
+        "lag_members": lag_members
+    }
+
+def os9_manifest(intf, vlans, compiled=None):
+    """
+    Returns the compiled manifest, compiling it from the interface and VLAN manifests if it isn't given
+
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param compiled: Compiled manifest (from OS9_COMPILEMANIFEST), used instead of intf and vlans if set
+    :type compiled: dict
+    :return: Compiled manifest
+    :rtype: dict
+    """
+
+    if compiled:
+        if compiled.get("version") != compiled_manifest_version:
+            raise ValueError(f"compiled manifest has version {compiled.get('version')}, "
+                             f"expected {compiled_manifest_version}, compile it again")
+        return compiled
+
+    return OS9_COMPILEMANIFEST(intf, vlans)
+
+def fingerprint(value):
+    """
+    Hashes a JSON compatible value
+
+    :param value: Value to hash
+    :return: Hex digest
+    :rtype: str
+    """
+
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+def os9_fingerprints(sw_tree, manifest, managed_vlan_list):
+    """
+    Fingerprints every manifest entry that gets planned, together with the running config it is planned against
+    That is the block of the interface (without VLAN/channel membership lines), the VLANs it is a member of and
+    for port-channels their members. If neither fingerprint of an interface changed since a run where its plan
+    was empty, its plan is still empty.
+
+    :param sw_tree: Parsed switch config
+    :type sw_tree: OS9ConfigTree
+    :param manifest: Merged manifest
+    :type manifest: dict
+    :param managed_vlan_list: List of VLANs that are managed
+    :type managed_vlan_list: list
+    :return: Dict of "version", "context" (fingerprint of what all interfaces depend on) and
+             "interfaces" (interface label -> [manifest fingerprint, running config fingerprint])
+    :rtype: dict
+    """
+
+    out = {
+        "version": fingerprint_version,
+        "context": fingerprint(sorted(managed_vlan_list)),
+        "interfaces": {}
+    }
+
+    for key, fields in manifest.items():
+        if ("managed" in fields and fields["managed"]) or "fanout" in fields:
+            continue
 
-        if "tagged" in man_fields:
-            tagged_vllist = getTaggedVlanList(man_fields["tagged"])
-        else:
-            tagged_vllist = []
+        block = sw_tree.get(f"interface {key}")
+        running = {
+            "lines": [] if block is None else [line for line in block.lines if line.split(" ")[0] not in range_line_keys],
+            "untagged": sw_tree.get_member_vlans(key, "untagged"),
+            "tagged": sw_tree.get_member_vlans(key, "tagged")
+        }
 
-        if "tagged" in man_fields:
-            for cur_vlan in tagged_vllist:
-                vlan_intf_label = f"Vlan {str(cur_vlan)}"
+        if getattr(intf_id(key), "type", None) in lag_intf_types:
+            running["channel_members"] = list(sw_tree.get_channel_members(key))
+            running["lacp_members"] = list(sw_tree.get_lacp_members(key).values())
 
-                vlan_running_fields = OS9_GETINTFCONFIG(vlan_intf_label, sw_config)
-                conf_line = f"tagged {intf_label}"
+        out["interfaces"][key] = [fingerprint(fields), fingerprint(running)]
 
-                if conf_line not in vlan_running_fields or default_port:
-                    cur_intf_cfg = []
+    return out
 
-                    cur_intf_cfg.append(f"interface {vlan_intf_label}")
-                    cur_intf_cfg.append(conf_line)
-                    out.append(cur_intf_cfg)
+def os9_unchanged(fingerprints, state):
+    """
+    Finds the interfaces that didn't change since the fingerprints in state were taken
+
+    :param fingerprints: Current fingerprints, as returned by os9_fingerprints
+    :type fingerprints: dict
+    :param state: Fingerprints of converged interfaces from an earlier run (as returned by OS9_FINGERPRINTS), or None
+    :type state: dict
+    :return: Set of interface labels
+    :rtype: set
+    """
 
-        return out
+    if not state or state.get("version") != fingerprints["version"] or state.get("context") != fingerprints["context"]:
+        return set()
 
-    def os9_lagmembers(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "lag-members" attribute
+    state_interfaces = state.get("interfaces", {})
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set lag-members
-        :rtype: list
-        """
+    return {key for key, value in fingerprints["interfaces"].items() if state_interfaces.get(key) == value}
 
-        out = []
+@profiled
+def OS9_FINGERPRINTS(sw_config, intf, vlans, state=None, compiled=None):
+    """
+    Fingerprints the interfaces that are converged (have an empty plan) in the running config
+    Run this on the config gathered after a successful apply, and pass the result as state to the next plan.
+    Interfaces that are unchanged since state was taken are converged without having to plan them again.
 
-        if "lag-members" in man_fields:
-            channel_members = man_fields["lag-members"]
+    :param sw_config: Running switch config
+    :type sw_config: dict
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param state: Fingerprints of an earlier run
+    :type state: dict
+    :param compiled: Compiled manifest (from OS9_COMPILEMANIFEST), used instead of intf and vlans if set
+    :type compiled: dict
+    :return: Fingerprints of the converged interfaces
+    :rtype: dict
+    """
 
-            for lag_member in channel_members:
-                conf_line = f"channel-member {lag_member}"
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    compiled = os9_manifest(intf, vlans, compiled)
+    manifest = compiled["manifest"]
+    managed_vlan_list = set(compiled["managed_vlans"])
 
-                if conf_line not in running_fields or default_port:
-                    out.append(conf_line)  # add channel member if not on switch
+    fingerprints = os9_fingerprints(sw_tree, manifest, managed_vlan_list)
+    unchanged = os9_unchanged(fingerprints, state)
 
-            for cfg_line in running_fields:
-                if cfg_line.startswith("channel-member"):
-                    mem_intf_label = " ".join(cfg_line.split(" ")[1:])
-                    if mem_intf_label not in channel_members and not default_port:
-                        conf_line = f"no channel-member {mem_intf_label}"
-                        out.insert(0, conf_line)  # remove any existing channel members if they exist
+    converged = {}
+    for key, value in fingerprints["interfaces"].items():
+        if key not in unchanged:
+            vlan_changes = []
+            intf_lines, _ = OS9_GENERATEINTFCONFIG(key, manifest[key], sw_tree, managed_vlan_list, [], vlan_changes,
+                                                   compiled["tagged_vlans"].get(key, []),
+                                                   compiled["lacp_members"].get(key, {}))
+            if len(intf_lines) > 0 or len(vlan_changes) > 0:
+                continue
 
-        return out
+        converged[key] = value
 
-    def os9_cleanlacpmembers(intf_label, sw_config, man_fields, default_list):
-        """
-        Removed LACP config from ports that need it
+    fingerprints["interfaces"] = converged
 
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to clean LACP interfaces
-        :rtype: list
-        """
+    return fingerprints
 
-        out = []
+@profiled
+def OS9_PLANSTATS(sw_config, intf, vlans, state=None, compiled=None):
+    """
+    Counts the interfaces that OS9_GETCONFIG plans and skips with the given state
 
-        # clean existing members
-        existing_member_list = os9_searchconfig(sw_config, physical_interface_types, ["port-channel"], intf_label)
+    :param sw_config: Running switch config
+    :type sw_config: dict
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param state: Fingerprints of an earlier run (as returned by OS9_FINGERPRINTS)
+    :type state: dict
+    :param compiled: Compiled manifest (from OS9_COMPILEMANIFEST), used instead of intf and vlans if set
+    :type compiled: dict
+    :return: Dict of interfaces, planned and skipped
+    :rtype: dict
+    """
 
-        for existing_member in existing_member_list:
-            if not("lacp-members-active" in man_fields and existing_member in man_fields["lacp-members-active"]) and\
-               not("lacp-members-passive" in man_fields and existing_member in man_fields["lacp-members-passive"]):
-                if existing_member in default_list:
-                    continue
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    compiled = os9_manifest(intf, vlans, compiled)
 
-                cur_intf_cfg = []
+    fingerprints = os9_fingerprints(sw_tree, compiled["manifest"], compiled["managed_vlans"])
+    skipped = len(os9_unchanged(fingerprints, state))
 
-                cur_intf_cfg.append(f"interface {existing_member}")
-                conf_line = "no port-channel-protocol LACP"
-                cur_intf_cfg.append(conf_line)
+    return {
+        "interfaces": len(fingerprints["interfaces"]),
+        "planned": len(fingerprints["interfaces"]) - skipped,
+        "skipped": skipped
+    }
 
-                out.append(cur_intf_cfg)
+class OS9Scope(object):
+    """
+    Interfaces and VLANs a plan is limited to, e.g. for a quick change to a few ports
+    Entries are interface labels in any spelling ("Te 1/1/1"), globs on interface labels matched case-insensitively
+    ("TenGigabitEthernet 1/1/*") or VLAN IDs and ranges ("100", "100:110"). A VLAN covers its VLAN interface and
+    the membership of every interface in it.
+    """
 
-        return out
+    def __init__(self, scope):
+        """
+        :param scope: List of entries, or a string of comma separated entries
+        :type scope: list
+        """
 
-    def os9_lacpmembersactive(intf_label, sw_config, man_fields):
+        if isinstance(scope, str):
+            scope = scope.split(",")
+
+        self.intf_ids = set()  # interface keys
+        self.patterns = []  # lower case globs
+        self.vlan_ids = set()
+
+        for entry in scope:
+            entry = str(entry).strip()
+
+            if re.fullmatch(r"\d+([:-]\d+)?", entry):
+                for vlan_id in os9_expandvlans([entry.replace("-", ":")]):
+                    self.vlan_ids.add(vlan_id)
+                    self.intf_ids.add(intf_key(f"Vlan {vlan_id}"))
+            elif any(glob_char in entry for glob_char in "*?["):
+                # a type written out in any spelling ("te 1/1/*") is matched as the canonical type
+                type_name, _, numbers = entry.partition(" ")
+                intf_type = intf_type_spellings.get(type_name.lower())
+                if intf_type is not None and numbers != "":
+                    entry = f"{intf_type_names[intf_type]} {numbers}"
+                self.patterns.append(entry.lower())
+            elif len(entry) > 0:
+                port_id = intf_key(entry)
+                self.intf_ids.add(port_id)
+                if getattr(port_id, "type", None) in vlan_intf_types:
+                    self.vlan_ids.add(str(port_id.numbers[-1]))
+
+    def match(self, intf_label):
         """
-        Create OS9 commands for "lag-members-active" attribute
+        Checks if an interface is in scope by itself
 
         :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to set lag-members-active
-        :rtype: list
+        :type intf_label: str
+        :return: True if it is in scope
+        :rtype: bool
         """
 
-        out = []
+        if intf_key(intf_label) in self.intf_ids:
+            return True
 
-        if "lacp-members-active" in man_fields:
-            channel_members = man_fields["lacp-members-active"]
+        if len(self.patterns) == 0:
+            return False
 
-            for lag_member in channel_members:
-                lag_member_fields = OS9_GETINTFCONFIG(lag_member, sw_config)
+        intf_label = str(intf_key(intf_label)).lower()
+        return any(fnmatch.fnmatchcase(intf_label, pattern) for pattern in self.patterns)
 
-                conf_line = f"{intf_label.lower()} mode active"
-                if conf_line not in lag_member_fields:
-                    cur_intf_cfg = []
+def os9_scopeplan(scope, sw_tree, compiled):
+    """
+    Selects the manifest entries a scoped plan has to cover
+    Besides the interfaces in scope these are the port-channels with a member in scope (they add and clean their
+    members) and the interfaces with a membership in a VLAN in scope, of which only that membership is planned.
+    An interface of the latter that has to be defaulted is planned completely, as defaulting it drops all of its
+    memberships.
+
+    :param scope: Scope of the plan
+    :type scope: OS9Scope
+    :param sw_tree: Parsed switch config
+    :type sw_tree: OS9ConfigTree
+    :param compiled: Compiled manifest
+    :type compiled: dict
+    :return: Tuple of <labels planned completely>,<labels planned for VLAN membership only>,<VLAN IDs in scope>
+    :rtype: tuple
+    """
 
-                    cur_intf_cfg.append(f"interface {lag_member}")
-                    cur_intf_cfg.append("port-channel-protocol LACP")
-                    cur_intf_cfg.append(conf_line)
+    manifest = compiled["manifest"]
 
-                    out.append(cur_intf_cfg)
+    selected = {key for key in manifest if scope.match(key)}
 
-        return out
+    # VLAN interfaces that matched a glob bring their membership along as well
+    vlan_ids = set(scope.vlan_ids)
+    for key in selected:
+        port_id = intf_id(key)
+        if getattr(port_id, "type", None) in vlan_intf_types:
+            vlan_ids.add(str(port_id.numbers[-1]))
 
-    def os9_lacpmemberspassive(intf_label, sw_config, man_fields):
-        """
-        Create OS9 commands for "lag-members-passive" attribute
+    selected_ids = {intf_key(key) for key in selected}
 
-        :param intf_label: Label of the interface
-        :type: str
-        :param sw_config: Switch config lines
-        :type: list
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :return: List of OS9 commands to set lag-members-passive
-        :rtype: list
-        """
+    for key, fields in manifest.items():
+        if getattr(intf_id(key), "type", None) not in lag_intf_types or key in selected:
+            continue
 
-        out = []
+        members = list(fields.get("lag-members", [])) + list(compiled["lacp_members"].get(key, {})) + \
+            list(sw_tree.get_channel_members(key)) + \
+            [member_label for member_label, _ in sw_tree.get_lacp_members(key).values()]
 
-        if "lacp-members-passive" in man_fields:
-            channel_members = man_fields["lacp-members-passive"]
+        if any(intf_key(member) in selected_ids for member in members):
+            selected.add(key)
 
-            for lag_member in channel_members:
-                lag_member_fields = OS9_GETINTFCONFIG(lag_member, sw_config)
+    vlan_members = set()
 
-                conf_line = f"{intf_label.lower()} mode passive"
-                if conf_line not in lag_member_fields:
-                    cur_intf_cfg = []
+    if len(vlan_ids) > 0:
+        for key, fields in manifest.items():
+            if key in selected:
+                continue
 
-                    cur_intf_cfg.append(f"interface {lag_member}")
-                    cur_intf_cfg.append("port-channel-protocol LACP")
-                    cur_intf_cfg.append(conf_line)
+            member_vlans = set(compiled["tagged_vlans"].get(key, []))
+            if "untagged" in fields:
+                member_vlans.add(str(fields["untagged"]))
+            for vlan_mode in ["untagged", "tagged"]:
+                member_vlans.update(vlan_label.split(" ")[-1] for vlan_label in sw_tree.get_member_vlans(key, vlan_mode))
 
-                    out.append(cur_intf_cfg)
+            if member_vlans.isdisjoint(vlan_ids):
+                continue
 
-        return out
+            if os9_portmode(fields, sw_tree.get_intf_state(key))[1]:
+                selected.add(key)
+            else:
+                vlan_members.add(key)
 
-    def os9_lacprate(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "lacp-rate" attribute
+    return selected, vlan_members, vlan_ids
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set lacp-rate
-        :rtype: list
-        """
+def os9_plandefaults(sw_tree, work):
+    """
+    Phase one of the parallel planner: decides for every interface if it is defaulted, in manifest order
+
+    :param sw_tree: Parsed switch config
+    :type sw_tree: OS9ConfigTree
+    :param work: List of <label>,<fields>,<tagged VLANs>,<LACP members> per interface, in manifest order
+    :type work: list
+    :return: Tuple of <labels of the defaulted interfaces>,<per interface, the number of them defaulted before it>
+    :rtype: tuple
+    """
 
-        out = []
+    defaulted = []
+    default_counts = []
 
-        if "lacp-rate" in man_fields:
-            if man_fields["lacp-rate"] == "fast":
-                conf_line = "lacp fast-switchover"
+    for intf_label, intf_fields, _, _ in work:
+        default_counts.append(len(defaulted))
+        if os9_portmode(intf_fields, sw_tree.get_intf_state(intf_label))[1]:
+            defaulted.append(intf_label)
 
-                if conf_line not in running_fields or default_port:
-                    out.append(conf_line)
+    return defaulted, default_counts
 
-        elif "lacp fast-switchover" in running_fields and not default_port:
-            out.append("no lacp fast-switchover")
+def os9_generateworker(plan_input, chunks, conn):
+    """
+    Phase two of the parallel planner, runs in a forked worker process: generates the config of slices of the
+    interfaces and sends it back through conn
+    Every interface gets the interfaces defaulted before it as default_list, which is what the serial planner passes
+
+    :param plan_input: Parsed switch config, managed VLANs, work list and the result of os9_plandefaults
+    :type plan_input: dict
+    :param chunks: List of <first index>,<end index> into the work list
+    :type chunks: list
+    :param conn: Write end of the pipe to the planner
+    :type conn: multiprocessing.connection.Connection
+    """
 
-        return out
+    try:
+        out = []
 
-    def os9_mlag(man_fields, running_fields, default_port):
-        """
-        Create OS9 commands for "mlag" attribute
+        for chunk in chunks:
+            for idx in range(*chunk):
+                intf_label, intf_fields, tagged_vlans, lacp_members = plan_input["work"][idx]
+                vlan_changes = []
+                intf_lines, _ = OS9_GENERATEINTFCONFIG(intf_label, intf_fields, plan_input["sw_tree"],
+                                                       plan_input["managed_vlan_list"],
+                                                       plan_input["defaulted"][:plan_input["default_counts"][idx]],
+                                                       vlan_changes, tagged_vlans, lacp_members)
+                out.append((idx, intf_lines, vlan_changes))
+
+        conn.send((True, out))
+    except Exception as e:
+        conn.send((False, f"{e.__class__.__name__}: {e}"))
+    finally:
+        conn.close()
+
+def os9_parallelworkers(workers, work_size):
+    """
+    Returns how many worker processes the planner can use, 0 if it has to plan serially
+    The workers are forked so they share the parsed config, which needs the fork start method and a process that
+    may have children (a daemonic process may not)
+
+    :param workers: Requested number of worker processes
+    :type workers: int
+    :param work_size: Number of interfaces to plan
+    :type work_size: int
+    :return: Number of worker processes
+    :rtype: int
+    """
 
-        :param man_fields: Manifest fields for current interface
-        :type man_fields: dict
-        :param running_fields: Interface attributes in the running config
-        :type running_fields: list
-        :param default_port: If true, this port is being defaulted
-        :type default_port: boolean
-        :return: List of OS9 commands to set mlag
-        :rtype: list
-        """
+    if workers <= 1 or work_size < plan_parallel_min:
+        return 0
 
-        out = []
+    if "fork" not in multiprocessing.get_all_start_methods() or multiprocessing.current_process().daemon:
+        return 0
 
-        if "mlag" in man_fields:
-            conf_line = f"vlt-peer-lag {man_fields['mlag'].lower()}"
-            if conf_line not in running_fields or default_port:
-                out.append(conf_line)
+    return min(workers, work_size // (plan_parallel_min // 2))
 
-        elif any(item.startswith("vlt-peer-lag") for item in running_fields) and not default_port:
-            out.append("no vlt-peer-lag")
+def os9_generateparallel(sw_tree, managed_vlan_list, work, workers):
+    """
+    Generates the config of all interfaces in two phases, the same as generating it serially
+    Phase one decides which interfaces are defaulted (the only state the serial planner carries from one interface to
+    the next), phase two generates the interfaces in slices over forked worker processes. The workers inherit the
+    parsed config instead of getting it pickled, only their results are sent back and merged in manifest order.
+
+    :param sw_tree: Parsed switch config
+    :type sw_tree: OS9ConfigTree
+    :param managed_vlan_list: VLANs that are managed, or their bitmap
+    :type managed_vlan_list: int
+    :param work: List of <label>,<fields>,<tagged VLANs>,<LACP members> per interface, in manifest order
+    :type work: list
+    :param workers: Number of worker processes
+    :type workers: int
+    :return: List of <config>,<VLAN membership changes> per interface, in manifest order
+    :rtype: list
+    """
 
-        return out
+    with profile_stage("plan_defaults"):
+        defaulted, default_counts = os9_plandefaults(sw_tree, work)
+
+    plan_input = {
+        "sw_tree": sw_tree,
+        "managed_vlan_list": managed_vlan_list,
+        "work": work,
+        "defaulted": defaulted,
+        "default_counts": default_counts
+    }
+
+    # a few slices per worker, dealt out in turn, so a run of defaulted or LAG interfaces doesn't hold up one worker
+    chunk_size = -(-len(work) // (workers * 4))
+    chunks = [(start, min(start + chunk_size, len(work))) for start in range(0, len(work), chunk_size)]
+
+    context = multiprocessing.get_context("fork")
+    procs = []
+    for worker in range(workers):
+        recv_conn, send_conn = context.Pipe(duplex=False)
+        proc = context.Process(target=os9_generateworker, args=(plan_input, chunks[worker::workers], send_conn),
+                               daemon=True)
+        proc.start()
+        send_conn.close()
+        procs.append((proc, recv_conn))
+
+    results = [None] * len(work)
+    errors = []
+
+    for proc, recv_conn in procs:
+        try:
+            ok, worker_out = recv_conn.recv()
+        except EOFError:
+            ok, worker_out = False, f"worker exited with code {proc.exitcode}"
+        recv_conn.close()
+        proc.join()
+
+        if not ok:
+            errors.append(worker_out)
+            continue
 
-    #
-    # Combine all configuration for the interface
-    #
+        for idx, intf_lines, vlan_changes in worker_out:
+            results[idx] = (intf_lines, vlan_changes)
 
-    running_config = OS9_GETINTFCONFIG(intf_label, sw_config)
+    if len(errors) > 0:
+        raise ValueError(f"Parallel planning failed: {'; '.join(errors)}")
 
-    cur_intf_cfg = []
-    output = []
+    return results
 
-    portmode_out,default_port = os9_portmode(intf_fields, running_config)
-    if default_port:
-        default_list.append(intf_label)
+@profiled
+def OS9_GETCONFIG(sw_config, intf, vlans, state=None, compiled=None, workers=None, scope=None):
+    """
+    Main method which returns a 2d list of commands, where each nested list is an interface
 
-    # General
-    cur_intf_cfg += os9_name(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_description(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_state(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_mtu(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_autoneg(intf_label, intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_fec(intf_fields, running_config, default_port)
-    # L3
-    cur_intf_cfg += os9_ip4(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_ip6(intf_fields, running_config, default_port)
-    # LAG
-    cur_intf_cfg += os9_lagmembers(intf_fields, running_config, default_port)
-    cur_intf_cfg += os9_lacprate(intf_fields, running_config, default_port)
+    :param sw_config: Running switch config
+    :type sw_config: dict
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param state: If set, interfaces that are unchanged since these fingerprints (from OS9_FINGERPRINTS) are skipped
+    :type state: dict
+    :param compiled: Compiled manifest (from OS9_COMPILEMANIFEST), used instead of intf and vlans if set
+    :type compiled: dict
+    :param workers: Worker processes to generate the interface config with (OS9_PLAN_WORKERS if None), 0 or 1 is serial
+    :type workers: int
+    :param scope: If set, only these interfaces and VLANs are planned (see OS9Scope), a list or comma separated string
+    :type scope: list
+    :return: 2D List os os9 commands
+    :rtype: list
+    """
 
-    # VLAN interfaces / L2
-    cur_intf_cfg += portmode_out
-    cur_intf_cfg += os9_mlag(intf_fields, running_config, default_port)
-    # STP
-    cur_intf_cfg += os9_stp(intf_fields, running_config, default_port)
+    sw_tree = OS9_PARSECONFIG(sw_config)
+    compiled = os9_manifest(intf, vlans, compiled)
+    manifest = compiled["manifest"]
+    managed_vlan_list = set(compiled["managed_vlans"])
 
-    # these go directly to output because they are controlling other interfaces
-    cleanvlan_list = os9_cleanvlans(intf_label, sw_config, intf_fields, default_port, managed_vlan_list)
-    output += cleanvlan_list
+    unchanged = set()
+    if state:
+        with profile_stage("fingerprint"):
+            unchanged = os9_unchanged(os9_fingerprints(sw_tree, manifest, managed_vlan_list), state)
 
-    untag_list = os9_untagged(intf_label, sw_config, intf_fields, default_port)
-    output += untag_list
+    selected = None
+    vlan_members = set()
+    if scope:
+        with profile_stage("scope"):
+            selected, vlan_members, vlan_ids = os9_scopeplan(OS9Scope(scope), sw_tree, compiled)
 
-    tag_list = os9_tagged(intf_label, sw_config, intf_fields, default_port)
-    output += tag_list
+    out = []
+    default_list = []
+    vlan_changes = []
+    work = []
 
-    # These change physical interfaces
-    lacp_members_cleaned = os9_cleanlacpmembers(intf_label, sw_config, intf_fields, default_list)
-    output += lacp_members_cleaned
+    for key,fields in manifest.items():
+        if "managed" in fields and fields["managed"]:
+            # Don't edit managed interfaces
+            continue
 
-    lacp_members_active_list = os9_lacpmembersactive(intf_label, sw_config, intf_fields)
-    output += lacp_members_active_list
+        if "fanout" in fields:
+            # Skip fanouts
+            continue
 
-    lacp_members_passive_list = os9_lacpmemberspassive(intf_label, sw_config, intf_fields)
-    output += lacp_members_passive_list
+        if selected is not None and key not in selected and key not in vlan_members:
+            # out of scope
+            continue
 
-    # add interface config line
-    if len(cur_intf_cfg) > 0:
-        cur_intf_cfg.insert(0, f"interface {intf_label}")
+        if key in unchanged:
+            # converged in an earlier run and nothing changed since
+            profile_count("skipped_interfaces")
+            continue
 
-        if default_port:
-            intf_type = intf_label.split(" ")[0]
-            if intf_type.lower() in physical_interface_types:
-                # this is a physical interface
-                cur_intf_cfg.insert(0, f"default interface {intf_label}")
-            elif intf_type.lower() in lag_interface_types:
-                # this is a port channel, so it just needs to be delete
-                cur_intf_cfg.insert(0, f"no interface {intf_label}")
+        work.append((key, fields, compiled["tagged_vlans"].get(key, []), compiled["lacp_members"].get(key, {})))
+
+    workers = os9_parallelworkers(plan_workers if workers is None else int(workers), len(work))
+    managed_bits = vlan_bitmap(managed_vlan_list)
+
+    if workers > 0:
+        with profile_stage("generate"):
+            results = os9_generateparallel(sw_tree, managed_bits, work, workers)
+    else:
+        results = []
+        for key, fields, tagged_vlans, lacp_members in work:
+            intf_vlan_changes = []
+            with profile_stage("generate"):
+                intf_lines,default_list = OS9_GENERATEINTFCONFIG(key, fields, sw_tree, managed_bits, default_list,
+                                                                 intf_vlan_changes, tagged_vlans, lacp_members)
+            results.append((intf_lines, intf_vlan_changes))
+
+    for (key, _, _, _), (intf_lines, intf_vlan_changes) in zip(work, results):
+        if key in vlan_members:
+            # only in scope through a VLAN, so only its membership of the VLANs in scope is planned
+            vlan_changes += [change for change in intf_vlan_changes if change[0].split(" ")[-1] in vlan_ids]
+            continue
 
-        output.insert(0, cur_intf_cfg)
+        out += intf_lines
+        vlan_changes += intf_vlan_changes
 
-    return output,default_list
+    with profile_stage("vlan_ranges"):
+        out = OS9_VLANRANGECFG(out, sw_tree)
 
-def OS9_FANOUTCFG(sw_config, manifest):
-    """
-    This method will create OS9 commands for fanout interfaces
+    # VLAN membership goes last, once all interfaces are in the right mode
+    with profile_stage("vlan_membership"):
+        out += OS9_VLANMEMBERCFG(vlan_changes, sw_tree)
 
-    :param sw_config: Switch configuration
-    :type sw_config: str
-    :param manifest: YAML manifest
-    :type manifest: dict
-    :return: List of OS9 commands
+    return out
+
+def OS9_ORDERBLOCKS(blocks, sw_config):
+    """
+    Orders a 2D list of os9 commands using an explicit dependency graph between the blocks
+
+    For every interface the blocks touching it are ordered as:
+    LACP cleanup -> default or delete -> own config -> LAG, LACP and VLAN additions
+    and VLAN removals come before VLAN additions (an untagged port can only be in one VLAN)
+    Blocks without a dependency between them keep their original order.
+
+    :param blocks: 2D List of os9 commands (as returned by OS9_GETCONFIG)
+    :type blocks: list
+    :param sw_config: Parsed switch config
+    :type sw_config: OS9ConfigTree
+    :return: 2D List of os9 commands
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
+    roles = {}  # interface key -> {role: [block indexes]}
 
-    out = []
+    def add_role(intf_label, role, idx):
+        roles.setdefault(intf_key(intf_label), {}).setdefault(role, []).append(idx)
 
-    manifest_stackunits = []  # hold existing stuff for 2nd for loop
+    for idx, block in enumerate(blocks):
+        first_line = block[0]
+        body = block[1:]
 
-    # Add fanouts that need to be added
-    for intf,items in manifest.items():
-        if "fanout" in items:
-            # this is a fanout interface
-            fanout_speed = items["fanout"]["speed"]
-            fanout_type = items["fanout"]["type"]
-            port_num = intf.split("/")[-1]
-
-            conf_line_base = f"stack-unit 1 port {port_num} portmode {fanout_type}"
-            manifest_stackunits.append(conf_line_base)
-            conf_line = f"{conf_line_base} speed {fanout_speed}"
-            manifest_stackunits.append(conf_line)
-
-            if conf_line not in conf_lines and conf_line_base not in conf_lines:
-                parent_port_num = f"1/{port_num}"
-                search_pattern = rf'^interface .*{re.escape(parent_port_num)}$'
-                search_matches = [line for line in conf_lines if re.match(search_pattern, line)]
-                parent_port_label = " ".join(search_matches[0].split(" ")[1:])
-
-                out.append(f"default interface {parent_port_label}")
-                out.append(f"{conf_line} no-confirm")
-
-    # Remove fanouts that need to be removed
-    for line in [s for s in conf_lines if s.startswith("stack-unit 1 port")]:
-        # loop through existing stack-units
-        if line in manifest_stackunits:
-            # supposed to be there
+        if first_line.startswith("interface range vlan "):
+            # config of consecutive VLANs, see OS9_VLANRANGECFG
+            for first_vlan, last_vlan in re.findall(r"(\d+) - (\d+)", first_line):
+                for vlan_id in range(int(first_vlan), int(last_vlan) + 1):
+                    add_role(f"Vlan {vlan_id}", "own", idx)
             continue
 
-        line_parts = line.split(" ")
-        port_num = line_parts[3]
-
-        search_pattern = rf'^interface .*1/{port_num}/\d$'
-        search_matches = [match_line for match_line in conf_lines if re.match(search_pattern, match_line)]
+        if first_line.startswith(("default interface ", "no interface ")):
+            add_role(first_line.split(" ", 2)[2], "reset", idx)
+            body = block[2:]  # skip the "interface X" line after the reset
 
-        for child_intf in search_matches:
-            out.append(f"default {child_intf}")
+        elif first_line.startswith("interface Vlan ") and len(body) > 0 and \
+                all(line.split(" ")[1 if line.startswith("no ") else 0] in ("untagged", "tagged") for line in body):
+            # VLAN membership block
+            for line in body:
+                role = "vlan_removal" if line.startswith("no ") else "vlan_addition"
+                range_str = line.split(" ", 2 if line.startswith("no ") else 1)[-1]
+                for member in OS9IntfRange(sw_config, range_str):
+                    add_role(member, role, idx)
 
-        conf_line_index = line.find("speed")
-        if conf_line_index == -1:
-            conf_line = line
-        else:
-            conf_line = line[:conf_line_index - 1]
-
-        out.append(f"no {conf_line} no-confirm")
+            add_role(first_line[len("interface "):], "vlan_addition", idx)
+            continue
 
-    return out
+        intf_label = first_line[len("interface "):] if first_line.startswith("interface ") else first_line
 
-def OS9_CLEANINTF(sw_config, manifest, vlans):
+        if "no port-channel-protocol LACP" in body:
+            add_role(intf_label, "cleanup", idx)
+        elif "port-channel-protocol LACP" in body:
+            # LACP member joining a port-channel
+            add_role(intf_label, "addition", idx)
+            for line in body:
+                if line.startswith("port-channel "):
+                    add_role(" ".join(line.split(" ")[:2]), "addition", idx)
+        else:
+            add_role(intf_label, "own", idx)
+            for line in body:
+                if line.startswith("channel-member "):
+                    add_role(line[len("channel-member "):], "addition", idx)
+
+    # which roles have to come before which for the same interface
+    role_order = {
+        "cleanup": ["reset", "own", "addition", "vlan_addition"],
+        "vlan_removal": ["vlan_addition"],
+        "reset": ["own", "addition", "vlan_addition"],
+        "own": ["addition", "vlan_addition"]
+    }
+
+    edges = [set() for _ in blocks]
+    in_degree = [0] * len(blocks)
+
+    for intf_roles in roles.values():
+        for before_role, after_roles in role_order.items():
+            for before_idx in intf_roles.get(before_role, []):
+                for after_role in after_roles:
+                    for after_idx in intf_roles.get(after_role, []):
+                        if after_idx != before_idx and after_idx not in edges[before_idx]:
+                            edges[before_idx].add(after_idx)
+                            in_degree[after_idx] += 1
+
+    # Kahn's algorithm, always picking the lowest original index so the order is stable
+    ready = [idx for idx in range(len(blocks)) if in_degree[idx] == 0]
+    heapq.heapify(ready)
+
+    out_idx = []
+    while len(ready) > 0:
+        idx = heapq.heappop(ready)
+        out_idx.append(idx)
+
+        for after_idx in edges[idx]:
+            in_degree[after_idx] -= 1
+            if in_degree[after_idx] == 0:
+                heapq.heappush(ready, after_idx)
+
+    if len(out_idx) < len(blocks):
+        # dependency cycle, keep the remaining blocks in their original order
+        placed = set(out_idx)
+        out_idx += [idx for idx in range(len(blocks)) if idx not in placed]
+
+    return [blocks[idx] for idx in out_idx]
+
+def OS9_SCRIPTCHUNKS(blocks, call_latency=0, line_latency=0.02, max_call_seconds=20):
     """
-    This method will create os9 commands to delete interfaces that have been removed from the manifest
-    This can happen when a vlan interface or a port channel is deleted
-
-    :param sw_config: existing switch config
-    :type sw_config: str
-    :param manifst: interface manifest from YAML
-    :type manifest: dict
-    :param vlans: vlan manifest from YAML
-    :type vlans: dict
-    :return: List of os9 commands
+    Flattens ordered blocks into one command script and splits it into chunks, one chunk per os9_config call
+
+    The chunk size follows the measured per-call latency: the slower a call is, the more lines go in each
+    chunk so the fixed cost stays small, but a chunk never takes longer than max_call_seconds.
+    Blocks are never split over two chunks.
+
+    Each chunk is config text indented by mode (one space per level, like the running config) and is pushed as the
+    src of os9_config. Pushed as lines instead, os9_config would keep only the first of every repeated top level
+    line, e.g. the "exit" and "no shutdown" of every interface but the first.
+
+    :param blocks: 2D List of os9 commands, already ordered
+    :type blocks: list
+    :param call_latency: Measured time of a single call to the switch in seconds
+    :type call_latency: float
+    :param line_latency: Estimated time to apply a single line in seconds
+    :type line_latency: float
+    :param max_call_seconds: Upper limit for the time of a single call in seconds
+    :type max_call_seconds: float
+    :return: List of config texts
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
-
-    search_keys = ["interface " + i for i in vlan_interface_types] + ["interface " + i for i in lag_interface_types]
+    max_lines = max(1, int((max_call_seconds - call_latency) / line_latency))
+    if call_latency > 0:
+        # keep the fixed call cost at ~10% of the call
+        chunk_lines = max(20, min(max_lines, int(9 * call_latency / line_latency)))
+    else:
+        chunk_lines = max_lines
 
     out = []
+    cur_chunk = []
 
-    for line in conf_lines:
-        if line == "interface Vlan 1":
-            # skip default vlan
-            continue
+    for block in blocks:
+        block_script = []
 
-        if line.lower().startswith(tuple(search_keys)):
-            line_parts = line.split(" ")
-            intf_type = line_parts[1]
-            intf_num = line_parts[-1]
-            intf_label = " ".join(line_parts[1:])
+        # go back to config mode after the block, nested LACP config is one level deeper
+        depth = 0
+        for line in block:
+            if line.startswith("interface "):
+                block_script.append(line)
+                depth = 1
+            else:
+                block_script.append(" " * depth + line)
+                if line == "port-channel-protocol LACP":
+                    depth = 2
+        block_script += [" " * level + "exit" for level in range(depth, 0, -1)]
 
-            not_manifest_vlan = intf_type == "Vlan" and int(intf_num) not in vlans
-            not_manifest_lag = intf_type == "Port-channel" and intf_label not in manifest
+        if len(cur_chunk) > 0 and len(cur_chunk) + len(block_script) > chunk_lines:
+            out.append(cur_chunk)
+            cur_chunk = []
 
-            if not_manifest_vlan or not_manifest_lag:
-                out.append(f"no {line}")
+        cur_chunk += block_script
 
-    return out
+    if len(cur_chunk) > 0:
+        out.append(cur_chunk)
+
+    return ["\n".join(chunk) + "\n" for chunk in out]
 
-def OS9_GETCONFIG(sw_config, intf, vlans):
+@profiled
+def OS9_GETSCRIPT(sw_config, intf, vlans, call_latency=0, line_latency=0.02, max_call_seconds=20, state=None,
+                  compiled=None, workers=None, scope=None):
     """
-    Main method which returns a 2d list of commands, where each nested list is an interface
+    Alternative to OS9_GETCONFIG that returns the manifest config as one dependency ordered command script,
+    split into as few chunks (os9_config calls) as the measured latency allows
 
     :param sw_config: Running switch config
-    :type sw_config: str
-    :param manifest: YAML manifest
-    :type manifest: dict
-    :param type: Type of manifest (vlan or intf)
-    :type type: str
-    :return: 2D List os os9 commands
+    :type sw_config: dict
+    :param intf: Interface manifest from YAML
+    :type intf: dict
+    :param vlans: VLAN manifest from YAML
+    :type vlans: dict
+    :param call_latency: Measured time of a single call to the switch in seconds
+    :type call_latency: float
+    :param line_latency: Estimated time to apply a single line in seconds
+    :type line_latency: float
+    :param max_call_seconds: Upper limit for the time of a single call in seconds
+    :type max_call_seconds: float
+    :param state: If set, interfaces that are unchanged since these fingerprints (from OS9_FINGERPRINTS) are skipped
+    :type state: dict
+    :param compiled: Compiled manifest (from OS9_COMPILEMANIFEST), used instead of intf and vlans if set
+    :type compiled: dict
+    :param workers: Worker processes to generate the interface config with, see OS9_GETCONFIG
+    :type workers: int
+    :param scope: If set, only these interfaces and VLANs are planned, see OS9_GETCONFIG
+    :type scope: list
+    :return: List of config texts, see OS9_SCRIPTCHUNKS
     :rtype: list
     """
 
-    conf_lines = sw_config["ansible_facts"]["ansible_net_config"].splitlines()
-    conf_lines = OS9_GETEXTENDEDCFG(conf_lines)
-
-    managed_vlan_list = [str(key) for key, value in vlans.items() if "managed" in value and value["managed"]]
-    vlans = {"Vlan " + str(key): value for key, value in vlans.items()}
-    manifest = merge_dicts(vlans, intf)
-
-    out = []
-    default_list = []
-
-    for key,fields in manifest.items():
-        if "managed" in fields and fields["managed"]:
-            # Don't edit managed interfaces
-            continue
-
-        if "fanout" in fields:
-            # Skip fanouts
-            continue
+    sw_tree = OS9_PARSECONFIG(sw_config)
 
-        intf_lines,default_list = OS9_GENERATEINTFCONFIG(key, fields, conf_lines, managed_vlan_list, default_list)
-        if len(intf_lines) > 0:
-            out += intf_lines
+    blocks = OS9_GETCONFIG(sw_config, intf, vlans, state, compiled, workers, scope)
+    with profile_stage("order"):
+        blocks = OS9_ORDERBLOCKS(blocks, sw_tree)
 
-    return out
+    with profile_stage("chunk"):
+        return OS9_SCRIPTCHUNKS(blocks, float(call_latency), float(line_latency), float(max_call_seconds))
 
 def merge_dicts(dict1, dict2):
     """
@@ -1102,5 +3495,12 @@ class FilterModule(object):
         return {
             "OS9_GETCONFIG": OS9_GETCONFIG,
             "OS9_CLEANINTF": OS9_CLEANINTF,
-            "OS9_FANOUTCFG": OS9_FANOUTCFG
+            "OS9_SYSTEMCFG": OS9_SYSTEMCFG,
+            "OS9_FANOUTCFG": OS9_FANOUTCFG,
+            "OS9_PREDICTFANOUT": OS9_PREDICTFANOUT,
+            "OS9_GETSCRIPT": OS9_GETSCRIPT,
+            "OS9_FINGERPRINTS": OS9_FINGERPRINTS,
+            "OS9_PLANSTATS": OS9_PLANSTATS,
+            "OS9_COMPILEMANIFEST": OS9_COMPILEMANIFEST,
+            "OS9_CACHESTATS": OS9_CACHESTATS
         }
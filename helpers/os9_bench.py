@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the dell_os9 filter plugin on synthetic running configs of increasing size
+
+Every filter is run on every size tier, recording the best wall time and the tracemalloc peak.
+The parse cache is cleared before every run, so each number includes parsing the running config.
+A filter whose time grows much faster than its input between two tiers is flagged as superlinear.
+Filters that fail on a tier are reported as well, the exit code is 1 if anything was reported.
+
+Example:
+    helpers/os9_bench.py --tiers small,medium,large --out bench.json
+    helpers/os9_bench.py --compare bench.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import os9_site
+import os9_synth
+
+# Time growth exponent (relative to the config size) that is reported as superlinear
+SCALING_LIMIT = 1.5
+
+def bench_cases(plugin, conf_text, interfaces, vlans):
+    """
+    Builds the filter calls to benchmark
+
+    :param plugin: The dell_os9 module
+    :type plugin: module
+    :param conf_text: Running config
+    :type conf_text: str
+    :param interfaces: Interface manifest
+    :type interfaces: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :return: Dict of name -> callable
+    :rtype: dict
+    """
+
+    facts = os9_site.make_facts(conf_text)
+    conf_lines = conf_text.splitlines()
+    state = plugin.OS9_FINGERPRINTS(facts, interfaces, vlans)
+    compiled = plugin.OS9_COMPILEMANIFEST(interfaces, vlans)
+
+    return {
+        "OS9_PARSECONFIG": lambda: plugin.OS9_PARSECONFIG(facts),
+        "OS9_GETEXTENDEDCFG": lambda: plugin.OS9_GETEXTENDEDCFG(conf_lines),
+        "OS9_GETCONFIG": lambda: plugin.OS9_GETCONFIG(facts, interfaces, vlans),
+        "OS9_GETCONFIG+state": lambda: plugin.OS9_GETCONFIG(facts, interfaces, vlans, state),
+        "OS9_GETCONFIG+compiled": lambda: plugin.OS9_GETCONFIG(facts, interfaces, vlans, compiled=compiled),
+        "OS9_GETCONFIG+workers": lambda: plugin.OS9_GETCONFIG(facts, interfaces, vlans, workers=os.cpu_count()),
+        "OS9_FANOUTCFG": lambda: plugin.OS9_FANOUTCFG(facts, interfaces),
+        "OS9_CLEANINTF": lambda: plugin.OS9_CLEANINTF(facts, interfaces, vlans),
+        "OS9_GETSCRIPT": lambda: plugin.OS9_GETSCRIPT(facts, interfaces, vlans)
+    }
+
+def input_size(conf_text, interfaces):
+    """
+    Size of a benchmark input, the number of running config lines plus the number of VLAN memberships in the manifest
+    VLAN memberships are counted separately as OS9 compresses them into ranges in the running config
+
+    :param conf_text: Running config
+    :type conf_text: str
+    :param interfaces: Interface manifest
+    :type interfaces: dict
+    :return: Size
+    :rtype: int
+    """
+
+    size = len(conf_text.splitlines())
+
+    for fields in interfaces.values():
+        size += len(os9_synth.expand_tagged(fields.get("tagged", [])))
+        if "untagged" in fields:
+            size += 1
+
+    return size
+
+def run_case(plugin, func, repeat):
+    """
+    Runs one filter call
+
+    :param plugin: The dell_os9 module
+    :type plugin: module
+    :param func: Filter call
+    :type func: callable
+    :param repeat: Number of timed runs, the best one is kept
+    :type repeat: int
+    :return: Tuple of <best wall time in seconds>,<peak traced memory in bytes>
+    :rtype: tuple
+    """
+
+    best = None
+    for _ in range(repeat):
+        plugin.parse_cache.clear()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # separate run for the memory, tracemalloc slows everything down
+    plugin.parse_cache.clear()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plugin.parse_cache.clear()
+
+    return best, peak
+
+def check_scaling(results):
+    """
+    Finds filters whose time grows superlinearly with the config size between consecutive tiers
+
+    :param results: Benchmark results, as returned by run_bench
+    :type results: list
+    :return: List of warnings
+    :rtype: list
+    """
+
+    warnings = []
+    by_case = {}
+
+    for result in results:
+        by_case.setdefault(result["case"], []).append(result)
+
+    for case, case_results in by_case.items():
+        for prev, cur in zip(case_results, case_results[1:]):
+            size_ratio = cur["size"] / prev["size"]
+            if size_ratio <= 1 or prev["seconds"] < 0.001:
+                continue
+
+            exponent = math.log(max(cur["seconds"], 1e-9) / prev["seconds"]) / math.log(size_ratio)
+            if exponent > SCALING_LIMIT:
+                warnings.append(f"{case}: {prev['tier']} -> {cur['tier']} grows with exponent {exponent:.2f}")
+
+    return warnings
+
+def check_regressions(results, baseline, threshold):
+    """
+    Compares results with an earlier run
+
+    :param results: Benchmark results, as returned by run_bench
+    :type results: list
+    :param baseline: Benchmark results of an earlier run
+    :type baseline: list
+    :param threshold: Slowdown factor (time or memory) that counts as a regression
+    :type threshold: float
+    :return: List of regressions
+    :rtype: list
+    """
+
+    previous = {(result["tier"], result["case"]): result for result in baseline}
+    regressions = []
+
+    for result in results:
+        prev = previous.get((result["tier"], result["case"]))
+        if prev is None:
+            continue
+
+        # ignore noise on very fast calls
+        if result["seconds"] > 0.01 and result["seconds"] > prev["seconds"] * threshold:
+            regressions.append(f"{result['tier']} {result['case']}: {prev['seconds']:.3f}s -> {result['seconds']:.3f}s")
+        if result["peak_bytes"] > prev["peak_bytes"] * threshold:
+            regressions.append(f"{result['tier']} {result['case']}: "
+                               f"{prev['peak_bytes'] / 2**20:.1f}MiB -> {result['peak_bytes'] / 2**20:.1f}MiB")
+
+    return regressions
+
+def run_bench(tiers, repeat, seed=0):
+    """
+    Runs all filters on all tiers
+
+    :param tiers: Names of the tiers to run, smallest first
+    :type tiers: list
+    :param repeat: Number of timed runs per filter
+    :type repeat: int
+    :param seed: Random seed of the generator
+    :type seed: int
+    :return: Tuple of <list of results>,<list of errors>
+    :rtype: tuple
+    """
+
+    plugin = os9_site.load_plugin()
+    results = []
+    errors = []
+
+    for tier in tiers:
+        conf_text, interfaces, vlans = os9_synth.generate_tier(tier, seed)
+        size = input_size(conf_text, interfaces)
+
+        for case, func in bench_cases(plugin, conf_text, interfaces, vlans).items():
+            try:
+                seconds, peak = run_case(plugin, func, repeat)
+            except Exception as e:
+                errors.append(f"{tier} {case}: {e.__class__.__name__}: {e}")
+                print(f"{tier:<8} {size:>7} {case:<22} {'failed':>10}", flush=True)
+                continue
+
+            results.append({
+                "tier": tier,
+                "case": case,
+                "size": size,
+                "seconds": seconds,
+                "peak_bytes": peak
+            })
+            print(f"{tier:<8} {size:>7} {case:<22} {seconds:>9.4f}s {peak / 2**20:>9.1f}MiB", flush=True)
+
+    return results, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dell_os9 filters on synthetic running configs")
+    parser.add_argument("--tiers", default=",".join(os9_synth.TIERS),
+                        help="comma separated size tiers, smallest first (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per filter, the best one is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generator")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown factor that counts as a regression with --compare (default: 1.25)")
+    args = parser.parse_args()
+
+    tiers = args.tiers.split(",")
+    for tier in tiers:
+        if tier not in os9_synth.TIERS:
+            parser.error(f"unknown tier {tier}")
+
+    print(f"{'tier':<8} {'size':>7} {'filter':<22} {'time':>10} {'peak':>12}")
+    results, problems = run_bench(tiers, args.repeat, args.seed)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    problems += check_scaling(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems += check_regressions(results, json.load(f), args.threshold)
+
+    for problem in problems:
+        print(f"WARNING: {problem}")
+
+    if len(problems) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
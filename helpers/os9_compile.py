@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Compiles the manifests of the OS9 switches into normalized artifacts
+
+Turns group_vars/all/vlans.yaml plus host_vars/HOST/interfaces.yaml of every switch into OUT_DIR/HOST.json with
+OS9_COMPILEMANIFEST (merged manifest, expanded tagged VLANs, managed VLANs, resolved LACP/LAG members).
+Each artifact stores the hashes of its source files and is only compiled again when one of them changes.
+The filters take the artifact as compiled=, so they skip merging and expanding the manifest on every run.
+
+Example:
+    helpers/os9_compile.py --out compiled/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import os9_site
+
+def source_paths(host, repo_dir=os9_site.REPO_DIR):
+    """
+    Returns the manifest files the artifact of a host is compiled from
+
+    :param host: Inventory hostname
+    :type host: str
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Dict of name -> path
+    :rtype: dict
+    """
+
+    return {
+        "vlans": os.path.join(repo_dir, "group_vars", "all", "vlans.yaml"),
+        "interfaces": os.path.join(repo_dir, "host_vars", host, "interfaces.yaml")
+    }
+
+def source_hashes(host, repo_dir=os9_site.REPO_DIR):
+    """
+    Hashes the manifest files of a host
+
+    :param host: Inventory hostname
+    :type host: str
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Dict of name -> sha256 of the file
+    :rtype: dict
+    """
+
+    out = {}
+
+    for name, path in source_paths(host, repo_dir).items():
+        with open(path, "rb") as f:
+            out[name] = hashlib.sha256(f.read()).hexdigest()
+
+    return out
+
+def load_compiled(out_dir, host):
+    """
+    Loads the saved artifact of a host
+
+    :param out_dir: Directory with the artifacts (HOST.json)
+    :type out_dir: str
+    :param host: Inventory hostname
+    :type host: str
+    :return: Compiled manifest, or None if there isn't one
+    :rtype: dict
+    """
+
+    path = os.path.join(out_dir, f"{host}.json")
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+def compile_host(host, out_dir, force=False, repo_dir=os9_site.REPO_DIR):
+    """
+    Compiles the manifest of a host, unless the saved artifact was compiled from the same sources
+
+    :param host: Inventory hostname
+    :type host: str
+    :param out_dir: Directory with the artifacts (HOST.json)
+    :type out_dir: str
+    :param force: If true, the manifest is compiled even if the saved artifact is current
+    :type force: bool
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Tuple of <compiled manifest>,<true if it was compiled again>
+    :rtype: tuple
+    """
+
+    dell_os9 = os9_site.load_plugin()
+    sources = source_hashes(host, repo_dir)
+
+    compiled = load_compiled(out_dir, host)
+    if not force and compiled is not None and compiled.get("version") == dell_os9.compiled_manifest_version and \
+       compiled.get("sources") == sources:
+        return compiled, False
+
+    interfaces = os9_site.load_interfaces(host, repo_dir)
+    vlans = os9_site.load_vlans(repo_dir)
+    compiled = dell_os9.OS9_COMPILEMANIFEST(interfaces, vlans, sources)
+
+    # write to a temporary file first, so a concurrent reader never sees half an artifact
+    path = os.path.join(out_dir, f"{host}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(compiled, f)
+    os.replace(path + ".tmp", path)
+
+    return compiled, True
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the OS9 switch manifests into normalized artifacts")
+    parser.add_argument("--out", default="compiled", help="directory to write the artifacts to (default: compiled)")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts to compile")
+    parser.add_argument("--force", action="store_true", help="compile even if the sources didn't change")
+    args = parser.parse_args()
+
+    hosts = list(os9_site.load_inventory(args.inventory))
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    os.makedirs(args.out, exist_ok=True)
+
+    for host in hosts:
+        if not os.path.exists(source_paths(host)["interfaces"]):
+            print(f"{host:<24} no-manifest")
+            continue
+
+        _, compiled = compile_host(host, args.out, args.force)
+        print(f"{host:<24} {'compiled' if compiled else 'current'}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
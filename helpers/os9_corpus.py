@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Regression corpus of recorded OS9 running configs with golden plans
+
+record sanitizes the saved running config of every switch (see os9_plan.py) into CORPUS_DIR/HOST.cfg and writes the
+plans of the filters for it, together with the hashes of the manifests and a time and memory budget, to
+CORPUS_DIR/HOST.json. With --synth the config is rendered from the manifest of the switch instead (see
+os9_synth.render_manifest), that is how the committed corpus is recorded, so it is synthetic. check plans every
+recorded config again with the current filters and fails if a plan differs from the golden one or a switch exceeds
+its budget, so the filters can be reworked without changing their output.
+
+Example:
+    helpers/os9_corpus.py record --configs configs/
+    helpers/os9_corpus.py record --synth
+    helpers/os9_corpus.py check
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import os9_compile
+import os9_plan
+import os9_site
+import os9_synth
+
+CORPUS_DIR = os.path.join(os9_site.REPO_DIR, "corpus")
+
+# Plans that are recorded, as returned by os9_plan.plan_host
+PLAN_KEYS = ["fanout", "manifest", "clean"]
+
+# Words that are followed by a secret in the running config, optionally after an encryption type (0, 5 or 7)
+SECRET_WORDS = {"password", "secret", "key", "community", "md5"}
+
+def sanitize_line(line):
+    """
+    Replaces the secrets (passwords, keys, SNMP communities) of a running config line
+
+    :param line: Running config line
+    :type line: str
+    :return: Sanitized line
+    :rtype: str
+    """
+
+    line_parts = line.split(" ")
+
+    for idx, part in enumerate(line_parts[:-1]):
+        if part not in SECRET_WORDS:
+            continue
+
+        secret_idx = idx + 1
+        if re.fullmatch(r"[057]", line_parts[secret_idx]) and secret_idx + 1 < len(line_parts):
+            secret_idx += 1
+
+        line_parts[secret_idx] = "SANITIZED"
+
+    return " ".join(line_parts)
+
+def sanitize(conf_text):
+    """
+    Sanitizes a running config
+
+    :param conf_text: Output of "show running-config"
+    :type conf_text: str
+    :return: Sanitized running config
+    :rtype: str
+    """
+
+    return "\n".join(sanitize_line(line) for line in conf_text.splitlines()) + "\n"
+
+def measure(host, config_path, vlans, repeat):
+    """
+    Plans a recorded config, timing it and tracing its memory
+
+    :param host: Inventory hostname
+    :type host: str
+    :param config_path: Path of the recorded config
+    :type config_path: str
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param repeat: Number of timed runs, the best one is kept
+    :type repeat: int
+    :return: Tuple of <plan>,<best wall time in seconds>,<peak traced memory in bytes>
+    :rtype: tuple
+    """
+
+    plugin = os9_site.load_plugin()
+
+    best = None
+    for _ in range(repeat):
+        plugin.parse_cache.clear()
+        start = time.perf_counter()
+        plan = os9_plan.plan_host(host, config_path, vlans)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # separate run for the memory, tracemalloc slows everything down
+    plugin.parse_cache.clear()
+    tracemalloc.start()
+    os9_plan.plan_host(host, config_path, vlans)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plugin.parse_cache.clear()
+
+    return plan, best, peak
+
+def record(hosts, config_dir, corpus_dir, repeat, factor, min_seconds):
+    """
+    Records the config and golden plans of every host that has a saved config
+
+    :param hosts: Inventory hostnames
+    :type hosts: list
+    :param config_dir: Directory with the saved running configs, or None to render them from the manifests
+    :type config_dir: str
+    :param corpus_dir: Directory of the corpus
+    :type corpus_dir: str
+    :param repeat: Number of timed runs per host
+    :type repeat: int
+    :param factor: Budget as a multiple of the measured time and memory
+    :type factor: float
+    :param min_seconds: Lowest time budget, so fast hosts don't fail on noise
+    :type min_seconds: float
+    :return: List of problems
+    :rtype: list
+    """
+
+    vlans = os9_site.load_vlans()
+    problems = []
+
+    for host in hosts:
+        interfaces = os9_site.load_interfaces(host)
+        config_path = None if config_dir is None else os9_plan.find_config(config_dir, host)
+        if config_dir is not None and config_path is None:
+            problems.append(f"{host}: no saved config in {config_dir}")
+            continue
+        if interfaces is None:
+            print(f"{host:<24} no-manifest")
+            continue
+
+        if config_path is None:
+            conf_text = os9_synth.render_manifest(interfaces, vlans, host, seed=host)
+        else:
+            with open(config_path) as f:
+                conf_text = sanitize(f.read())
+
+        corpus_config = os.path.join(corpus_dir, f"{host}.cfg")
+        with open(corpus_config, "w") as f:
+            f.write(conf_text)
+
+        plan, seconds, peak = measure(host, corpus_config, vlans, repeat)
+
+        golden = {key: plan[key] for key in PLAN_KEYS}
+        golden["sources"] = os9_compile.source_hashes(host)
+        golden["budget"] = {
+            "seconds": round(max(seconds * factor, min_seconds), 4),
+            "peak_bytes": int(peak * factor)
+        }
+
+        with open(os.path.join(corpus_dir, f"{host}.json"), "w") as f:
+            json.dump(golden, f, indent=2)
+            f.write("\n")
+
+        print(f"{host:<24} recorded {seconds:>9.4f}s {peak / 2**20:>9.1f}MiB")
+
+    return problems
+
+def check(hosts, corpus_dir, repeat):
+    """
+    Plans every recorded config again and compares it with the golden plans and the budgets
+
+    :param hosts: Inventory hostnames
+    :type hosts: list
+    :param corpus_dir: Directory of the corpus
+    :type corpus_dir: str
+    :param repeat: Number of timed runs per host
+    :type repeat: int
+    :return: List of problems
+    :rtype: list
+    """
+
+    vlans = os9_site.load_vlans()
+    problems = []
+
+    for host in hosts:
+        corpus_config = os.path.join(corpus_dir, f"{host}.cfg")
+        golden_path = os.path.join(corpus_dir, f"{host}.json")
+        if not os.path.exists(corpus_config) or not os.path.exists(golden_path):
+            continue
+
+        with open(golden_path) as f:
+            golden = json.load(f)
+
+        if golden["sources"] != os9_compile.source_hashes(host):
+            problems.append(f"{host}: manifest changed since the golden plans were recorded, record it again")
+            print(f"{host:<24} stale")
+            continue
+
+        try:
+            plan, seconds, peak = measure(host, corpus_config, vlans, repeat)
+        except Exception as e:
+            problems.append(f"{host}: {e.__class__.__name__}: {e}")
+            print(f"{host:<24} failed")
+            continue
+
+        host_problems = []
+
+        for key in PLAN_KEYS:
+            if plan[key] != golden[key]:
+                host_problems.append(f"{host}: {key} plan differs from the golden plan")
+
+        if seconds > golden["budget"]["seconds"]:
+            host_problems.append(f"{host}: {seconds:.3f}s is over the budget of {golden['budget']['seconds']:.3f}s")
+        if peak > golden["budget"]["peak_bytes"]:
+            host_problems.append(f"{host}: {peak / 2**20:.1f}MiB is over the budget of "
+                                 f"{golden['budget']['peak_bytes'] / 2**20:.1f}MiB")
+
+        problems += host_problems
+        print(f"{host:<24} {'ok' if len(host_problems) == 0 else 'failed':<8} {seconds:>9.4f}s {peak / 2**20:>9.1f}MiB")
+
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or check the OS9 regression corpus")
+    parser.add_argument("command", choices=["record", "check"])
+    parser.add_argument("--configs", default="configs", help="directory with saved running configs for record "
+                                                             "(default: configs)")
+    parser.add_argument("--synth", action="store_true",
+                        help="render the configs for record from the manifests instead of reading --configs")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="directory of the corpus (default: corpus)")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per host, the best one is kept (default: 3)")
+    parser.add_argument("--factor", type=float, default=3,
+                        help="budget as a multiple of the time and memory measured by record (default: 3)")
+    parser.add_argument("--min-seconds", type=float, default=0.1, help="lowest time budget (default: 0.1)")
+    args = parser.parse_args()
+
+    hosts = list(os9_site.load_inventory(args.inventory))
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    if args.command == "record":
+        os.makedirs(args.corpus, exist_ok=True)
+        problems = record(hosts, None if args.synth else args.configs, args.corpus, args.repeat, args.factor,
+                          args.min_seconds)
+    else:
+        problems = check(hosts, args.corpus, args.repeat)
+
+    for problem in problems:
+        print(f"WARNING: {problem}")
+
+    return 1 if len(problems) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
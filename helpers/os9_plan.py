@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Offline fleet planner for the OS9 switches
+
+Computes the OS9_FANOUTCFG, OS9_GETCONFIG and OS9_CLEANINTF plans of every switch in the inventory from saved
+"show running-config" output, using the filter plugin directly (no Ansible, no connection to the switches).
+The manifest is planned against the config predicted after the fanout change, when it can be predicted.
+The config of each switch is read from CONFIG_DIR/HOST.cfg (or .txt/.conf).
+
+Example:
+    helpers/os9_plan.py --configs configs/ --out plans/
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import traceback
+
+import os9_compile
+import os9_site
+
+CONFIG_SUFFIXES = [".cfg", ".txt", ".conf"]
+
+def find_config(config_dir, host):
+    """
+    Finds the saved running config of a host
+
+    :param config_dir: Directory with the saved configs
+    :type config_dir: str
+    :param host: Inventory hostname
+    :type host: str
+    :return: Path of the config, or None if there isn't one
+    :rtype: str
+    """
+
+    for suffix in CONFIG_SUFFIXES:
+        path = os.path.join(config_dir, host + suffix)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+def load_state(state_dir, host):
+    """
+    Loads the fingerprints saved by the last successful run of a host
+
+    :param state_dir: Directory with the saved fingerprints (HOST.json), or None
+    :type state_dir: str
+    :param host: Inventory hostname
+    :type host: str
+    :return: Fingerprints, or None if there aren't any
+    :rtype: dict
+    """
+
+    if state_dir is None:
+        return None
+
+    path = os.path.join(state_dir, f"{host}.json")
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+def plan_host(host, config_path, vlans, profile_dir=None, state_dir=None, compiled_dir=None, scope=None,
+              clean_ports=False):
+    """
+    Computes the plans of a single switch, this runs in a worker process
+
+    :param host: Inventory hostname
+    :type host: str
+    :param config_path: Path of the saved running config
+    :type config_path: str
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param profile_dir: If set, the filters are profiled and the results written to PROFILE_DIR/HOST.json
+    :type profile_dir: str
+    :param state_dir: If set, interfaces that are unchanged since the fingerprints in STATE_DIR/HOST.json are skipped
+    :type state_dir: str
+    :param compiled_dir: If set, the manifest is compiled to COMPILED_DIR/HOST.json, or reused from there if current
+    :type compiled_dir: str
+    :param scope: If set, only these interfaces and VLANs are planned and fanouts are left alone (see OS9Scope)
+    :type scope: str
+    :param clean_ports: If true, the clean plan also resets physical ports that aren't in the manifest, like the
+                        playbook does with os9_clean_ports
+    :type clean_ports: bool
+    :return: Dict with the fanout, manifest and clean plans
+    :rtype: dict
+    """
+
+    dell_os9 = os9_site.load_plugin()
+    interfaces = os9_site.load_interfaces(host)
+
+    with open(config_path) as f:
+        sw_config = os9_site.make_facts(f.read())
+
+    profile = None if profile_dir is None else os.path.join(profile_dir, f"{host}.json")
+    state = load_state(state_dir, host)
+    compiled = None if compiled_dir is None else os9_compile.compile_host(host, compiled_dir)[0]
+
+    start = time.perf_counter()
+
+    if scope:
+        # like the playbook, a scoped run doesn't change fanouts
+        fanout = []
+        prediction = {"predicted": False}
+    else:
+        fanout = dell_os9.OS9_FANOUTCFG(sw_config, interfaces, profile=profile)
+
+        # the rest is planned against the config after the fanout change, like the playbook does
+        prediction = dell_os9.OS9_PREDICTFANOUT(sw_config, interfaces)
+        if prediction["predicted"]:
+            sw_config = prediction
+
+    manifest = dell_os9.OS9_GETCONFIG(sw_config, interfaces, vlans, state, compiled, scope=scope, profile=profile)
+    clean = dell_os9.OS9_CLEANINTF(sw_config, interfaces, vlans, scope, clean_ports, profile=profile)
+    stats = dell_os9.OS9_PLANSTATS(sw_config, interfaces, vlans, state, compiled)
+
+    return {
+        "host": host,
+        "config": config_path,
+        "seconds": round(time.perf_counter() - start, 4),
+        "skipped": stats["skipped"],
+        "fanout_predicted": prediction["predicted"],
+        "fanout": fanout,
+        "manifest": manifest,
+        "clean": clean
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan OS9 switch changes offline from saved running configs")
+    parser.add_argument("--configs", required=True, help="directory with saved running configs (HOST.cfg)")
+    parser.add_argument("--out", default="plans", help="directory to write the plans to (default: plans)")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts to plan")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--profile", default=None, help="profile the filters and write the results to PROFILE/HOST.json")
+    parser.add_argument("--state", default=None,
+                        help="skip interfaces that are unchanged since the fingerprints in STATE/HOST.json")
+    parser.add_argument("--compiled", default=None,
+                        help="compile the manifests to COMPILED/HOST.json, or reuse them from there if current")
+    parser.add_argument("--scope", default=None,
+                        help="comma separated interfaces, globs and VLAN IDs to limit the plans to (e.g. 'Te 1/1/*,100')")
+    parser.add_argument("--clean-ports", action="store_true",
+                        help="also reset physical ports that aren't in the manifest, like os9_clean_ports")
+    args = parser.parse_args()
+
+    inventory = os9_site.load_inventory(args.inventory)
+    vlans = os9_site.load_vlans()
+
+    hosts = list(inventory)
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    os.makedirs(args.out, exist_ok=True)
+    if args.profile is not None:
+        os.makedirs(args.profile, exist_ok=True)
+    if args.compiled is not None:
+        os.makedirs(args.compiled, exist_ok=True)
+
+    summary = {}
+    jobs = {}
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for host in hosts:
+            config_path = find_config(args.configs, host)
+
+            if config_path is None:
+                summary[host] = {"status": "no-config"}
+            elif os9_site.load_interfaces(host) is None:
+                summary[host] = {"status": "no-manifest"}
+            else:
+                jobs[executor.submit(plan_host, host, config_path, vlans, args.profile, args.state,
+                                   args.compiled, args.scope, args.clean_ports)] = host
+
+        for job in concurrent.futures.as_completed(jobs):
+            host = jobs[job]
+
+            try:
+                plan = job.result()
+            except Exception:
+                summary[host] = {"status": "error", "error": traceback.format_exc()}
+                continue
+
+            with open(os.path.join(args.out, f"{host}.json"), "w") as f:
+                json.dump(plan, f, indent=2)
+
+            summary[host] = {
+                "status": "planned",
+                "seconds": plan["seconds"],
+                "skipped_interfaces": plan["skipped"],
+                "fanout_predicted": plan["fanout_predicted"],
+                "fanout_lines": len(plan["fanout"]),
+                "manifest_blocks": len(plan["manifest"]),
+                "manifest_lines": sum(len(block) for block in plan["manifest"]),
+                "clean_lines": len(plan["clean"])
+            }
+
+    summary = {host: summary[host] for host in hosts}  # back to inventory order
+
+    with open(os.path.join(args.out, "summary.json"), "w") as f:
+        json.dump({"seconds": round(time.perf_counter() - start, 4), "hosts": summary}, f, indent=2)
+
+    print(f"{'HOST':<24} {'STATUS':<12} {'FANOUT':>7} {'BLOCKS':>7} {'LINES':>7} {'CLEAN':>7} {'SKIPPED':>7} {'SECONDS':>8}")
+    for host, result in summary.items():
+        if result["status"] == "planned":
+            print(f"{host:<24} {result['status']:<12} {result['fanout_lines']:>7} {result['manifest_blocks']:>7} "
+                  f"{result['manifest_lines']:>7} {result['clean_lines']:>7} {result['skipped_interfaces']:>7} "
+                  f"{result['seconds']:>8.3f}")
+        else:
+            print(f"{host:<24} {result['status']:<12}")
+
+    errors = [host for host, result in summary.items() if result["status"] == "error"]
+    for host in errors:
+        print(f"\n{host}:\n{summary[host]['error']}", file=sys.stderr)
+
+    return 1 if len(errors) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Replays the manifest script of every recorded config through the config parser of os9_config
+
+os9_config parses what it pushes with NetworkConfig of ansible.netcommon, which keeps only the first of repeated top
+level lines of a "lines" list. This plans the script push mode (see OS9_GETSCRIPT) for every config of the regression
+corpus, loads each chunk the way os9_config loads its src and fails if the commands it would send differ from the
+dependency ordered block plan, i.e. if a line was lost, duplicated or reordered on the way.
+
+Needs the ansible.netcommon collection, either from the ansible package or from ANSIBLE_COLLECTIONS_PATH.
+
+Example:
+    helpers/os9_scriptcheck.py
+    helpers/os9_scriptcheck.py --limit OCT4-SW-TORS --latency 2
+"""
+
+import argparse
+import os
+import sys
+
+import os9_corpus
+import os9_plan
+import os9_site
+
+# Collection paths ansible-galaxy installs to by default, searched after ANSIBLE_COLLECTIONS_PATH
+DEFAULT_COLLECTIONS_PATHS = ["~/.ansible/collections", "/usr/share/ansible/collections"]
+
+def load_network_config():
+    """
+    Imports NetworkConfig and dumps of ansible.netcommon, the config parser os9_config uses
+
+    :return: Tuple of <NetworkConfig class>,<dumps function>
+    :rtype: tuple
+    """
+
+    env_paths = os.environ.get("ANSIBLE_COLLECTIONS_PATH", os.environ.get("ANSIBLE_COLLECTIONS_PATHS", ""))
+
+    for path in [None] + [path for path in env_paths.split(os.pathsep) if path] + DEFAULT_COLLECTIONS_PATHS:
+        if path is not None:
+            sys.path.append(os.path.expanduser(path))
+
+        try:
+            from ansible_collections.ansible.netcommon.plugins.module_utils.network.common.config import \
+                NetworkConfig, dumps
+        except ImportError:
+            continue
+
+        return NetworkConfig, dumps
+
+    raise ImportError("ansible.netcommon collection not found, install ansible or set ANSIBLE_COLLECTIONS_PATH")
+
+def replay_script(chunks, network_config, dumps):
+    """
+    Returns the commands os9_config sends for the chunks of a script, in order
+
+    :param chunks: Config texts, as returned by OS9_SCRIPTCHUNKS
+    :type chunks: list
+    :param network_config: NetworkConfig class of ansible.netcommon
+    :type network_config: type
+    :param dumps: dumps function of ansible.netcommon
+    :type dumps: function
+    :return: List of commands
+    :rtype: list
+    """
+
+    commands = []
+
+    for chunk in chunks:
+        # like os9_config with src and match none
+        candidate = network_config(indent=1, contents=chunk)
+        commands += [command for command in dumps(candidate.items, "commands").split("\n") if command]
+
+    return commands
+
+def check_host(host, config_path, vlans, latency, network_config, dumps):
+    """
+    Plans the script of a single switch and replays it
+
+    :param host: Inventory hostname
+    :type host: str
+    :param config_path: Path of the recorded config
+    :type config_path: str
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param latency: Switch latency in seconds the chunks are sized for
+    :type latency: float
+    :param network_config: NetworkConfig class of ansible.netcommon
+    :type network_config: type
+    :param dumps: dumps function of ansible.netcommon
+    :type dumps: function
+    :return: Tuple of <list of problems>,<number of chunks>,<number of commands>
+    :rtype: tuple
+    """
+
+    dell_os9 = os9_site.load_plugin()
+    interfaces = os9_site.load_interfaces(host)
+
+    with open(config_path) as f:
+        sw_config = os9_site.make_facts(f.read())
+
+    # planned against the config after the fanout change, like the playbook does
+    prediction = dell_os9.OS9_PREDICTFANOUT(sw_config, interfaces)
+    if prediction["predicted"]:
+        sw_config = prediction
+
+    blocks = dell_os9.OS9_ORDERBLOCKS(dell_os9.OS9_GETCONFIG(sw_config, interfaces, vlans),
+                                      dell_os9.OS9_PARSECONFIG(sw_config))
+    chunks = dell_os9.OS9_SCRIPTCHUNKS(blocks, latency)
+
+    script = [line.strip() for chunk in chunks for line in chunk.splitlines()]
+    commands = replay_script(chunks, network_config, dumps)
+
+    problems = []
+
+    if commands != script:
+        lost = len(script) - len(commands)
+        problems.append(f"{host}: os9_config sends {len(commands)} of the {len(script)} script lines "
+                        f"({lost} lost or reordered)")
+
+    # the script is the block plan plus the exits back to config mode
+    if [line for line in script if line != "exit"] != [line for block in blocks for line in block if line != "exit"]:
+        problems.append(f"{host}: script differs from the ordered block plan")
+
+    return problems, len(chunks), len(commands)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the OS9 manifest scripts through the os9_config parser")
+    parser.add_argument("--corpus", default=os9_corpus.CORPUS_DIR,
+                        help="directory with the recorded configs (default: corpus)")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts")
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="switch latency in seconds the chunks are sized for (default: 0.5)")
+    args = parser.parse_args()
+
+    network_config, dumps = load_network_config()
+
+    hosts = list(os9_site.load_inventory(args.inventory))
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    vlans = os9_site.load_vlans()
+    problems = []
+
+    for host in hosts:
+        config_path = os9_plan.find_config(args.corpus, host)
+        if config_path is None or os9_site.load_interfaces(host) is None:
+            continue
+
+        host_problems, chunks, commands = check_host(host, config_path, vlans, args.latency, network_config, dumps)
+        problems += host_problems
+        print(f"{host:<24} {'ok' if len(host_problems) == 0 else 'failed':<8} {chunks:>4} chunks {commands:>6} lines")
+
+    for problem in problems:
+        print(f"WARNING: {problem}")
+
+    return 1 if len(problems) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
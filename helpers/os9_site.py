@@ -0,0 +1,117 @@
+"""
+Helpers shared by the offline tools in this directory
+These load the site (inventory, host_vars, group_vars) and the dell_os9 filter plugin without Ansible
+"""
+
+import importlib.util
+import os
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The manifests are large, use the libyaml loader if PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_plugin = None
+
+def load_plugin():
+    """
+    Imports filter_plugins/dell_os9.py as a normal module
+
+    :return: The dell_os9 module
+    :rtype: module
+    """
+
+    global _plugin
+
+    if _plugin is None:
+        plugin_path = os.path.join(REPO_DIR, "filter_plugins", "dell_os9.py")
+        spec = importlib.util.spec_from_file_location("dell_os9", plugin_path)
+        _plugin = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_plugin)
+
+        # a helper plans each switch in one process, the parse cache in memory covers it
+        _plugin.parse_cache_dir = ""
+
+    return _plugin
+
+def load_inventory(path=None):
+    """
+    Parses the INI inventory (the "hosts" file)
+
+    :param path: Path of the inventory, defaults to the hosts file of the repo
+    :type path: str
+    :return: Dict of host -> {"groups": [group names], "vars": {inventory vars}}, in inventory order
+    :rtype: dict
+    """
+
+    if path is None:
+        path = os.path.join(REPO_DIR, "hosts")
+
+    hosts = {}
+    group = "ungrouped"
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith(("#", ";")):
+                continue
+
+            if line.startswith("[") and line.endswith("]"):
+                group = line[1:-1]
+                continue
+
+            line_parts = line.split()
+            host = hosts.setdefault(line_parts[0], {"groups": [], "vars": {}})
+            host["groups"].append(group)
+
+            for var in line_parts[1:]:
+                key, _, value = var.partition("=")
+                host["vars"][key] = value
+
+    return hosts
+
+def load_vlans(repo_dir=REPO_DIR):
+    """
+    Loads the VLAN manifest from group_vars/all/vlans.yaml
+
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: VLAN manifest
+    :rtype: dict
+    """
+
+    with open(os.path.join(repo_dir, "group_vars", "all", "vlans.yaml")) as f:
+        return yaml.load(f, Loader=YAML_LOADER)["vlans"]
+
+def load_interfaces(host, repo_dir=REPO_DIR):
+    """
+    Loads the interface manifest of a host from host_vars/HOST/interfaces.yaml
+
+    :param host: Inventory hostname
+    :type host: str
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Interface manifest, or None if the host doesn't have one
+    :rtype: dict
+    """
+
+    path = os.path.join(repo_dir, "host_vars", host, "interfaces.yaml")
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return yaml.load(f, Loader=YAML_LOADER)["interfaces"]
+
+def make_facts(conf_text):
+    """
+    Wraps a saved running config like the registered result of os9_facts, so it can be passed to the filters
+
+    :param conf_text: Output of "show running-config"
+    :type conf_text: str
+    :return: Facts dict
+    :rtype: dict
+    """
+
+    return {"ansible_facts": {"ansible_net_config": conf_text}}
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""
+Synthetic OS9 running config and manifest generator
+
+Generates a running config together with a matching interface/VLAN manifest, for benchmarks and offline tests.
+The running config is rendered from the manifest with a fraction of random drift (missing or stale attributes,
+VLAN membership and LACP members), so the filters always have some work to do.
+
+Example:
+    helpers/os9_synth.py --tier large --config-out synth.cfg --manifest-out synth.yaml
+"""
+
+import argparse
+import random
+
+import yaml
+
+import os9_site
+
+# Size tiers, from a small access switch to a fully stacked core with every VLAN
+TIERS = {
+    "small": {
+        "stack_units": 1,
+        "ports": 48,
+        "fanout_ports": 2,
+        "vlans": 100,
+        "trunks": 8,
+        "port_channels": 2,
+        "lacp_members": 2
+    },
+    "medium": {
+        "stack_units": 1,
+        "ports": 54,
+        "fanout_ports": 4,
+        "vlans": 700,
+        "trunks": 24,
+        "port_channels": 4,
+        "lacp_members": 2
+    },
+    "large": {
+        "stack_units": 2,
+        "ports": 54,
+        "fanout_ports": 4,
+        "vlans": 2000,
+        "trunks": 48,
+        "port_channels": 8,
+        "lacp_members": 2
+    },
+    "xlarge": {
+        "stack_units": 4,
+        "ports": 54,
+        "fanout_ports": 6,
+        "vlans": 4093,
+        "trunks": 96,
+        "port_channels": 16,
+        "lacp_members": 4
+    }
+}
+
+FANOUT_CHILD_TYPES = {
+    "10G": "TenGigabitEthernet",
+    "25G": "twentyFiveGigE"
+}
+
+def compress_members(members, port_order):
+    """
+    Renders a list of member interfaces the way OS9 shows them in a VLAN (e.g. "TenGigabitEthernet 1/1-1/4,1/7")
+
+    :param members: Member interface labels
+    :type members: list
+    :param port_order: Dict of interface label -> position in the running config
+    :type port_order: dict
+    :return: List of ranges, one per interface type
+    :rtype: list
+    """
+
+    ranges = {}  # type -> list of [first, last, last position]
+
+    def consecutive(first_num, second_num):
+        # OS9 only joins ports of the same unit (and port, for subports) into a range
+        first_parts = first_num.split("/")
+        second_parts = second_num.split("/")
+        return first_parts[:-1] == second_parts[:-1] and int(first_parts[-1]) + 1 == int(second_parts[-1])
+
+    for member in sorted(members, key=lambda label: port_order[label]):
+        intf_type, intf_num = member.split(" ")
+        parts = ranges.setdefault(intf_type, [])
+        pos = port_order[member]
+
+        if len(parts) > 0 and parts[-1][2] == pos - 1 and consecutive(parts[-1][1], intf_num):
+            parts[-1][1] = intf_num
+            parts[-1][2] = pos
+        else:
+            parts.append([intf_num, intf_num, pos])
+
+    out = []
+    for intf_type, parts in ranges.items():
+        range_parts = [first if first == last else f"{first}-{last}" for first, last, _ in parts]
+        out.append(f"{intf_type} {','.join(range_parts)}")
+
+    return out
+
+def generate(stack_units=1, ports=48, fanout_ports=2, vlans=100, trunks=8, port_channels=2, lacp_members=2,
+             drift=0.1, seed=0):
+    """
+    Generates a running config and a matching manifest
+
+    :param stack_units: Number of units in the stack
+    :type stack_units: int
+    :param ports: Number of front panel ports per unit
+    :type ports: int
+    :param fanout_ports: Number of ports per unit (counted from the last one) that are fanned out
+    :type fanout_ports: int
+    :param vlans: Number of VLANs (2 up to 4094)
+    :type vlans: int
+    :param trunks: Number of trunk ports carrying (ranges of) most VLANs
+    :type trunks: int
+    :param port_channels: Number of LACP port-channels
+    :type port_channels: int
+    :param lacp_members: Number of LACP members per port-channel
+    :type lacp_members: int
+    :param drift: Fraction of attributes where the running config differs from the manifest
+    :type drift: float
+    :param seed: Random seed, the same arguments and seed always give the same output
+    :type seed: int
+    :return: Tuple of <running config text>,<interfaces manifest>,<vlans manifest>
+    :rtype: tuple
+    """
+
+    rand = random.Random(seed)
+
+    def drifted():
+        return rand.random() < drift
+
+    vlan_ids = list(range(2, min(vlans, 4093) + 2))
+
+    vlan_manifest = {}
+    for vlan_id in vlan_ids:
+        vlan_manifest[vlan_id] = {
+            "name": f"SYNTH-{vlan_id}",
+            "description": f"Synthetic VLAN {vlan_id}"
+        }
+        if rand.random() < 0.02:
+            vlan_manifest[vlan_id]["managed"] = True
+
+    # Physical ports, fanned out ports are replaced by their children
+    port_labels = []
+    stack_lines = []
+    intf_manifest = {}
+
+    for unit in range(1, stack_units + 1):
+        for port in range(1, ports + 1):
+            if port > ports - fanout_ports:
+                speed = rand.choice(list(FANOUT_CHILD_TYPES))
+                parent_label = f"hundredGigE {unit}/{port}"
+                intf_manifest[parent_label] = {"fanout": {"type": "quad", "speed": speed}}
+
+                if not drifted():
+                    stack_lines.append(f"stack-unit {unit} port {port} portmode quad speed {speed}")
+                    port_labels += [f"{FANOUT_CHILD_TYPES[speed]} {unit}/{port}/{child}" for child in range(1, 5)]
+                else:
+                    port_labels.append(parent_label)
+            else:
+                port_labels.append(f"TenGigabitEthernet {unit}/{port}")
+
+    # Manifest for every physical port that exists
+    rand.shuffle(vlan_ids)
+    trunk_ports = port_labels[:trunks]
+    lacp_ports = port_labels[trunks:trunks + port_channels * lacp_members]
+    access_ports = port_labels[trunks + port_channels * lacp_members:]
+
+    for idx, label in enumerate(trunk_ports):
+        # mix of single VLANs and large ranges
+        first = 2 + (idx * 37) % max(1, len(vlan_ids) // 2)
+        last = min(first + len(vlan_ids) // 2, len(vlan_ids) + 1)
+        intf_manifest[label] = {
+            "description": f"Trunk {idx}",
+            "state": "up",
+            "mtu": 9216,
+            "portmode": "trunk",
+            "tagged": [f"{first}:{last}"] + rand.sample(sorted(vlan_manifest), min(5, len(vlan_manifest)))
+        }
+
+    for idx, label in enumerate(access_ports):
+        intf_manifest[label] = {
+            "description": f"Host {idx}",
+            "state": "up" if rand.random() < 0.8 else "down",
+            "portmode": "hybrid" if rand.random() < 0.5 else "access",
+            "untagged": rand.choice(sorted(vlan_manifest)),
+            "stp": {"edgeport": True}
+        }
+        if rand.random() < 0.3:
+            intf_manifest[label]["mtu"] = 9216
+
+    for pc in range(1, port_channels + 1):
+        members = lacp_ports[(pc - 1) * lacp_members:pc * lacp_members]
+        for member in members:
+            intf_manifest[member] = {"description": f"Po{pc} member", "state": "up", "mtu": 9216}
+
+        intf_manifest[f"Port-channel {pc}"] = {
+            "description": f"Uplink LAG {pc}",
+            "state": "up",
+            "mtu": 9216,
+            "portmode": "trunk",
+            "tagged": [f"{sorted(vlan_manifest)[0]}:{sorted(vlan_manifest)[-1]}"],
+            "lacp-rate": "fast",
+            "lacp-members-active": members,
+            "mlag": f"Port-channel {pc}"
+        }
+
+    # Render the running config from the manifest, with drift
+    port_order = {label: pos for pos, label in enumerate(port_labels)}
+    pc_labels = [f"Port-channel {pc}" for pc in range(1, port_channels + 1)]
+    for pos, label in enumerate(pc_labels):
+        port_order[label] = len(port_labels) + pos
+
+    lines = [
+        "Current Configuration ...",
+        "! Version 9.14(2.4)",
+        "!",
+        "boot system stack-unit 1 primary system://A",
+        "boot system stack-unit 1 secondary system://B",
+        "!",
+        "hostname SYNTH-SW",
+        "!",
+        "protocol lldp",
+        "!",
+        "redundancy auto-synchronize full",
+        "!"
+    ]
+    lines += [f"stack-unit {unit} provision S4048-ON" for unit in range(1, stack_units + 1)]
+    lines.append("!")
+    lines += stack_lines
+    lines.append("!")
+
+    vlan_members = {}  # vlan id -> {mode: [members]}
+
+    for label in port_labels:
+        fields = intf_manifest.get(label, {})
+        block = []
+
+        if "description" in fields and not drifted():
+            block.append(f"description {fields['description']}")
+        block.append("no ip address")
+        if "mtu" in fields and not drifted():
+            block.append(f"mtu {fields['mtu']}")
+        if fields.get("portmode") == "hybrid" and not drifted():
+            block.append("portmode hybrid")
+        if "portmode" in fields and not drifted():
+            block.append("switchport")
+        if fields.get("stp", {}).get("edgeport") and not drifted():
+            block.append("spanning-tree rstp edge-port")
+
+        if label in lacp_ports and not drifted():
+            pc = lacp_ports.index(label) // lacp_members + 1
+            block += ["!", "port-channel-protocol LACP", f" port-channel {pc} mode active"]
+
+        block.append("no shutdown" if fields.get("state") == "up" and not drifted() else "shutdown")
+
+        lines.append(f"interface {label}")
+        lines += [f" {line}" for line in block]
+        lines.append("!")
+
+        for vlan_id in expand_tagged(fields.get("tagged", [])):
+            if not drifted():
+                vlan_members.setdefault(vlan_id, {}).setdefault("tagged", []).append(label)
+        if "untagged" in fields and not drifted():
+            vlan_members.setdefault(fields["untagged"], {}).setdefault("untagged", []).append(label)
+        if drifted() and "portmode" in fields:
+            # stale membership
+            vlan_members.setdefault(rand.choice(vlan_ids), {}).setdefault("tagged", []).append(label)
+
+    lines += ["interface ManagementEthernet 1/1", " ip address 10.80.1.1/16", " no shutdown", "!"]
+
+    for label in pc_labels:
+        fields = intf_manifest[label]
+        block = [f"description {fields['description']}", "no ip address", f"mtu {fields['mtu']}", "switchport"]
+        if not drifted():
+            block.append("lacp fast-switchover")
+        block += [f"vlt-peer-lag {fields['mlag'].lower()}", "no shutdown"]
+
+        lines.append(f"interface {label}")
+        lines += [f" {line}" for line in block]
+        lines.append("!")
+
+        for vlan_id in expand_tagged(fields["tagged"]):
+            if not drifted():
+                vlan_members.setdefault(vlan_id, {}).setdefault("tagged", []).append(label)
+
+    # a stale port-channel and VLAN for the cleanup
+    lines += ["interface Port-channel 999", " no ip address", " shutdown", "!"]
+
+    for vlan_id in [1] + sorted(vlan_manifest) + [4094]:
+        fields = vlan_manifest.get(vlan_id, {})
+        block = []
+
+        if "name" in fields and not drifted():
+            block.append(f"name {fields['name']}")
+        if "description" in fields and not drifted():
+            block.append(f"description {fields['description']}")
+        block.append("no ip address")
+
+        for mode in ["tagged", "untagged"]:
+            for range_str in compress_members(vlan_members.get(vlan_id, {}).get(mode, []), port_order):
+                block.append(f"{mode} {range_str}")
+
+        # the manifest has no state for VLANs, so they are shut down
+        block.append("shutdown" if not drifted() else "no shutdown")
+
+        lines.append(f"interface Vlan {vlan_id}")
+        lines += [f" {line}" for line in block]
+        lines.append("!")
+
+    lines += [
+        "protocol spanning-tree rstp",
+        " no disable",
+        "!",
+        "vlt domain 1",
+        " peer-link port-channel 100",
+        " back-up destination 10.80.1.2",
+        " unit-id 0",
+        "!",
+        "ip ssh server enable",
+        "ip ssh connection-rate-limit 60",
+        "!",
+        "end"
+    ]
+
+    return "\n".join(lines) + "\n", intf_manifest, vlan_manifest
+
+def render_manifest(interfaces, vlans, hostname="SYNTH-SW", drift=0.1, seed=0):
+    """
+    Renders a running config for an existing manifest (e.g. host_vars/HOST/interfaces.yaml), with drift
+    Only the interfaces of the manifest are rendered, autoneg and managed fields are left out.
+
+    :param interfaces: Interface manifest
+    :type interfaces: dict
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param hostname: Hostname of the switch
+    :type hostname: str
+    :param drift: Fraction of attributes where the running config differs from the manifest
+    :type drift: float
+    :param seed: Random seed, the same manifest and seed always give the same output
+    :type seed: int or str
+    :return: Running config text
+    :rtype: str
+    """
+
+    dell_os9 = os9_site.load_plugin()
+    rand = random.Random(seed)
+
+    def drifted():
+        return rand.random() < drift
+
+    manifest = dell_os9.OS9_COMPILEMANIFEST(interfaces, vlans)["manifest"]
+
+    # running config label of every manifest entry of a known type
+    labels = {}
+    for key in manifest:
+        port_id = dell_os9.intf_id(key)
+        if port_id is not None and port_id.type in dell_os9.intf_type_names:
+            labels[key] = f"{dell_os9.intf_type_names[port_id.type]} {'/'.join(str(i) for i in port_id.numbers)}"
+
+    ordered = sorted(labels, key=dell_os9.intf_id)
+
+    # fanned out ports are replaced by their subports, unless the fanout drifted
+    stack_lines = []
+    skipped = set()
+    for key in ordered:
+        fanout = manifest[key].get("fanout")
+        if fanout is None:
+            continue
+
+        numbers = dell_os9.intf_id(key).numbers
+        subports = {other for other in ordered if dell_os9.intf_id(other).numbers[:-1] == numbers}
+        if not drifted():
+            stack_lines.append(f"stack-unit {numbers[0]} port {numbers[1]} portmode {fanout['type']} "
+                               f"speed {fanout['speed']}")
+            skipped.add(key)
+        else:
+            skipped |= subports
+
+    physical = [key for key in ordered if key not in skipped and
+                dell_os9.intf_id(key).type in dell_os9.physical_intf_types]
+    port_channels = [key for key in ordered if dell_os9.intf_id(key).type in dell_os9.lag_intf_types]
+    vlan_intfs = [key for key in ordered if dell_os9.intf_id(key).type in dell_os9.vlan_intf_types]
+
+    port_order = {labels[key]: pos for pos, key in enumerate(physical + port_channels)}
+
+    lacp_modes = {}  # member key -> (port-channel number, mode)
+    for key in port_channels:
+        for field, mode in (("lacp-members-active", "active"), ("lacp-members-passive", "passive")):
+            for member in manifest[key].get(field, []):
+                lacp_modes[dell_os9.intf_id(member)] = (dell_os9.intf_id(key).numbers[-1], mode)
+
+    vlan_members = {}  # vlan id -> {mode: [members]}
+
+    def render_intf(key):
+        fields = manifest[key]
+        block = []
+
+        if "description" in fields and not drifted():
+            block.append(f"description {fields['description']}")
+        if "ip4" in fields and not drifted():
+            block.append(f"ip address {fields['ip4']}")
+        else:
+            block.append("no ip address")
+        if "ip6" in fields and not drifted():
+            block.append(f"ipv6 address {fields['ip6']}")
+        if "mtu" in fields and not drifted():
+            block.append(f"mtu {fields['mtu']}")
+        if fields.get("portmode") == "hybrid" and not drifted():
+            block.append("portmode hybrid")
+        if "portmode" in fields and not drifted():
+            block.append("switchport")
+        if fields.get("fec") is False and not drifted():
+            block.append("no fec enable")
+
+        stp = fields.get("stp", {})
+        if stp.get("disabled") and not drifted():
+            block.append("no spanning-tree")
+        for stp_type in ["rstp", "pvst", "mstp"]:
+            if stp.get("edgeport") and not drifted():
+                bpduguard = " bpduguard shutdown-on-violation" if stp.get("bpduguard") else ""
+                block.append(f"spanning-tree {stp_type} edge-port{bpduguard}")
+            for guard in ["rootguard", "loopguard"]:
+                if stp.get(guard) and not drifted():
+                    block.append(f"spanning-tree {stp_type} {guard}")
+
+        for member in fields.get("lag-members", []):
+            if not drifted():
+                block.append(f"channel-member {labels.get(member, member)}")
+        if fields.get("lacp-rate") == "fast" and not drifted():
+            block.append("lacp fast-switchover")
+        if "mlag" in fields and not drifted():
+            block.append(f"vlt-peer-lag {fields['mlag'].lower()}")
+
+        lacp_mode = lacp_modes.get(dell_os9.intf_id(key))
+        if lacp_mode is not None and not drifted():
+            block += ["!", "port-channel-protocol LACP", f" port-channel {lacp_mode[0]} mode {lacp_mode[1]}"]
+
+        block.append("no shutdown" if fields.get("state") == "up" and not drifted() else "shutdown")
+
+        for vlan_id in expand_tagged(fields.get("tagged", [])):
+            if not drifted():
+                vlan_members.setdefault(vlan_id, {}).setdefault("tagged", []).append(labels[key])
+        if "untagged" in fields and not drifted():
+            vlan_members.setdefault(fields["untagged"], {}).setdefault("untagged", []).append(labels[key])
+        if "portmode" in fields and drifted():
+            # stale membership
+            vlan_members.setdefault(rand.choice(sorted(vlans)), {}).setdefault("tagged", []).append(labels[key])
+
+        return [f"interface {labels[key]}"] + [f" {line}" for line in block] + ["!"]
+
+    units = sorted({dell_os9.intf_id(key).numbers[0] for key in physical} or {1})
+
+    lines = [
+        "Current Configuration ...",
+        "! Version 9.14(2.4)",
+        "!",
+        f"hostname {hostname}",
+        "!",
+        "protocol lldp",
+        "!"
+    ]
+    lines += [f"stack-unit {unit} provision S4048-ON" for unit in units]
+    lines.append("!")
+    lines += stack_lines
+    lines.append("!")
+
+    for key in physical:
+        lines += render_intf(key)
+
+    lines += ["interface ManagementEthernet 1/1", " ip address 10.80.1.1/16", " no shutdown", "!"]
+
+    for key in port_channels:
+        lines += render_intf(key)
+
+    # a stale port-channel and VLAN for the cleanup
+    if "Port-channel 999" not in port_order:
+        lines += ["interface Port-channel 999", " no ip address", " shutdown", "!"]
+    stale_vlans = [vlan_id for vlan_id in [4093] if vlan_id not in vlans]
+
+    for vlan_id in sorted({1} | {dell_os9.intf_id(key).numbers[-1] for key in vlan_intfs} | set(stale_vlans)):
+        key = f"Vlan {vlan_id}"
+        fields = manifest.get(key, {})
+        block = []
+
+        if "name" in fields and not drifted():
+            block.append(f"name {fields['name']}")
+        if "description" in fields and not drifted():
+            block.append(f"description {fields['description']}")
+        if "ip4" in fields and not drifted():
+            block.append(f"ip address {fields['ip4']}")
+        else:
+            block.append("no ip address")
+
+        for mode in ["tagged", "untagged"]:
+            for range_str in compress_members(vlan_members.get(vlan_id, {}).get(mode, []), port_order):
+                block.append(f"{mode} {range_str}")
+
+        block.append("no shutdown" if fields.get("state") == "up" and not drifted() else "shutdown")
+
+        lines.append(f"interface {key}")
+        lines += [f" {line}" for line in block]
+        lines.append("!")
+
+    lines += [
+        "protocol spanning-tree rstp",
+        " no disable",
+        "!",
+        "ip ssh server enable",
+        "ip ssh connection-rate-limit 60",
+        "!",
+        "end"
+    ]
+
+    return "\n".join(lines) + "\n"
+
+def expand_tagged(tagged):
+    """
+    Expands a manifest tagged list (which allows "1000:1010" ranges) into VLAN IDs
+
+    :param tagged: Manifest tagged list
+    :type tagged: list
+    :return: List of VLAN IDs
+    :rtype: list
+    """
+
+    out = []
+
+    for item in tagged:
+        item_parts = str(item).split(":")
+        if len(item_parts) == 1:
+            out.append(int(item_parts[0]))
+        else:
+            out += list(range(int(item_parts[0]), int(item_parts[1]) + 1))
+
+    return out
+
+def generate_tier(tier, seed=0):
+    """
+    Generates a running config and manifest of one of the size tiers
+
+    :param tier: Name of the tier (see TIERS)
+    :type tier: str
+    :param seed: Random seed
+    :type seed: int
+    :return: Tuple of <running config text>,<interfaces manifest>,<vlans manifest>
+    :rtype: tuple
+    """
+
+    return generate(seed=seed, **TIERS[tier])
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic OS9 running config and manifest")
+    parser.add_argument("--tier", default="medium", choices=list(TIERS), help="size tier (default: medium)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--config-out", required=True, help="file to write the running config to")
+    parser.add_argument("--manifest-out", required=True, help="file to write the manifest (interfaces and vlans) to")
+    args = parser.parse_args()
+
+    conf_text, interfaces, vlans = generate_tier(args.tier, args.seed)
+
+    with open(args.config_out, "w") as f:
+        f.write(conf_text)
+
+    with open(args.manifest_out, "w") as f:
+        yaml.safe_dump({"interfaces": interfaces, "vlans": vlans}, f, sort_keys=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Validates the manifests of the OS9 switches without connecting to them
+
+Checks group_vars/all/vlans.yaml and host_vars/HOST/interfaces.yaml of every switch against a JSON schema of the
+fields the filters understand, plus what a schema can't express (interface labels the filters can parse, fields that
+only apply to some interface types, the same interface written twice). Every problem of every file is reported in
+one pass, so a bad manifest fails before the playbook gathers the running configs of the fleet.
+
+Example:
+    helpers/os9_validate.py
+    helpers/os9_validate.py --limit OCT-CORE-1,OCT-CORE-2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import jsonschema
+
+import os9_site
+
+# Interface label as written in the running config (e.g. "TenGigabitEthernet 1/1"), or a short form
+INTF_LABEL_SCHEMA = {"type": "string", "pattern": r"^\s*[A-Za-z][A-Za-z-]*\s*[0-9]+(/[0-9]+)*\s*$"}
+
+INTF_LIST_SCHEMA = {"type": "array", "items": INTF_LABEL_SCHEMA}
+
+VLAN_ID_SCHEMA = {"type": "integer", "minimum": 2, "maximum": 4094}
+
+# Fields of an entry of "interfaces", see "Available Fields" in the README
+INTERFACE_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "state": {"enum": ["up", "down"]},
+        "mtu": {"type": "integer", "minimum": 576, "maximum": 9416},
+        "fec": {"type": "boolean"},
+        "autoneg": {"type": "boolean"},
+        "managed": {"type": "boolean"},
+        # "tagged" is an older spelling of "trunk", the filters only tell "hybrid" apart
+        "portmode": {"enum": ["access", "trunk", "hybrid", "tagged"]},
+        "untagged": VLAN_ID_SCHEMA,
+        "tagged": {
+            "type": "array",
+            "items": {
+                "anyOf": [
+                    VLAN_ID_SCHEMA,
+                    {"type": "string", "pattern": r"^[0-9]+:[0-9]+$"}
+                ]
+            }
+        },
+        "ip4": {"type": "string", "pattern": r"^[0-9]{1,3}(\.[0-9]{1,3}){3}/[0-9]{1,2}$"},
+        "ip6": {"type": "string"},
+        "lag-members": INTF_LIST_SCHEMA,
+        "lacp-members-active": INTF_LIST_SCHEMA,
+        "lacp-members-passive": INTF_LIST_SCHEMA,
+        "lacp-rate": {"enum": ["fast", "slow"]},
+        "mlag": INTF_LABEL_SCHEMA,
+        # kind of port-channel, only a note for the reader, the filters go by the member fields
+        "mode": {"enum": ["lacp", "normal"]},
+        "fanout": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["type", "speed"],
+            "properties": {
+                "type": {"enum": ["single", "dual", "quad"]},
+                "speed": {"type": "string", "pattern": r"^[0-9]+G$"}
+            }
+        },
+        "stp": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "disabled": {"type": "boolean"},
+                "edgeport": {"type": "boolean"},
+                "bpduguard": {"type": "boolean"},
+                "rootguard": {"type": "boolean"},
+                "loopguard": {"type": "boolean"}
+            }
+        }
+    }
+}
+
+# Fields of an entry of "vlans"
+VLAN_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "managed": {"type": "boolean"}
+    }
+}
+
+# Fields that only apply to some interface types, field -> (types, what the types are called in the message)
+TYPE_FIELDS = {
+    "autoneg": ("physical_intf_types", "physical interfaces"),
+    "fec": ("physical_intf_types", "physical interfaces"),
+    "fanout": ("physical_intf_types", "physical interfaces"),
+    "lag-members": ("lag_intf_types", "port-channels"),
+    "lacp-members-active": ("lag_intf_types", "port-channels"),
+    "lacp-members-passive": ("lag_intf_types", "port-channels"),
+    "lacp-rate": ("lag_intf_types", "port-channels"),
+    "mlag": ("lag_intf_types", "port-channels"),
+    "mode": ("lag_intf_types", "port-channels")
+}
+
+# Validators are compiled once per schema and reused for every entry of every file
+_validators = {}
+
+def get_validator(schema):
+    """
+    Returns the compiled validator of a schema, checking the schema itself the first time
+
+    :param schema: JSON schema
+    :type schema: dict
+    :return: Validator
+    :rtype: jsonschema.protocols.Validator
+    """
+
+    validator = _validators.get(id(schema))
+
+    if validator is None:
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        validator = validator_class(schema)
+        _validators[id(schema)] = validator
+
+    return validator
+
+def schema_errors(schema, instance, where):
+    """
+    Validates an instance against a schema
+
+    :param schema: JSON schema
+    :type schema: dict
+    :param instance: Manifest entry
+    :type instance: any
+    :param where: Location of the entry, prefixed to every error
+    :type where: str
+    :return: List of errors
+    :rtype: list
+    """
+
+    errors = []
+
+    for error in sorted(get_validator(schema).iter_errors(instance), key=lambda e: list(e.path)):
+        path = "/".join(str(part) for part in error.path)
+        errors.append(f"{where}{'/' + path if path else ''}: {error.message}")
+
+    return errors
+
+def validate_vlans(vlans, path):
+    """
+    Validates the VLAN manifest
+
+    :param vlans: VLAN manifest
+    :type vlans: dict
+    :param path: Path of the manifest, for the errors
+    :type path: str
+    :return: List of errors
+    :rtype: list
+    """
+
+    if not isinstance(vlans, dict):
+        return [f"{path}: vlans: must be a mapping of VLAN ID -> fields"]
+
+    errors = []
+
+    for vlan_id, fields in vlans.items():
+        where = f"{path}: vlans/{vlan_id}"
+        if not isinstance(vlan_id, int) or isinstance(vlan_id, bool) or not 1 <= vlan_id <= 4094:
+            errors.append(f"{where}: VLAN ID must be an integer 1-4094")
+
+        errors += schema_errors(VLAN_SCHEMA, fields, where)
+
+    return errors
+
+def validate_interfaces(interfaces, path):
+    """
+    Validates the interface manifest of a switch
+
+    :param interfaces: Interface manifest
+    :type interfaces: dict
+    :param path: Path of the manifest, for the errors
+    :type path: str
+    :return: List of errors
+    :rtype: list
+    """
+
+    if not isinstance(interfaces, dict):
+        return [f"{path}: interfaces: must be a mapping of interface label -> fields"]
+
+    dell_os9 = os9_site.load_plugin()
+    errors = []
+    seen = {}  # interface ID -> label as written
+
+    for intf, fields in interfaces.items():
+        where = f"{path}: interfaces/{intf}"
+
+        errors += schema_errors(INTERFACE_SCHEMA, fields, where)
+
+        port_id = dell_os9.intf_id(intf) if isinstance(intf, str) else None
+        if port_id is None or port_id.type == dell_os9.OS9IntfType.OTHER:
+            errors.append(f"{where}: not a label of a known interface type")
+            continue
+
+        if port_id in seen:
+            errors.append(f"{where}: same interface as {seen[port_id]}")
+        seen[port_id] = intf
+
+        if not isinstance(fields, dict):
+            continue
+
+        for field, (types_name, types_label) in TYPE_FIELDS.items():
+            if field in fields and port_id.type not in getattr(dell_os9, types_name):
+                errors.append(f"{where}/{field}: only applies to {types_label}")
+
+        tagged = fields.get("tagged")
+        if isinstance(tagged, list):
+            for idx, tag in enumerate(tagged):
+                if not isinstance(tag, str) or ":" not in tag:
+                    continue
+
+                # the schema checks the A:B form, the range itself is checked here
+                first_vlan, _, last_vlan = tag.partition(":")
+                if not first_vlan.isdigit() or not last_vlan.isdigit() or \
+                        not 2 <= int(first_vlan) <= int(last_vlan) <= 4094:
+                    errors.append(f"{where}/tagged/{idx}: {tag} is not a VLAN range A:B with 2 <= A <= B <= 4094")
+
+        for field in ("lag-members", "lacp-members-active", "lacp-members-passive"):
+            members = fields.get(field)
+            if not isinstance(members, list):
+                continue
+
+            for member in members:
+                member_id = dell_os9.intf_id(member) if isinstance(member, str) else None
+                if member_id is None or member_id.type not in dell_os9.physical_intf_types:
+                    errors.append(f"{where}/{field}: {member} is not a physical interface")
+
+    return errors
+
+def validate_site(hosts, repo_dir=os9_site.REPO_DIR):
+    """
+    Validates the VLAN manifest and the interface manifest of every host that has one
+
+    :param hosts: Inventory hostnames
+    :type hosts: list
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Tuple of <list of errors>,<number of files checked>
+    :rtype: tuple
+    """
+
+    errors = []
+    checked = 0
+
+    vlans_path = os.path.join("group_vars", "all", "vlans.yaml")
+    try:
+        vlans = os9_site.load_vlans(repo_dir)
+    except Exception as e:
+        errors.append(f"{vlans_path}: {e.__class__.__name__}: {e}")
+    else:
+        errors += validate_vlans(vlans, vlans_path)
+    checked += 1
+
+    for host in hosts:
+        intf_path = os.path.join("host_vars", host, "interfaces.yaml")
+        try:
+            interfaces = os9_site.load_interfaces(host, repo_dir)
+        except Exception as e:
+            errors.append(f"{intf_path}: {e.__class__.__name__}: {e}")
+            checked += 1
+            continue
+
+        if interfaces is None:
+            continue
+
+        errors += validate_interfaces(interfaces, intf_path)
+        checked += 1
+
+    return errors, checked
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the OS9 switch manifests")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts to validate")
+    args = parser.parse_args()
+
+    hosts = list(os9_site.load_inventory(args.inventory))
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    start = time.perf_counter()
+    errors, checked = validate_site(hosts)
+    elapsed = time.perf_counter() - start
+
+    for error in errors:
+        print(f"ERROR: {error}")
+
+    print(f"{checked} manifests checked in {elapsed:.3f}s, {len(errors)} errors")
+
+    return 1 if len(errors) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Splits a fleet-wide run into waves that never change both switches of a VLT pair at the same time
+
+The VLT pairs are found from the manifests: two switches of the same inventory group whose port-channels have the
+same set of "mlag" peer port-channels, the closest hostnames winning if several switches match. A "vlt_peer" host
+var in the inventory sets the peer explicitly. Each pair is split over two waves, the other switches go wherever
+they finish first, so a fleet-wide run takes at most two waves. With the offline plans (see os9_plan.py) each switch
+is weighted by the number of pushes it needs and the heavier switch of each pair goes into the first wave, which
+keeps the critical path (the sum of the longest fork lane of every wave) as short as possible.
+
+Example:
+    helpers/os9_waves.py --plans plans/
+    helpers/os9_waves.py --limits | while read hosts; do ansible-playbook deploy.yaml --limit "$hosts" || break; done
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import os9_site
+
+# Pushes every switch needs at least, gathering the running config
+BASE_PUSHES = 1
+
+def mlag_peers(interfaces):
+    """
+    Returns the peer port-channels (the "mlag" fields) of an interface manifest
+
+    :param interfaces: Interface manifest
+    :type interfaces: dict
+    :return: Set of lowercase port-channel labels
+    :rtype: frozenset
+    """
+
+    return frozenset(fields["mlag"].lower() for fields in interfaces.values()
+                     if isinstance(fields, dict) and "mlag" in fields)
+
+def find_pairs(inventory, repo_dir=os9_site.REPO_DIR):
+    """
+    Finds the VLT pairs of the inventory
+
+    :param inventory: Parsed inventory, as returned by os9_site.load_inventory
+    :type inventory: dict
+    :param repo_dir: Root of the site
+    :type repo_dir: str
+    :return: Tuple of <dict of host -> peer host, both ways>,<list of problems>
+    :rtype: tuple
+    """
+
+    peers = {}
+    problems = []
+
+    # explicit peers first
+    for host, host_info in inventory.items():
+        peer = host_info["vars"].get("vlt_peer")
+        if peer is None:
+            continue
+
+        if peer not in inventory or peer == host:
+            problems.append(f"{host}: vlt_peer {peer} is not another host of the inventory")
+            continue
+
+        for a, b in ((host, peer), (peer, host)):
+            if peers.get(a, b) != b:
+                problems.append(f"{a}: VLT peer is both {peers[a]} and {b}")
+            peers.setdefault(a, b)
+
+    mlags = {}
+    for host in inventory:
+        if host in peers:
+            continue
+
+        interfaces = os9_site.load_interfaces(host, repo_dir)
+        if interfaces is not None and len(mlag_peers(interfaces)) > 0:
+            mlags[host] = mlag_peers(interfaces)
+
+    def best_match(host):
+        groups = set(inventory[host]["groups"])
+        candidates = [other for other in mlags if other != host and mlags[other] == mlags[host] and
+                      not groups.isdisjoint(inventory[other]["groups"])]
+        if len(candidates) == 0:
+            return None
+
+        scores = {other: len(os.path.commonprefix([host, other])) for other in candidates}
+        best = max(scores.values())
+        best_candidates = [other for other, score in scores.items() if score == best]
+
+        return best_candidates[0] if len(best_candidates) == 1 else None
+
+    matches = {host: best_match(host) for host in mlags}
+
+    for host, peer in matches.items():
+        if peer is not None and matches.get(peer) == host:
+            peers[host] = peer
+        else:
+            problems.append(f"{host}: has mlag port-channels but no unambiguous VLT peer, set vlt_peer in the inventory")
+
+    return peers, problems
+
+def load_weights(plan_dir, hosts):
+    """
+    Weights every host by the number of pushes its offline plan needs (block push mode)
+
+    :param plan_dir: Directory with the offline plans (summary.json), or None to weigh every host the same
+    :type plan_dir: str
+    :param hosts: Inventory hostnames
+    :type hosts: list
+    :return: Dict of host -> number of pushes
+    :rtype: dict
+    """
+
+    weights = {host: BASE_PUSHES for host in hosts}
+    if plan_dir is None:
+        return weights
+
+    with open(os.path.join(plan_dir, "summary.json")) as f:
+        summary = json.load(f)["hosts"]
+
+    for host in hosts:
+        result = summary.get(host, {})
+        if result.get("status") != "planned":
+            continue
+
+        weights[host] += result["manifest_blocks"]
+        if result["fanout_lines"] > 0:
+            weights[host] += 1
+        if result["clean_lines"] > 0:
+            weights[host] += 1
+
+    return weights
+
+def wave_lanes(wave, weights, forks):
+    """
+    Spreads the hosts of a wave over the forks, longest first, like Ansible takes the next host when a fork is free
+
+    :param wave: Hosts of the wave
+    :type wave: list
+    :param weights: Dict of host -> weight
+    :type weights: dict
+    :param forks: Number of forks, 0 for as many as there are hosts
+    :type forks: int
+    :return: List of lanes, each a tuple of <total weight>,<list of hosts>
+    :rtype: list
+    """
+
+    lane_count = len(wave) if forks == 0 else min(forks, len(wave))
+    lanes = [(0, []) for _ in range(lane_count)]
+
+    for host in sorted(wave, key=lambda host: -weights[host]):
+        idx = min(range(lane_count), key=lambda idx: lanes[idx][0])
+        lanes[idx] = (lanes[idx][0] + weights[host], lanes[idx][1] + [host])
+
+    return lanes
+
+def critical_path(waves, weights, forks):
+    """
+    Returns the critical path of a rollout, the longest lane of every wave
+
+    :param waves: List of waves, each a list of hosts
+    :type waves: list
+    :param weights: Dict of host -> weight
+    :type weights: dict
+    :param forks: Number of forks, 0 for as many as there are hosts
+    :type forks: int
+    :return: Tuple of <total weight>,<list of (wave weight, hosts of the longest lane)>
+    :rtype: tuple
+    """
+
+    path = []
+
+    for wave in waves:
+        if len(wave) > 0:
+            path.append(max(wave_lanes(wave, weights, forks), key=lambda lane: lane[0]))
+
+    return sum(lane[0] for lane in path), path
+
+def plan_waves(hosts, peers, weights, forks):
+    """
+    Splits the hosts into waves, the two switches of a VLT pair always in different waves
+
+    :param hosts: Hosts of the run
+    :type hosts: list
+    :param peers: Dict of host -> VLT peer, as returned by find_pairs
+    :type peers: dict
+    :param weights: Dict of host -> weight
+    :type weights: dict
+    :param forks: Number of forks, 0 for as many as there are hosts
+    :type forks: int
+    :return: List of waves, each a list of hosts in inventory order
+    :rtype: list
+    """
+
+    run_hosts = set(hosts)
+    pairs = []
+    singles = []
+
+    for host in hosts:
+        peer = peers.get(host)
+        if peer in run_hosts:
+            if hosts.index(host) < hosts.index(peer):
+                pairs.append(tuple(sorted((host, peer), key=lambda pair_host: -weights[pair_host])))
+        else:
+            singles.append(host)
+
+    if len(pairs) == 0:
+        return [list(hosts)]
+
+    # the heavier switch of each pair first, so the second wave is as short as possible
+    waves = [[heavy for heavy, _ in pairs], [light for _, light in pairs]]
+
+    for host in sorted(singles, key=lambda host: -weights[host]):
+        options = [[wave + [host] if idx == pick else wave for idx, wave in enumerate(waves)] for pick in (0, 1)]
+        waves = min(options, key=lambda option: critical_path(option, weights, forks)[0])
+
+    # with limited forks the heavier half isn't always best, swap pairs while that shortens the critical path
+    improved = True
+    while improved:
+        improved = False
+        for heavy, light in pairs:
+            swap = {heavy: light, light: heavy}
+            swapped = [[swap.get(host, host) for host in wave] for wave in waves]
+            if critical_path(swapped, weights, forks)[0] < critical_path(waves, weights, forks)[0]:
+                waves = swapped
+                improved = True
+
+    return [[host for host in hosts if host in wave] for wave in waves if len(wave) > 0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a fleet-wide run into VLT safe waves")
+    parser.add_argument("--inventory", default=None, help="inventory file (default: hosts of the site)")
+    parser.add_argument("--limit", default=None, help="comma separated list of hosts to roll out to")
+    parser.add_argument("--plans", default=None,
+                        help="directory with offline plans (see os9_plan.py) to weigh the hosts by their pushes")
+    parser.add_argument("--forks", type=int, default=5,
+                        help="forks of ansible-playbook, 0 for unlimited (default: 5, like Ansible)")
+    parser.add_argument("--out", default=None, help="write the waves and the critical path to this JSON file")
+    parser.add_argument("--limits", action="store_true",
+                        help="only print the hosts of every wave as a --limit, one wave per line")
+    args = parser.parse_args()
+
+    inventory = os9_site.load_inventory(args.inventory)
+
+    hosts = list(inventory)
+    if args.limit is not None:
+        limit = args.limit.split(",")
+        hosts = [host for host in hosts if host in limit]
+
+    peers, problems = find_pairs(inventory)
+    weights = load_weights(args.plans, hosts)
+    waves = plan_waves(hosts, peers, weights, args.forks)
+    total, path = critical_path(waves, weights, args.forks)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "waves": waves,
+                "pairs": {host: peer for host, peer in peers.items() if host in hosts},
+                "weights": weights,
+                "critical_path": [{"weight": weight, "hosts": lane} for weight, lane in path],
+                "critical_weight": total
+            }, f, indent=2)
+
+    if args.limits:
+        for wave in waves:
+            print(",".join(wave))
+    else:
+        for idx, wave in enumerate(waves):
+            print(f"wave {idx + 1}: {len(wave)} hosts, {path[idx][0]} pushes")
+            for host in wave:
+                peer = f" (peer {peers[host]})" if host in peers else ""
+                print(f"    {host:<24} {weights[host]:>5}{peer}")
+
+        print(f"critical path: {' -> '.join(', '.join(lane) for _, lane in path)} = {total} pushes")
+
+    for problem in problems:
+        print(f"WARNING: {problem}", file=sys.stderr)
+
+    return 1 if len(problems) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())